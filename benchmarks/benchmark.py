@@ -0,0 +1,239 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Callable, Union
+
+import numpy as np
+
+# Run from the root of the repository: python -m benchmarks.benchmark [--quick] [--update-baseline]
+from environments.identification_management.Identification_management import IdentificationManagement
+from environments.identification_management.configuration import default_environment_configuration, \
+    random_environment_configuration, random_matrix_identification_factors
+from environments.identification_management.vectorized_identification_management import \
+    VectorizedIdentificationManagement
+from evaluation import play_episode, play_vectorized_episodes
+from policies.brutal import Brutal
+from policies.combination import Combination
+from policies.voracious import Voracious
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# For each metric, whether a larger value is better
+METRICS_HIGHER_IS_BETTER = {
+    'reset_seconds': False,
+    'environment_steps_per_second': True,
+    'episodes_per_second': True,
+    'vectorized_episodes_per_second': True,
+    'peak_memory_bytes_per_episode': False,
+}
+
+POLICIES = {
+    'brutal': Brutal,
+    'combination': Combination,
+    'voracious': Voracious,
+}
+
+
+def get_benchmark_configurations(quick: bool = False) -> dict:
+    # Grid of (number of messages, number of factors) with a fixed factor matrix per size, plus a few draws of
+    # random_environment_configuration. Everything is seeded so that runs are comparable.
+    grid_number_messages = [100, 1000] if quick else [100, 1000, 10000]
+    grid_number_factors = [4] if quick else [2, 4, 10]
+    number_random_configurations = 1 if quick else 3
+    generator = np.random.default_rng(0)
+
+    configurations = {}
+    for number_factors in grid_number_factors:
+        matrix_identification_factors = random_matrix_identification_factors(number_factors, generator)
+        for number_messages in grid_number_messages:
+            configuration = dict(default_environment_configuration)
+            configuration['matrix_identification_factors'] = matrix_identification_factors
+            configuration['number_messages'] = number_messages
+            configuration['maximum_energy'] = number_messages / 10
+            configurations[f'messages_{number_messages}_factors_{number_factors}'] = configuration
+
+    for index_configuration in range(number_random_configurations):
+        configuration = dict(default_environment_configuration)
+        configuration.update(random_environment_configuration(generator))
+        configurations[f'random_configuration_{index_configuration}'] = configuration
+
+    return configurations
+
+
+def measure(function: Callable, number_repeats: int, minimum_seconds: float) -> float:
+    # Best time per call over number_repeats rounds, each round calling the function until minimum_seconds elapsed
+    best_seconds_per_call = float('inf')
+    for _ in range(number_repeats):
+        number_calls = 0
+        start = time.perf_counter()
+        while True:
+            function()
+            number_calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= minimum_seconds:
+                break
+        best_seconds_per_call = min(best_seconds_per_call, elapsed / number_calls)
+    return best_seconds_per_call
+
+
+def benchmark_environment(configuration: dict, number_repeats: int, minimum_seconds: float) -> dict:
+    environment = IdentificationManagement(dict(configuration, seed=0))
+    number_factors = environment.number_identification_factors
+    index_cheapest_factor = int(np.argmin(environment.matrix_identification_factors[:, 0]))
+
+    calling_cheapest_factor = np.zeros(number_factors, dtype=np.int32)
+    calling_cheapest_factor[index_cheapest_factor] = 1
+    # Alternates a factor call and a decision, as the heuristic policies do
+    actions = [
+        {'is_real_source': 1, 'calling_identification_factors': calling_cheapest_factor},
+        {'is_real_source': 2, 'calling_identification_factors': np.zeros(number_factors, dtype=np.int32)},
+    ]
+
+    def run_environment_episode() -> int:
+        environment.reset()
+        number_steps = 0
+        terminated = False
+        while not terminated:
+            _, _, terminated, _, _ = environment.step(actions[number_steps % 2])
+            number_steps += 1
+        return number_steps
+
+    number_steps_episode = run_environment_episode()
+    seconds_per_episode = measure(run_environment_episode, number_repeats, minimum_seconds)
+
+    return {
+        'reset_seconds': measure(environment.reset, number_repeats, minimum_seconds),
+        'environment_steps_per_second': number_steps_episode / seconds_per_episode,
+        'peak_memory_bytes_per_episode': measure_peak_memory(run_environment_episode),
+    }
+
+
+def benchmark_policy(configuration: dict, policy_class: type, number_repeats: int, minimum_seconds: float,
+                     number_vectorized_episodes: int) -> dict:
+    environment = IdentificationManagement(dict(configuration, seed=0))
+    policy = policy_class(environment.observation_space, environment.action_space)
+    seconds_per_episode = measure(lambda: play_episode(environment, policy), number_repeats, minimum_seconds)
+
+    vectorized_environment = VectorizedIdentificationManagement(
+        dict(configuration, seed=0, number_environments=number_vectorized_episodes))
+    vectorized_policy = policy_class(vectorized_environment.single_observation_space,
+                                     vectorized_environment.single_action_space)
+    seconds_per_vectorized_run = measure(lambda: play_vectorized_episodes(vectorized_environment, vectorized_policy),
+                                         number_repeats, minimum_seconds)
+
+    return {
+        'episodes_per_second': 1 / seconds_per_episode,
+        'vectorized_episodes_per_second': number_vectorized_episodes / seconds_per_vectorized_run,
+    }
+
+
+def measure_peak_memory(function: Callable) -> int:
+    tracemalloc.start()
+    try:
+        function()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak_memory
+
+
+def run_benchmarks(quick: bool = False, number_repeats: int = 3, minimum_seconds: float = 0.2,
+                   number_vectorized_episodes: int = 64) -> dict:
+    results = {}
+    for name_configuration, configuration in get_benchmark_configurations(quick).items():
+        results[f'{name_configuration}/environment'] = benchmark_environment(
+            configuration, number_repeats, minimum_seconds)
+        for name_policy, policy_class in POLICIES.items():
+            results[f'{name_configuration}/{name_policy}'] = benchmark_policy(
+                configuration, policy_class, number_repeats, minimum_seconds, number_vectorized_episodes)
+        print(f'{name_configuration}: done', file=sys.stderr)
+
+    return {
+        'metadata': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'quick': quick,
+        },
+        'results': results,
+    }
+
+
+def compare_to_baseline(benchmark: dict, baseline: dict, threshold: float) -> list:
+    # A metric regresses when it is worse than the baseline by more than threshold (relative)
+    regressions = []
+    for name_case, metrics in benchmark['results'].items():
+        baseline_metrics = baseline['results'].get(name_case)
+        if baseline_metrics is None:
+            continue
+        for name_metric, value in metrics.items():
+            baseline_value = baseline_metrics.get(name_metric)
+            if baseline_value is None or baseline_value == 0:
+                continue
+            relative_change = (value - baseline_value) / baseline_value
+            if not METRICS_HIGHER_IS_BETTER[name_metric]:
+                relative_change = -relative_change
+            if relative_change < -threshold:
+                regressions.append(f'{name_case} {name_metric}: {value:.6g} against {baseline_value:.6g} in the '
+                                   f'baseline ({relative_change:+.1%})')
+    return regressions
+
+
+def save_benchmark(benchmark: dict, path: str):
+    with open(path, 'w') as file:
+        json.dump(benchmark, file, indent=4, sort_keys=True)
+
+
+def load_benchmark(path: str) -> Union[dict, None]:
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def main(arguments: Union[list, None] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the environment and the heuristic policies.')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH, help='Baseline file to compare against.')
+    parser.add_argument('--update-baseline', action='store_true', help='Write the results as the new baseline.')
+    parser.add_argument('--output', default=None, help='Also write the results to this file.')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Relative degradation of a metric above which the run fails.')
+    parser.add_argument('--quick', action='store_true', help='Smaller grid, for a fast check.')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--minimum-seconds', type=float, default=0.2)
+    arguments = parser.parse_args(arguments)
+
+    benchmark = run_benchmarks(arguments.quick, arguments.repeats, arguments.minimum_seconds)
+    print(json.dumps(benchmark['results'], indent=4, sort_keys=True))
+    if arguments.output is not None:
+        save_benchmark(benchmark, arguments.output)
+
+    if arguments.update_baseline:
+        save_benchmark(benchmark, arguments.baseline)
+        print(f'Baseline written to {arguments.baseline}')
+        return 0
+
+    baseline = load_benchmark(arguments.baseline)
+    if baseline is None:
+        print(f'No baseline at {arguments.baseline}, run with --update-baseline to create it.')
+        return 0
+
+    regressions = compare_to_baseline(benchmark, baseline, arguments.threshold)
+    if len(regressions) > 0:
+        print(f'PERFORMANCE REGRESSION: {len(regressions)} metric(s) worse than the baseline by more than '
+              f'{arguments.threshold:.0%}', file=sys.stderr)
+        for regression in regressions:
+            print(f'  {regression}', file=sys.stderr)
+        return 1
+
+    print(f'No regression above {arguments.threshold:.0%} against {arguments.baseline}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
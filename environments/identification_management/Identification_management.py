@@ -1,12 +1,22 @@
-import random
-from typing import Callable, Union
+import inspect
+import itertools
+from typing import Callable, Iterable, Iterator, Union
 import gymnasium as gym
 from gymnasium import spaces
 import numpy as np
 import warnings
 import json
 
-from environments.identification_management.configuration import default_environment_configuration
+from environments.identification_management.configuration import default_environment_configuration, \
+    EPISODE_CONFIGURATION_KEYS
+from environments.identification_management.message_sources import iterate_message_chunks
+from environments.identification_management.prefetch import EpisodePrefetcher
+from event_logging import EventLogger, json_serializer
+from instrumentation import Instrumentation
+from environments.identification_management.flat_spaces import create_flat_action_space, \
+    create_flat_observation_space, get_flat_mask_slice, get_flat_observation_size, unflatten_action, \
+    INDEX_CURRENT_ENERGY, INDEX_MAXIMUM_ENERGY, INDEX_POSITION_CURRENT_MESSAGE, INDEX_CURRENT_MESSAGE_CRITICALITY, \
+    INDEX_CURRENT_MESSAGE_TRUST, INDEX_RESPONSE_IDENTIFICATION_FACTORS
 
 
 class Message:
@@ -19,6 +29,55 @@ class Message:
         return {'criticality': self.criticality, 'trust': self.trust, 'is_real_source': self.is_real_source}
 
 
+def create_message_columns(message_configuration: Callable, number_messages: int,
+                           generator: np.random.Generator) -> dict:
+    # A message configuration taking (number_messages, generator) returns the columns directly, a configuration
+    # without parameter describes a single message and is called once per message (it is not seeded by the
+    # environment).
+    if len(inspect.signature(message_configuration).parameters) > 0:
+        columns = message_configuration(number_messages, generator)
+        return {
+            'criticality': np.asarray(columns['criticality'], dtype=np.float64),
+            'trust': np.asarray(columns['trust'], dtype=np.float64),
+            'is_real_source': np.asarray(columns['is_real_source'], dtype=bool),
+        }
+
+    messages = [message_configuration() for _ in range(number_messages)]
+    return {
+        'criticality': np.fromiter((message['criticality'] for message in messages), dtype=np.float64,
+                                   count=number_messages),
+        'trust': np.fromiter((message['trust'] for message in messages), dtype=np.float64, count=number_messages),
+        'is_real_source': np.fromiter((message['is_real_source'] for message in messages), dtype=bool,
+                                      count=number_messages),
+    }
+
+
+def create_seed_sequence(seed: Union[int, np.random.SeedSequence, None]) -> np.random.SeedSequence:
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    return np.random.SeedSequence(seed)
+
+
+def spawn_episode_seed_sequences(episode_seed_sequence: np.random.SeedSequence) -> Iterator:
+    # (None, seed sequence) of the next episodes played without seed: the children reset would spawn from now on,
+    # built as SeedSequence.spawn builds them but without spawning them. reset spawns the child of each episode it
+    # plays, the children prefetched and dropped (the prefetcher closed by a schedule or a seeded reset) are then
+    # built again by the next prefetcher.
+    first_index = episode_seed_sequence.n_children_spawned
+    return ((None, np.random.SeedSequence(episode_seed_sequence.entropy,
+                                          spawn_key=episode_seed_sequence.spawn_key + (index,),
+                                          pool_size=episode_seed_sequence.pool_size))
+            for index in itertools.count(first_index))
+
+
+def get_episode_seed_sequences(seeds: Iterable) -> Iterator:
+    # (seed, seed sequence) of the episodes played with reset(seed=seed), one per seed
+    for seed in seeds:
+        if not isinstance(seed, (int, np.integer)):
+            raise ValueError(f'Only integer seeds can be scheduled, not {seed!r}.')
+        yield seed, np.random.SeedSequence(seed).spawn(2)[0].spawn(1)[0]
+
+
 class IdentificationManagement(gym.Env):
     def __init__(self, environment_configuration=None):
         if environment_configuration is None:
@@ -29,7 +88,9 @@ class IdentificationManagement(gym.Env):
         )
 
         self.current_action: Union[dict, None] = None
-        self.messages: Union[list[Message], None] = None
+        self.messages_criticality: Union[np.ndarray, None] = None
+        self.messages_trust: Union[np.ndarray, None] = None
+        self.messages_is_real_source: Union[np.ndarray, None] = None
         self.message_configuration: Callable = environment_configuration.get(
             'message_configuration', default_environment_configuration['message_configuration']
         )
@@ -38,14 +99,84 @@ class IdentificationManagement(gym.Env):
             'matrix_identification_factors', default_environment_configuration['matrix_identification_factors'])
         self.number_identification_factors: int = self.matrix_identification_factors.shape[0]
         self.response_identification_factors: Union[np.ndarray, None] = None
-        self.number_messages: int = environment_configuration.get(
+        self.number_messages: Union[int, None] = environment_configuration.get(
             'number_messages', default_environment_configuration['number_messages'])
         self.position_current_message: Union[int, None] = None
-        self.current_message: Union[Message, None] = None
+
+        # Streaming mode: the messages are pulled lazily from message_source (see message_sources), the message
+        # arrays then only hold the current chunk, starting at the position chunk_offset of the episode, and
+        # next_chunk is read ahead to know whether the current message is the last one. The episode ends when the
+        # source is exhausted or after number_messages messages when it is given.
+        self.message_source = environment_configuration.get(
+            'message_source', default_environment_configuration['message_source'])
+        self.message_read_ahead: int = environment_configuration.get(
+            'message_read_ahead', default_environment_configuration['message_read_ahead'])
+        self.message_stream = None
+        self.next_chunk: Union[dict, None] = None
+        self.chunk_offset: int = 0
+        self.message_index: Union[int, None] = None
+        if self.message_source is None and self.number_messages is None:
+            raise ValueError('number_messages can only be None when a message_source is given.')
         self.maximum_energy: float = environment_configuration.get(
             'maximum_energy', default_environment_configuration['maximum_energy'])
         self.current_energy: Union[float, None] = None
 
+        # Padded mode: the observation and the action have maximum_number_identification_factors factors whatever the
+        # number of factors of the matrix. The padding factors have zero rows in the observed matrix and zero
+        # responses, valid_identification_factors tells them apart, and calling them does nothing. With a
+        # configuration_sampler (a callable taking a generator and returning some of EPISODE_CONFIGURATION_KEYS, e.g.
+        # random_episode_configuration), reset draws the configuration of each episode, the keys it does not return
+        # keep the values of environment_configuration. A single policy is then trained on a distribution of
+        # configurations.
+        self.maximum_number_identification_factors: Union[int, None] = environment_configuration.get(
+            'maximum_number_identification_factors',
+            default_environment_configuration['maximum_number_identification_factors'])
+        self.number_observed_identification_factors: int = self.number_identification_factors
+        if self.maximum_number_identification_factors is not None:
+            self.number_observed_identification_factors = self.maximum_number_identification_factors
+        if self.number_identification_factors > self.number_observed_identification_factors:
+            raise ValueError(f'The matrix has {self.number_identification_factors} identification factors, more than '
+                             f'maximum_number_identification_factors ({self.maximum_number_identification_factors}).')
+        self.configuration_sampler: Union[Callable, None] = environment_configuration.get(
+            'configuration_sampler', default_environment_configuration['configuration_sampler'])
+        self.base_episode_configuration: dict = {
+            'matrix_identification_factors': self.matrix_identification_factors,
+            'number_messages': self.number_messages,
+            'maximum_energy': self.maximum_energy,
+            'message_configuration': self.message_configuration,
+        }
+        self.observed_matrix_identification_factors: np.ndarray = self.matrix_identification_factors
+        self.valid_identification_factors: Union[np.ndarray, None] = None
+
+        # Each episode gets its own child of episode_seed_sequence, the messages and the factor outcomes are drawn
+        # from two separate streams so that the messages do not depend on the factors called by the policy.
+        self.seed_sequence: Union[np.random.SeedSequence, None] = None
+        self.episode_seed_sequence: Union[np.random.SeedSequence, None] = None
+        self.spawn_seed_sequence: Union[np.random.SeedSequence, None] = None
+        self.generator: Union[np.random.Generator, None] = None
+        self.factor_outcome_generator: Union[np.random.Generator, None] = None
+        # With prefetch_episodes > 0, the messages and the first block of factor outcomes of the next episodes are
+        # generated in a background thread (see prefetch), reset only takes the next one. The episodes of resets with
+        # a seed are only prefetched when their seeds are scheduled beforehand (schedule_episode_seeds).
+        self.prefetch_episodes: int = environment_configuration.get(
+            'prefetch_episodes', default_environment_configuration['prefetch_episodes'])
+        self.prefetcher: Union[EpisodePrefetcher, None] = None
+        # Whether the prefetcher builds the episodes of scheduled seeds (see schedule_episode_seeds)
+        self.is_prefetcher_scheduled: bool = False
+        if self.prefetch_episodes > 0 and self.message_source is not None:
+            raise ValueError('The episodes of a message_source cannot be prefetched.')
+        self._seed(environment_configuration.get('seed', default_environment_configuration['seed']))
+
+        # One row of uniforms per message, column i decides whether factor i answers correctly for this message
+        self.factor_outcome_block_size: int = environment_configuration.get(
+            'factor_outcome_block_size', default_environment_configuration['factor_outcome_block_size'])
+        self.factor_outcome_uniforms: np.ndarray = np.empty(
+            (self.factor_outcome_block_size, self.number_identification_factors), dtype=np.float64)
+        self.factor_outcome_cursor: Union[int, None] = None
+        # reset(options={'antithetic': True}) plays the episode with the uniforms 1 - u: with the same seed, the same
+        # messages and the factors wrong where they were right (up to their accuracy), for antithetic pairs of episodes
+        self.antithetic_factor_outcomes: bool = False
+
         self.is_terminated: Union[bool, None] = None
         self.is_truncated: Union[bool, None] = None
 
@@ -54,12 +185,12 @@ class IdentificationManagement(gym.Env):
                 'matrix_identification_factors': spaces.Box(
                     low=np.finfo(np.float64).min/2,
                     high=np.finfo(np.float64).max/2,
-                    shape=self.matrix_identification_factors.shape,
+                    shape=(self.number_observed_identification_factors, 2),
                     dtype=np.float64),
                 'response_identification_factors': spaces.Box(
                     low=-1,
                     high=1,
-                    shape=(self.number_identification_factors,),
+                    shape=(self.number_observed_identification_factors,),
                     dtype=np.int32),
                 'current_energy': spaces.Box(
                     low=0,
@@ -88,72 +219,452 @@ class IdentificationManagement(gym.Env):
                     dtype=np.float64),
             }
         )
+        if self.maximum_number_identification_factors is not None:
+            self.observation_space['valid_identification_factors'] = spaces.Box(
+                low=0,
+                high=1,
+                shape=(self.number_observed_identification_factors,),
+                dtype=np.int32)
         self.action_space = spaces.Dict(
             {
                 'is_real_source': spaces.Discrete(
                     n=3),
                 'calling_identification_factors': spaces.MultiDiscrete(
-                    np.full((self.number_identification_factors,), 2)),
+                    np.full((self.number_observed_identification_factors,), 2)),
             }
         )
 
         self.int_to_bool = {-1: False, 1: True}
-        self.bool_to_int = {False: np.array([-1]), True: np.array(1)}
+        self.bool_to_int = {False: -1, True: 1}
+
+        # Lean mode: the observation returned by reset and step is always the same dict of preallocated buffers,
+        # overwritten in place at each step (copy it to keep it), and the information dict is empty unless requested.
+        self.reuse_observation: bool = environment_configuration.get(
+            'reuse_observation', default_environment_configuration['reuse_observation'])
+        self.return_information: bool = environment_configuration.get(
+            'return_information', default_environment_configuration['return_information'])
+        self.observation_buffers: Union[dict, None] = None
+        if self.maximum_number_identification_factors is not None:
+            self.observed_matrix_identification_factors = np.zeros(
+                (self.number_observed_identification_factors, 2), dtype=np.float64)
+            self.valid_identification_factors = np.zeros(self.number_observed_identification_factors, dtype=np.int32)
+        if self.reuse_observation:
+            self.response_identification_factors = np.zeros(self.number_observed_identification_factors, dtype=np.int32)
+            self.observation_buffers = {
+                'matrix_identification_factors': self.observed_matrix_identification_factors,
+                'response_identification_factors': self.response_identification_factors,
+                'current_energy': np.zeros(1, dtype=np.float64),
+                'number_messages': np.array([self.number_messages or 0], dtype=np.int32),
+                'position_current_message': np.zeros(1, dtype=np.int32),
+                'current_message_criticality': np.zeros(1, dtype=np.float64),
+                'current_message_trust': np.zeros(1, dtype=np.float64),
+            }
+            if self.valid_identification_factors is not None:
+                self.observation_buffers['valid_identification_factors'] = self.valid_identification_factors
+
+        self.instrumentation: Union[Instrumentation, None] = environment_configuration.get(
+            'instrumentation', default_environment_configuration['instrumentation'])
+        # With an event logger, the invalid factor calls and, with render_mode='text', the steps are recorded as
+        # events (see event_logging) instead of printed. Without, the invalid factor calls are warnings.
+        self.event_logger: Union[EventLogger, None] = environment_configuration.get(
+            'event_logger', default_environment_configuration['event_logger'])
+
+        # Flat mode: a single normalized float32 Box observation and a MultiDiscrete action, see flat_spaces for the
+        # layout and the mapping back to the dict form. Without the matrix in the observation, it is only given once
+        # in the information dict returned by reset.
+        self.flat_spaces: bool = environment_configuration.get(
+            'flat_spaces', default_environment_configuration['flat_spaces'])
+        self.flat_observation_includes_matrix: bool = environment_configuration.get(
+            'flat_observation_includes_matrix', default_environment_configuration['flat_observation_includes_matrix'])
+        self.dict_observation_space: spaces.Dict = self.observation_space
+        self.dict_action_space: spaces.Dict = self.action_space
+        # maximum_energy is in the flat observation when it may change from an episode to the next
+        self.flat_observation_includes_maximum_energy: bool = self.valid_identification_factors is not None or \
+            self.configuration_sampler is not None
+        self.flat_observation_buffer: Union[np.ndarray, None] = None
+        self.flat_observation_responses: Union[slice, None] = None
+        self.flat_observation_mask: Union[slice, None] = None
+        if self.flat_spaces:
+            include_mask = self.valid_identification_factors is not None
+            include_maximum_energy = self.flat_observation_includes_maximum_energy
+            self.observation_space = create_flat_observation_space(
+                self.number_observed_identification_factors, self.flat_observation_includes_matrix, include_mask,
+                include_maximum_energy)
+            self.action_space = create_flat_action_space(self.number_observed_identification_factors)
+            self.flat_observation_buffer = np.empty(get_flat_observation_size(
+                self.number_observed_identification_factors, self.flat_observation_includes_matrix, include_mask,
+                include_maximum_energy), dtype=np.float32)
+            self.flat_observation_responses = slice(
+                INDEX_RESPONSE_IDENTIFICATION_FACTORS,
+                INDEX_RESPONSE_IDENTIFICATION_FACTORS + self.number_observed_identification_factors)
+            self.flat_observation_mask = get_flat_mask_slice(self.number_observed_identification_factors,
+                                                             include_maximum_energy)
+        self._write_matrix_identification_factors()
+
+    def _write_matrix_identification_factors(self):
+        # Copies the matrix to the padded observed matrix, the validity mask and the flat observation buffer
+        number_identification_factors = self.number_identification_factors
+        if self.valid_identification_factors is not None:
+            self.observed_matrix_identification_factors.fill(0)
+            self.observed_matrix_identification_factors[:number_identification_factors] = \
+                self.matrix_identification_factors
+            self.valid_identification_factors.fill(0)
+            self.valid_identification_factors[:number_identification_factors] = 1
+        if self.flat_spaces:
+            index_end_responses = self.flat_observation_responses.stop
+            if self.flat_observation_includes_matrix:
+                self.flat_observation_buffer[index_end_responses:
+                                             index_end_responses + 2 * self.number_observed_identification_factors] = \
+                    self.observed_matrix_identification_factors.ravel()
+            if self.valid_identification_factors is not None:
+                self.flat_observation_buffer[self.flat_observation_mask] = self.valid_identification_factors
+            if self.flat_observation_includes_maximum_energy:
+                self.flat_observation_buffer[INDEX_MAXIMUM_ENERGY] = self.maximum_energy
+
+    def _sample_episode_configuration(self, seed_sequence: np.random.SeedSequence) -> dict:
+        # Does not modify the environment, it is also called in the thread of the prefetcher
+        sampled_configuration = self.configuration_sampler(np.random.default_rng(seed_sequence))
+        unknown_keys = set(sampled_configuration) - set(EPISODE_CONFIGURATION_KEYS)
+        if len(unknown_keys) > 0:
+            raise ValueError(f'The configuration_sampler returned {sorted(unknown_keys)}, only '
+                             f'{list(EPISODE_CONFIGURATION_KEYS)} can change at reset.')
+        configuration = dict(self.base_episode_configuration)
+        configuration.update(sampled_configuration)
+        configuration['matrix_identification_factors'] = np.asarray(
+            configuration['matrix_identification_factors'], dtype=np.float64)
+        number_identification_factors = configuration['matrix_identification_factors'].shape[0]
+        if number_identification_factors > self.number_observed_identification_factors or (
+                self.maximum_number_identification_factors is None and
+                number_identification_factors != self.number_observed_identification_factors):
+            raise ValueError(f'The configuration_sampler returned {number_identification_factors} identification '
+                             f'factors, the observation has {self.number_observed_identification_factors} (set '
+                             f'maximum_number_identification_factors to pad the factors).')
+        if configuration['number_messages'] is None and self.message_source is None:
+            raise ValueError('number_messages can only be None when a message_source is given.')
+        return configuration
+
+    def _set_episode_configuration(self, configuration: dict):
+        self.message_configuration = configuration['message_configuration']
+        self.number_messages = configuration['number_messages']
+        self.maximum_energy = configuration['maximum_energy']
+        if self.observation_buffers is not None:
+            self.observation_buffers['number_messages'][0] = self.number_messages or 0
+
+        self.matrix_identification_factors = configuration['matrix_identification_factors']
+        self.number_identification_factors = self.matrix_identification_factors.shape[0]
+        if self.valid_identification_factors is None:
+            self.observed_matrix_identification_factors = self.matrix_identification_factors
+            if self.observation_buffers is not None:
+                self.observation_buffers['matrix_identification_factors'] = self.matrix_identification_factors
+        elif not self.reuse_observation:
+            # The observations already returned keep the matrix of their episode
+            self.observed_matrix_identification_factors = np.zeros_like(self.observed_matrix_identification_factors)
+            self.valid_identification_factors = np.zeros_like(self.valid_identification_factors)
+        self._write_matrix_identification_factors()
+
+    def _seed(self, seed: Union[int, np.random.SeedSequence, None], close_prefetcher: bool = True):
+        # The episodes prefetched from the previous seed are dropped
+        if close_prefetcher:
+            self._close_prefetcher()
+        self.seed_sequence = create_seed_sequence(seed)
+        self.episode_seed_sequence, self.spawn_seed_sequence = self.seed_sequence.spawn(2)
+
+    def spawn_seed_sequences(self, number_seed_sequences: int) -> list[np.random.SeedSequence]:
+        # Independent streams for other environments (e.g. parallel workers), the episodes of this one are unaffected
+        return self.spawn_seed_sequence.spawn(number_seed_sequences)
+
+    def schedule_episode_seeds(self, seeds: Iterable):
+        # With prefetch_episodes > 0, the next resets given these integer seeds, in this order, take their episodes
+        # from the prefetcher, which builds them ahead (seeds is iterated lazily, in the thread). A reset with another
+        # seed, or without seed, drops the schedule. Without a schedule, a reset with a seed builds its episode itself.
+        if self.prefetch_episodes == 0:
+            return
+        self._close_prefetcher()
+        self.prefetcher = EpisodePrefetcher(self._create_episode, get_episode_seed_sequences(seeds),
+                                            self.prefetch_episodes)
+        self.is_prefetcher_scheduled = True
+
+    def _get_scheduled_episode(self, seed) -> Union[dict, None]:
+        if self.prefetcher is None or not self.is_prefetcher_scheduled:
+            return None
+        episode = self.prefetcher.get()
+        if episode is None or episode['seed'] != seed:
+            return None
+        return episode
 
     def reset(self, seed=None, options=None):
-        self.current_action = None
-        self.messages = []
-
-        for _ in range(self.number_messages):
-            self._create_message()
+        episode = None
+        if seed is not None:
+            episode = self._get_scheduled_episode(seed)
+            # The schedule is dropped unless this seed was the next one
+            self._seed(seed, close_prefetcher=episode is None)
+            if episode is not None:
+                # The child the episode was built from, as the episodes built here spawn it
+                self.episode_seed_sequence.spawn(1)
+        elif self.is_prefetcher_scheduled:
+            self._close_prefetcher()
+        self.antithetic_factor_outcomes = options is not None and options.get('antithetic', False)
 
+        self.current_action = None
+        instrumentation = self.instrumentation
+        if instrumentation is not None:
+            instrumentation.count('episodes')
+            start = instrumentation.start()
+        if episode is not None:
+            self._set_episode(episode)
+        elif self.prefetch_episodes > 0 and seed is None:
+            if self.prefetcher is None:
+                self.prefetcher = EpisodePrefetcher(
+                    self._create_episode, spawn_episode_seed_sequences(self.episode_seed_sequence),
+                    self.prefetch_episodes)
+            self._set_episode(self.prefetcher.get())
+            # The child the episode was built from
+            self.episode_seed_sequence.spawn(1)
+        else:
+            episode_seed_sequences = self.episode_seed_sequence.spawn(1)[0].spawn(
+                2 if self.configuration_sampler is None else 3)
+            if self.configuration_sampler is not None:
+                self._set_episode_configuration(self._sample_episode_configuration(episode_seed_sequences[2]))
+                if self.factor_outcome_uniforms.shape[1] != self.number_identification_factors:
+                    self.factor_outcome_uniforms = np.empty(
+                        (self.factor_outcome_block_size, self.number_identification_factors), dtype=np.float64)
+            message_seed_sequence, factor_outcome_seed_sequence = episode_seed_sequences[:2]
+            self.generator = np.random.default_rng(message_seed_sequence)
+            self.factor_outcome_generator = np.random.default_rng(factor_outcome_seed_sequence)
+            self._draw_factor_outcome_uniforms()
+            self._create_messages()
+        if instrumentation is not None:
+            instrumentation.stop('message_generation', start)
+        if self.event_logger is not None:
+            self.event_logger.log('reset', number_identification_factors=self.number_identification_factors,
+                                  number_messages=self.number_messages, maximum_energy=self.maximum_energy)
+
+        self._start_episode()
+
+        observation = self._get_observation()
+        information = self._get_information(observation)
+        if self.flat_spaces and not self.flat_observation_includes_matrix:
+            information['matrix_identification_factors'] = self.matrix_identification_factors
+        return observation, information
+
+    def _start_episode(self):
+        # State of the first step, once the messages and the first factor outcomes are drawn
         self.current_energy = self.maximum_energy
         self.position_current_message = 0
-        self.current_message = self.messages[self.position_current_message]
-        self.response_identification_factors = np.zeros(self.number_identification_factors, dtype=np.int32)
+        self.message_index = 0
+        self._clear_response_identification_factors()
 
         self.is_terminated = False
         self.is_truncated = False
 
-        return self._get_observation(), self._get_information()
+    def _create_episode(self, seed_sequence: np.random.SeedSequence) -> dict:
+        # Everything reset draws for an episode, called in the thread of the prefetcher
+        episode_seed_sequences = seed_sequence.spawn(2 if self.configuration_sampler is None else 3)
+        configuration = self.base_episode_configuration
+        if self.configuration_sampler is not None:
+            configuration = self._sample_episode_configuration(episode_seed_sequences[2])
+        generator = np.random.default_rng(episode_seed_sequences[0])
+        factor_outcome_generator = np.random.default_rng(episode_seed_sequences[1])
+        return {
+            'configuration': configuration,
+            'generator': generator,
+            'factor_outcome_generator': factor_outcome_generator,
+            'factor_outcome_uniforms': factor_outcome_generator.random(
+                (self.factor_outcome_block_size, configuration['matrix_identification_factors'].shape[0])),
+            'message_columns': create_message_columns(configuration['message_configuration'],
+                                                      configuration['number_messages'], generator),
+        }
 
-    def _create_message(self):
-        self.messages.append(Message(**self.message_configuration()))
+    def _set_episode(self, episode: dict):
+        # An episode built by _create_episode in the thread of the prefetcher
+        if self.configuration_sampler is not None:
+            self._set_episode_configuration(episode['configuration'])
+        self.generator = episode['generator']
+        self.factor_outcome_generator = episode['factor_outcome_generator']
+        # The episode owns its arrays, they are swapped in without copy
+        self.factor_outcome_uniforms = episode['factor_outcome_uniforms']
+        if self.antithetic_factor_outcomes:
+            np.subtract(1, self.factor_outcome_uniforms, out=self.factor_outcome_uniforms)
+        self.factor_outcome_cursor = 0
+        self._set_message_chunk(episode['message_columns'])
+
+    def _close_prefetcher(self):
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+            self.prefetcher = None
+        self.is_prefetcher_scheduled = False
+
+    def close(self):
+        self._close_prefetcher()
+        if self.event_logger is not None:
+            # The logger may be shared with other environments, it is only flushed
+            self.event_logger.flush(wait=True)
+        super().close()
+
+    def _draw_factor_outcome_uniforms(self):
+        self.factor_outcome_generator.random(out=self.factor_outcome_uniforms)
+        if self.antithetic_factor_outcomes:
+            np.subtract(1, self.factor_outcome_uniforms, out=self.factor_outcome_uniforms)
+        self.factor_outcome_cursor = 0
+
+    def _next_factor_outcome_uniforms(self):
+        self.factor_outcome_cursor += 1
+        if self.factor_outcome_cursor >= self.factor_outcome_block_size:
+            self._draw_factor_outcome_uniforms()
+
+    def _create_messages(self):
+        if self.message_source is not None:
+            self._open_message_stream()
+            return
+
+        columns = create_message_columns(self.message_configuration, self.number_messages, self.generator)
+        self._set_message_chunk(columns)
+
+    def _set_message_chunk(self, chunk: dict):
+        self.messages_criticality = chunk['criticality']
+        self.messages_trust = chunk['trust']
+        self.messages_is_real_source = chunk['is_real_source']
+
+    def _open_message_stream(self):
+        if callable(self.message_source):
+            messages = self.message_source(self.generator)
+        else:
+            messages = self.message_source
+            if iter(messages) is messages and self.message_stream is not None:
+                # An iterator (a live feed) cannot restart, the episode continues the stream of the previous one
+                self._resume_message_stream()
+                return
+        self.message_stream = iterate_message_chunks(messages, self.message_read_ahead)
+        self.next_chunk = None
+        self.chunk_offset = 0
+        if not self._read_ahead():
+            raise ValueError('The message source is empty.')
+        self._set_message_chunk(self.next_chunk)
+        self.next_chunk = None
+
+    def _resume_message_stream(self):
+        # The messages of the current chunk not reached by the previous episode come first (its current message too
+        # when the episode was not terminated, it was never decided), then next_chunk and the rest of the stream
+        start = self.message_index + (1 if self.is_terminated else 0)
+        self.chunk_offset = 0
+        if start < len(self.messages_criticality):
+            self._set_message_chunk({
+                'criticality': self.messages_criticality[start:],
+                'trust': self.messages_trust[start:],
+                'is_real_source': self.messages_is_real_source[start:],
+            })
+            return
+        if not self._read_ahead():
+            raise ValueError('The message source is exhausted.')
+        self._set_message_chunk(self.next_chunk)
+        self.next_chunk = None
+
+    def _read_ahead(self) -> bool:
+        if self.next_chunk is None:
+            self.next_chunk = next(self.message_stream, None)
+        return self.next_chunk is not None
+
+    def _is_last_message(self) -> bool:
+        if self.number_messages is not None and self.position_current_message >= self.number_messages - 1:
+            return True
+        if self.message_index < len(self.messages_criticality) - 1:
+            return False
+        return self.message_stream is None or not self._read_ahead()
+
+    def _get_observed_number_messages(self) -> int:
+        if self.number_messages is not None:
+            return self.number_messages
+        # Unknown length: the messages known so far (read ahead included) are reported as the horizon
+        number_messages_known = self.chunk_offset + len(self.messages_criticality)
+        if self.next_chunk is not None:
+            number_messages_known += len(self.next_chunk['criticality'])
+        return number_messages_known
+
+    @property
+    def current_message(self) -> Message:
+        return Message(
+            criticality=float(self.messages_criticality[self.message_index]),
+            trust=float(self.messages_trust[self.message_index]),
+            is_real_source=bool(self.messages_is_real_source[self.message_index]),
+        )
 
-    def step(self, action: dict):
+    def step(self, action: Union[dict, np.ndarray]):
+        if self.flat_spaces:
+            action = unflatten_action(action)
         self.current_action = action
+        instrumentation = self.instrumentation
+        if instrumentation is not None:
+            instrumentation.count('steps')
         action_is_real_source: int = int(action['is_real_source']) - 1
         action_calling_identification_factors: np.ndarray = action['calling_identification_factors']
         reward: Union[float, None] = None
+        message_reward: float = self.messages_criticality[self.message_index] * self.messages_trust[self.message_index]
+        is_real_source: bool = bool(self.messages_is_real_source[self.message_index])
 
         if action_is_real_source != 0:
-            if self.int_to_bool[action_is_real_source] == self.current_message.is_real_source:
-                reward = self.current_message.criticality * self.current_message.trust
-            elif self.int_to_bool[action_is_real_source] != self.current_message.is_real_source:
-                reward = -1 * self.current_message.criticality * self.current_message.trust
-
-            if self.position_current_message >= self.number_messages - 1:
+            if instrumentation is not None:
+                instrumentation.count('messages_decided')
+            if self.int_to_bool[action_is_real_source] == is_real_source:
+                reward = message_reward
+            elif self.int_to_bool[action_is_real_source] != is_real_source:
+                reward = -1 * message_reward
+
+            if self._is_last_message():
                 self.is_terminated = True
             else:
                 self._next_message()
 
         else:
+            if instrumentation is not None:
+                start = instrumentation.start()
             made_mistake = self._calling_identification_factors(action_calling_identification_factors)
+            if instrumentation is not None:
+                instrumentation.stop('identification_factors', start)
             reward = 0
-            if made_mistake or np.all(action_calling_identification_factors == 0):
-                reward = -1 * self.current_message.criticality * self.current_message.trust
-                if self.position_current_message >= self.number_messages - 1:
+            # Calling only padding factors calls nothing
+            if made_mistake or np.all(action_calling_identification_factors[:self.number_identification_factors] == 0):
+                if instrumentation is not None:
+                    instrumentation.count('messages_skipped')
+                reward = -1 * message_reward
+                if self._is_last_message():
                     self.is_terminated = True
                 else:
                     self._next_message()
 
         if self.render_mode == 'text':
-            self.render()
-
-        return self._get_observation(), reward, self.is_terminated, self.is_truncated, self._get_information()
-
-    def _get_information(self):
-        information = {'observation': self._get_observation()}
+            if instrumentation is not None:
+                start = instrumentation.start()
+            if self.event_logger is None:
+                self.render()
+            elif self.event_logger.is_sampled('step'):
+                self.event_logger.record('step', {
+                    'position_current_message': self.position_current_message,
+                    'is_real_source': int(action['is_real_source']),
+                    'calling_identification_factors': np.asarray(action_calling_identification_factors).tolist(),
+                    'reward': float(reward),
+                    'current_energy': float(self.current_energy),
+                    'terminated': self.is_terminated,
+                })
+            if instrumentation is not None:
+                instrumentation.stop('render', start)
+
+        if instrumentation is not None:
+            start = instrumentation.start()
+        observation = self._get_observation()
+        information = self._get_information(observation)
+        if instrumentation is not None:
+            instrumentation.stop('observation', start)
+        return observation, reward, self.is_terminated, self.is_truncated, information
+
+    def _get_information(self, observation: Union[dict, None] = None):
+        if not self.return_information:
+            return {}
+        return self._build_information(observation)
+
+    def _build_information(self, observation: Union[dict, None] = None):
+        if observation is None:
+            observation = self._get_observation()
+        information = {'observation': observation}
         information.update({'message': self.current_message.get_information()})
         if self.current_action is not None:
             information.update({'action': self.current_action})
@@ -161,52 +672,116 @@ class IdentificationManagement(gym.Env):
         return information
 
     def _get_observation(self):
+        index = self.message_index
+        if self.flat_spaces:
+            return self._get_flat_observation()
+
+        if self.observation_buffers is not None:
+            self.observation_buffers['current_energy'][0] = self.current_energy
+            self.observation_buffers['position_current_message'][0] = self.position_current_message
+            self.observation_buffers['current_message_criticality'][0] = self.messages_criticality[index]
+            self.observation_buffers['current_message_trust'][0] = self.messages_trust[index]
+            if self.number_messages is None:
+                self.observation_buffers['number_messages'][0] = self._get_observed_number_messages()
+            return self.observation_buffers
+
         observation = {
-            'matrix_identification_factors': self.matrix_identification_factors,
+            'matrix_identification_factors': self.observed_matrix_identification_factors,
             'response_identification_factors': self.response_identification_factors,
             'current_energy': np.array([self.current_energy], dtype=np.float64),
-            'number_messages': np.array([self.number_messages]),
-            'position_current_message': np.array([self.position_current_message]),
-            'current_message_criticality': np.array([self.current_message.criticality]),
-            'current_message_trust': np.array([self.current_message.trust]),
+            'number_messages': np.array([self._get_observed_number_messages()], dtype=np.int32),
+            'position_current_message': np.array([self.position_current_message], dtype=np.int32),
+            'current_message_criticality': self.messages_criticality[index:index + 1],
+            'current_message_trust': self.messages_trust[index:index + 1],
         }
+        if self.valid_identification_factors is not None:
+            observation['valid_identification_factors'] = self.valid_identification_factors
+        return observation
+
+    def _get_flat_observation(self):
+        if self.reuse_observation:
+            observation = self.flat_observation_buffer
+        else:
+            observation = self.flat_observation_buffer.copy()
+
+        index = self.message_index
+        observation[INDEX_CURRENT_ENERGY] = self.current_energy / self.maximum_energy
+        observation[INDEX_POSITION_CURRENT_MESSAGE] = \
+            self.position_current_message / self._get_observed_number_messages()
+        observation[INDEX_CURRENT_MESSAGE_CRITICALITY] = self.messages_criticality[index]
+        observation[INDEX_CURRENT_MESSAGE_TRUST] = self.messages_trust[index]
+        observation[self.flat_observation_responses] = self.response_identification_factors
         return observation
 
     def _next_message(self):
         self.position_current_message += 1
-        self.response_identification_factors = np.zeros(self.number_identification_factors, dtype=np.int32)
-        self.current_message = self.messages[self.position_current_message]
+        self.message_index += 1
+        if self.message_index >= len(self.messages_criticality):
+            # Only reached in streaming mode, _is_last_message has read the next chunk ahead
+            self.chunk_offset += len(self.messages_criticality)
+            self._set_message_chunk(self.next_chunk)
+            self.next_chunk = None
+            self.message_index = 0
+        self._clear_response_identification_factors()
+        self._next_factor_outcome_uniforms()
+
+    def _clear_response_identification_factors(self):
+        if self.observation_buffers is not None:
+            self.response_identification_factors.fill(0)
+        else:
+            self.response_identification_factors = np.zeros(self.number_observed_identification_factors, dtype=np.int32)
 
     def _calling_identification_factors(self, calling: np.ndarray) -> bool:
+        return self._call_identification_factors(
+            calling, bool(self.messages_is_real_source[self.message_index]),
+            self.factor_outcome_uniforms[self.factor_outcome_cursor], self.response_identification_factors)
+
+    def _call_identification_factors(self, calling: np.ndarray, is_real_source: bool,
+                                     factor_outcome_uniforms: np.ndarray, responses: np.ndarray) -> bool:
+        # Calls the factors of one message, whose responses are written to responses
         made_mistake: bool = False
         for i in range(self.number_identification_factors):
-            if calling[i] == 1 and self.response_identification_factors[i] == 0:
+            if calling[i] == 1 and responses[i] == 0:
                 factor_energy_cost = self.matrix_identification_factors[i][0]
                 factor_percentage_correct_responses = self.matrix_identification_factors[i][1]
 
                 if self.current_energy >= factor_energy_cost:
+                    if self.instrumentation is not None:
+                        self.instrumentation.count('factor_calls')
                     self.current_energy -= factor_energy_cost
-                    if np.random.uniform(0, 1) < factor_percentage_correct_responses:
-                        self.response_identification_factors[i] = self.bool_to_int[self.current_message.is_real_source]
+                    if factor_outcome_uniforms[i] < factor_percentage_correct_responses:
+                        responses[i] = self.bool_to_int[is_real_source]
                     else:
-                        self.response_identification_factors[i] = self.bool_to_int[not self.current_message.is_real_source]
+                        responses[i] = self.bool_to_int[not is_real_source]
                 else:
                     made_mistake = True
-                    print(f'The agent is attempting to call identification factor {i} for which it does not '
-                                  f'have enough energy.')
+                    if self.instrumentation is not None:
+                        self.instrumentation.count('invalid_factor_calls')
+                        self.instrumentation.count('energy_exhausted')
+                    self._report_invalid_factor_call(i, 'energy_exhausted')
 
-            elif calling[i] == 1 and self.response_identification_factors[i] != 0:
+            elif calling[i] == 1 and responses[i] != 0:
                 made_mistake = True
-                print(f'The agent is attempting to call the identification factor {i} that has already been '
-                              f'called for this message.')
+                if self.instrumentation is not None:
+                    self.instrumentation.count('invalid_factor_calls')
+                    self.instrumentation.count('factor_already_called')
+                self._report_invalid_factor_call(i, 'factor_already_called')
         return made_mistake
 
+    def _report_invalid_factor_call(self, index_factor: int, reason: str):
+        if self.event_logger is not None:
+            self.event_logger.log('invalid_factor_call', reason=reason, factor=index_factor,
+                                  position_current_message=self.position_current_message,
+                                  current_energy=float(self.current_energy))
+        elif reason == 'energy_exhausted':
+            # Shown once per factor with the default warning filter
+            warnings.warn(f'The agent is attempting to call identification factor {index_factor} for which it does '
+                          f'not have enough energy.')
+        else:
+            warnings.warn(f'The agent is attempting to call the identification factor {index_factor} that has '
+                          f'already been called for this message.')
+
     def render(self):
         print()
         print('-- Render --')
-        def numpy_array_serializer(obj):
-            if isinstance(obj, np.ndarray):
-                return obj.tolist()  # Convertir le tableau numpy en une liste standard
-            raise TypeError("Type not serializable")
-
-        print(json.dumps(self._get_information(), indent=4, default=numpy_array_serializer))
+        print(json.dumps(self._build_information(), indent=4, default=json_serializer))
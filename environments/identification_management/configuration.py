@@ -2,11 +2,22 @@ import random
 import numpy as np
 
 
-default_message_configuration = lambda: {
-    'criticality': random.uniform(0, 1),
-    'trust': random.uniform(0, 1),
-    'is_real_source': random.choice([True, False]),
-}
+def default_message_configuration(number_messages: int, generator: np.random.Generator):
+    # Returns whole columns, one value per message of the episode
+    return {
+        'criticality': generator.uniform(0, 1, size=number_messages),
+        'trust': generator.uniform(0, 1, size=number_messages),
+        'is_real_source': generator.uniform(0, 1, size=number_messages) < 0.5,
+    }
+
+
+def default_single_message_configuration():
+    # Per-message form, still accepted by the environments as 'message_configuration'
+    return {
+        'criticality': random.uniform(0, 1),
+        'trust': random.uniform(0, 1),
+        'is_real_source': random.choice([True, False]),
+    }
 
 default_matrix_identification_factors = np.array([
     [0.8, 0.8],
@@ -15,9 +26,11 @@ default_matrix_identification_factors = np.array([
     [0.2, 0.6],
 ])
 
-def random_matrix_identification_factors(number_factors):
-    energy_costs = np.random.uniform(0.5, 1, size=(number_factors, 1))
-    probability_correct_prediction = np.random.uniform(0.5, 1, size=(number_factors, 1))
+def random_matrix_identification_factors(number_factors, generator: np.random.Generator = None):
+    if generator is None:
+        generator = np.random.default_rng()
+    energy_costs = generator.uniform(0.5, 1, size=(number_factors, 1))
+    probability_correct_prediction = generator.uniform(0.5, 1, size=(number_factors, 1))
     matrix = np.hstack((energy_costs, probability_correct_prediction))
     return matrix
 
@@ -28,15 +41,47 @@ default_environment_configuration: dict = {
     'number_messages': 1000,
     'maximum_energy': 500,
     'render_mode': False,
+    'seed': None,
+    'factor_outcome_block_size': 1024,
+    'reuse_observation': False,
+    'return_information': True,
+    'flat_spaces': False,
+    'flat_observation_includes_matrix': True,
+    'instrumentation': None,
+    'message_source': None,
+    'message_read_ahead': 1024,
+    'prefetch_episodes': 0,
+    'maximum_number_identification_factors': None,
+    'configuration_sampler': None,
+    'event_logger': None,
 }
 
+# Keys a configuration_sampler may return, the others are fixed for the lifetime of the environment
+EPISODE_CONFIGURATION_KEYS = ('matrix_identification_factors', 'number_messages', 'maximum_energy',
+                              'message_configuration')
+MAXIMUM_NUMBER_RANDOM_IDENTIFICATION_FACTORS = 10
+MAXIMUM_NUMBER_RANDOM_MESSAGES = 2000
+
+
+def random_episode_configuration(generator: np.random.Generator = None):
+    # The configuration_sampler of the distribution of random_environment_configuration, to train a single policy
+    # on padded factors (maximum_number_identification_factors=MAXIMUM_NUMBER_RANDOM_IDENTIFICATION_FACTORS)
+    if generator is None:
+        generator = np.random.default_rng()
+    number_factors = int(generator.integers(2, MAXIMUM_NUMBER_RANDOM_IDENTIFICATION_FACTORS + 1))
+    return {
+        'matrix_identification_factors': random_matrix_identification_factors(number_factors, generator),
+        'number_messages': int(generator.integers(500, MAXIMUM_NUMBER_RANDOM_MESSAGES + 1)),
+        'maximum_energy': float(generator.uniform(150, 450)),
+    }
+
 
-def random_environment_configuration():
+def random_environment_configuration(generator: np.random.Generator = None):
+    if generator is None:
+        generator = np.random.default_rng()
     environment_configuration: dict = {
         'message_configuration': default_message_configuration,
-        'matrix_identification_factors': random_matrix_identification_factors(random.randint(2, 10)),
-        'number_messages': random.randint(500, 2000),
-        'maximum_energy': random.uniform(150, 450),
+        **random_episode_configuration(generator),
         'render_mode': False,
     }
     return environment_configuration
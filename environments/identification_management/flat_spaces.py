@@ -0,0 +1,141 @@
+from typing import Union
+
+from gymnasium import spaces
+import numpy as np
+
+# Flat observation (float32), with k the number of identification factors:
+#   [0]            current_energy / maximum_energy
+#   [1]            position_current_message / number_messages
+#   [2]            current_message_criticality
+#   [3]            current_message_trust
+#   [4:4+k]        response_identification_factors (-1, 0 or 1)
+#   [4+k:4+3k]     matrix_identification_factors flattened row by row (energy cost, percentage of correct
+#                  responses), only when the matrix is included in the observation
+#   [-k:]          valid_identification_factors (1 for a factor, 0 for padding), only when the factors are padded,
+#                  [-k-1:-1] when maximum_energy follows
+#   [-1]           maximum_energy, only when it may change from an episode to the next (padded factors or
+#                  configuration_sampler): the energy costs of the matrix are in its units, current_energy /
+#                  maximum_energy alone does not tell which factors are affordable
+#
+# With padded factors (maximum_number_identification_factors), k is the maximum number of factors and the padding
+# factors have zero responses and zero rows in the matrix.
+#
+# Flat action (MultiDiscrete([3, 2, ..., 2])):
+#   [0]            is_real_source
+#   [1:1+k]        calling_identification_factors
+
+INDEX_CURRENT_ENERGY = 0
+INDEX_POSITION_CURRENT_MESSAGE = 1
+INDEX_CURRENT_MESSAGE_CRITICALITY = 2
+INDEX_CURRENT_MESSAGE_TRUST = 3
+INDEX_RESPONSE_IDENTIFICATION_FACTORS = 4
+INDEX_MAXIMUM_ENERGY = -1
+
+
+def get_flat_observation_size(number_identification_factors: int, include_matrix: bool,
+                              include_mask: bool = False, include_maximum_energy: bool = False) -> int:
+    size = INDEX_RESPONSE_IDENTIFICATION_FACTORS + number_identification_factors
+    if include_matrix:
+        size += 2 * number_identification_factors
+    if include_mask:
+        size += number_identification_factors
+    if include_maximum_energy:
+        size += 1
+    return size
+
+
+def get_flat_mask_slice(number_identification_factors: int, include_maximum_energy: bool) -> slice:
+    if include_maximum_energy:
+        return slice(-number_identification_factors - 1, INDEX_MAXIMUM_ENERGY)
+    return slice(-number_identification_factors, None)
+
+
+def create_flat_observation_space(number_identification_factors: int, include_matrix: bool,
+                                  include_mask: bool = False, include_maximum_energy: bool = False) -> spaces.Box:
+    size = get_flat_observation_size(number_identification_factors, include_matrix, include_mask,
+                                     include_maximum_energy)
+    low = np.full(size, -np.inf, dtype=np.float32)
+    high = np.full(size, np.inf, dtype=np.float32)
+    low[[INDEX_CURRENT_ENERGY, INDEX_POSITION_CURRENT_MESSAGE]] = 0
+    high[[INDEX_CURRENT_ENERGY, INDEX_POSITION_CURRENT_MESSAGE]] = 1
+    responses = slice(INDEX_RESPONSE_IDENTIFICATION_FACTORS,
+                      INDEX_RESPONSE_IDENTIFICATION_FACTORS + number_identification_factors)
+    low[responses] = -1
+    high[responses] = 1
+    if include_mask:
+        mask = get_flat_mask_slice(number_identification_factors, include_maximum_energy)
+        low[mask] = 0
+        high[mask] = 1
+    if include_maximum_energy:
+        low[INDEX_MAXIMUM_ENERGY] = 0
+    return spaces.Box(low=low, high=high, dtype=np.float32)
+
+
+def create_flat_action_space(number_identification_factors: int) -> spaces.MultiDiscrete:
+    return spaces.MultiDiscrete(np.array([3] + [2] * number_identification_factors))
+
+
+def flatten_observation(observation: dict, maximum_energy: float, include_matrix: bool,
+                        out: Union[np.ndarray, None] = None,
+                        include_maximum_energy: Union[bool, None] = None) -> np.ndarray:
+    # include_maximum_energy: by default when the factors are padded, give the flat_observation_includes_maximum_energy
+    # of the environment for a configuration_sampler without padding
+    matrix_identification_factors = observation['matrix_identification_factors']
+    number_identification_factors = matrix_identification_factors.shape[0]
+    valid_identification_factors = observation.get('valid_identification_factors')
+    include_mask = valid_identification_factors is not None
+    if include_maximum_energy is None:
+        include_maximum_energy = include_mask
+    if out is None:
+        out = np.empty(get_flat_observation_size(number_identification_factors, include_matrix, include_mask,
+                                                 include_maximum_energy), dtype=np.float32)
+
+    out[INDEX_CURRENT_ENERGY] = observation['current_energy'][0] / maximum_energy
+    out[INDEX_POSITION_CURRENT_MESSAGE] = observation['position_current_message'][0] / observation['number_messages'][0]
+    out[INDEX_CURRENT_MESSAGE_CRITICALITY] = observation['current_message_criticality'][0]
+    out[INDEX_CURRENT_MESSAGE_TRUST] = observation['current_message_trust'][0]
+    index_end_responses = INDEX_RESPONSE_IDENTIFICATION_FACTORS + number_identification_factors
+    out[INDEX_RESPONSE_IDENTIFICATION_FACTORS:index_end_responses] = observation['response_identification_factors']
+    if include_matrix:
+        out[index_end_responses:index_end_responses + 2 * number_identification_factors] = \
+            matrix_identification_factors.ravel()
+    if include_mask:
+        out[get_flat_mask_slice(number_identification_factors, include_maximum_energy)] = valid_identification_factors
+    if include_maximum_energy:
+        out[INDEX_MAXIMUM_ENERGY] = maximum_energy
+    return out
+
+
+def unflatten_observation(flat_observation: np.ndarray, matrix_identification_factors: np.ndarray,
+                          maximum_energy: Union[float, None], number_messages: int) -> dict:
+    # The matrix and the normalization constants are not (always) in the flat observation, they are taken from the
+    # environment (or from the information dict returned by reset). maximum_energy None reads it from the flat
+    # observation, which must include it. The padding of padded factors is dropped, the responses are those of the
+    # factors of the matrix.
+    if maximum_energy is None:
+        maximum_energy = float(flat_observation[INDEX_MAXIMUM_ENERGY])
+    number_identification_factors = matrix_identification_factors.shape[0]
+    index_end_responses = INDEX_RESPONSE_IDENTIFICATION_FACTORS + number_identification_factors
+    return {
+        'matrix_identification_factors': matrix_identification_factors,
+        'response_identification_factors': np.rint(
+            flat_observation[INDEX_RESPONSE_IDENTIFICATION_FACTORS:index_end_responses]).astype(np.int32),
+        'current_energy': np.array([flat_observation[INDEX_CURRENT_ENERGY] * maximum_energy], dtype=np.float64),
+        'number_messages': np.array([number_messages], dtype=np.int32),
+        'position_current_message': np.array(
+            [np.rint(flat_observation[INDEX_POSITION_CURRENT_MESSAGE] * number_messages)], dtype=np.int32),
+        'current_message_criticality': np.array(
+            [flat_observation[INDEX_CURRENT_MESSAGE_CRITICALITY]], dtype=np.float64),
+        'current_message_trust': np.array([flat_observation[INDEX_CURRENT_MESSAGE_TRUST]], dtype=np.float64),
+    }
+
+
+def flatten_action(action: dict) -> np.ndarray:
+    return np.concatenate(([int(action['is_real_source'])], action['calling_identification_factors'])).astype(np.int64)
+
+
+def unflatten_action(flat_action: np.ndarray) -> dict:
+    return {
+        'is_real_source': int(flat_action[0]),
+        'calling_identification_factors': np.asarray(flat_action[1:]),
+    }
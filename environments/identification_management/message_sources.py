@@ -0,0 +1,116 @@
+import csv
+from typing import Callable, Iterable, Iterator, Union
+
+import numpy as np
+
+from environments.identification_management.configuration import default_message_configuration
+
+# A message source is given to IdentificationManagement as 'message_source'. It is either a callable taking the
+# episode generator and returning an iterable (called again at each reset, e.g. a seeded synthetic stream or a file
+# read from the start), or an iterable (iterated again at each reset: a list restarts, an iterator such as a live
+# feed keeps going from where the previous episode stopped, the messages already read ahead included). The iterable
+# yields chunks of messages as column dicts ('criticality', 'trust', 'is_real_source' arrays) or single messages as
+# dicts of scalars; the environment pulls them lazily and keeps at most the current chunk and the next one in memory.
+
+
+def is_message_chunk(item: dict) -> bool:
+    return np.ndim(item['criticality']) > 0
+
+
+def create_message_chunk(criticality, trust, is_real_source) -> dict:
+    return {
+        'criticality': np.asarray(criticality, dtype=np.float64),
+        'trust': np.asarray(trust, dtype=np.float64),
+        'is_real_source': np.asarray(is_real_source, dtype=bool),
+    }
+
+
+def iterate_message_chunks(items: Iterable, chunk_size: int) -> Iterator[dict]:
+    # Chunks are passed through, single messages are grouped into chunks of chunk_size
+    buffered_messages = []
+    for item in items:
+        if is_message_chunk(item):
+            if len(buffered_messages) > 0:
+                yield _stack_messages(buffered_messages)
+                buffered_messages = []
+            chunk = create_message_chunk(item['criticality'], item['trust'], item['is_real_source'])
+            if len(chunk['criticality']) > 0:
+                yield chunk
+        else:
+            buffered_messages.append(item)
+            if len(buffered_messages) >= chunk_size:
+                yield _stack_messages(buffered_messages)
+                buffered_messages = []
+
+    if len(buffered_messages) > 0:
+        yield _stack_messages(buffered_messages)
+
+
+def _stack_messages(messages: list) -> dict:
+    return create_message_chunk(
+        [message['criticality'] for message in messages],
+        [message['trust'] for message in messages],
+        [message['is_real_source'] for message in messages],
+    )
+
+
+class SyntheticMessageSource:
+    # Endless (or number_messages long) stream drawn chunk by chunk from a column message configuration
+    def __init__(self, message_configuration: Callable = default_message_configuration, chunk_size: int = 1024,
+                 number_messages: Union[int, None] = None):
+        self.message_configuration: Callable = message_configuration
+        self.chunk_size: int = chunk_size
+        self.number_messages: Union[int, None] = number_messages
+
+    def __call__(self, generator: np.random.Generator) -> Iterator[dict]:
+        number_messages_drawn = 0
+        while self.number_messages is None or number_messages_drawn < self.number_messages:
+            size = self.chunk_size
+            if self.number_messages is not None:
+                size = min(size, self.number_messages - number_messages_drawn)
+            columns = self.message_configuration(size, generator)
+            number_messages_drawn += size
+            yield create_message_chunk(columns['criticality'], columns['trust'], columns['is_real_source'])
+
+
+class CsvMessageSource:
+    # CSV file with a header containing the columns criticality, trust and is_real_source (true/false or 1/0)
+    def __init__(self, path: str, chunk_size: int = 1024):
+        self.path: str = path
+        self.chunk_size: int = chunk_size
+
+    def __call__(self, generator: np.random.Generator) -> Iterator[dict]:
+        with open(self.path, newline='') as file:
+            rows = []
+            for row in csv.DictReader(file):
+                rows.append(row)
+                if len(rows) >= self.chunk_size:
+                    yield self._parse_rows(rows)
+                    rows = []
+            if len(rows) > 0:
+                yield self._parse_rows(rows)
+
+    @staticmethod
+    def _parse_rows(rows: list) -> dict:
+        return create_message_chunk(
+            [float(row['criticality']) for row in rows],
+            [float(row['trust']) for row in rows],
+            [row['is_real_source'].strip().lower() in ('1', 'true') for row in rows],
+        )
+
+
+class NpyMessageSource:
+    # Memory-mapped .npy file, either a structured array with the three fields or a (number_messages, 3) array whose
+    # columns are criticality, trust and is_real_source. Only the chunk being read is loaded.
+    def __init__(self, path: str, chunk_size: int = 65536):
+        self.path: str = path
+        self.chunk_size: int = chunk_size
+
+    def __call__(self, generator: np.random.Generator) -> Iterator[dict]:
+        messages = np.load(self.path, mmap_mode='r')
+        for start in range(0, len(messages), self.chunk_size):
+            chunk = messages[start:start + self.chunk_size]
+            if messages.dtype.names is not None:
+                yield create_message_chunk(chunk['criticality'], chunk['trust'], chunk['is_real_source'])
+            else:
+                yield create_message_chunk(chunk[:, 0], chunk[:, 1], chunk[:, 2] != 0)
@@ -0,0 +1,58 @@
+import queue
+import threading
+from typing import Callable, Iterator, Union
+
+
+class EpisodePrefetcher:
+    # Prepares the data of the next episodes in a background thread, into a queue of at most number_episodes_ahead
+    # episodes (the thread blocks when it is full, so the memory is bounded by the ring size). seed_sequences yields
+    # (seed, seed sequence of the episode), it is iterated in the thread: the environment gives either the children of
+    # its episode_seed_sequence, spawned in order exactly as it would have spawned them at each reset, or the seed
+    # sequences of the seeds scheduled for the next resets. Either way, the episodes are the same with or without
+    # prefetching. get returns None once seed_sequences is exhausted.
+    def __init__(self, create_episode: Callable, seed_sequences: Iterator, number_episodes_ahead: int):
+        self.create_episode: Callable = create_episode
+        self.seed_sequences: Iterator = seed_sequences
+        self.is_exhausted: bool = False
+        self.episodes: queue.Queue = queue.Queue(maxsize=number_episodes_ahead)
+        self.stop_event: threading.Event = threading.Event()
+        self.exception: Union[BaseException, None] = None
+        self.thread: threading.Thread = threading.Thread(target=self._run, name='EpisodePrefetcher', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            for seed, seed_sequence in self.seed_sequences:
+                if self.stop_event.is_set():
+                    return
+                episode = self.create_episode(seed_sequence)
+                episode['seed'] = seed
+                self._put(episode)
+            self.is_exhausted = True
+            self._put(None)
+        except BaseException as exception:
+            # Raised again in the thread of the environment by get
+            self.exception = exception
+            self._put(None)
+
+    def _put(self, episode: Union[dict, None]):
+        while not self.stop_event.is_set():
+            try:
+                self.episodes.put(episode, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def get(self) -> Union[dict, None]:
+        episode = self.episodes.get()
+        if episode is None:
+            if self.is_exhausted:
+                # Every following get would wait forever
+                self._put(None)
+                return None
+            raise RuntimeError('The episode prefetcher failed.') from self.exception
+        return episode
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join()
@@ -0,0 +1,232 @@
+import json
+import os
+from typing import Union
+
+import gymnasium as gym
+import numpy as np
+
+from environments.identification_management.Identification_management import IdentificationManagement
+
+# A trace is a directory with one raw binary file per column (fixed dtype, appended to) and a metadata.json file:
+#   messages/<column>.bin  one record per message seen: its attributes and the uniforms deciding the outcome of every
+#                          identification factor for it (factor i answers correctly when uniform i < its percentage
+#                          of correct responses), whether the policy called it or not
+#   steps/<column>.bin     one record per step: the action, the energy after it and the reward
+# The columns are memory-mapped at replay, the messages of an episode are read without copy.
+
+
+def get_message_columns(number_identification_factors: int) -> dict:
+    return {
+        'episode': (np.int64, ()),
+        'position': (np.int64, ()),
+        'criticality': (np.float64, ()),
+        'trust': (np.float64, ()),
+        'is_real_source': (np.bool_, ()),
+        'factor_outcome_uniforms': (np.float64, (number_identification_factors,)),
+    }
+
+
+def get_step_columns(number_identification_factors: int) -> dict:
+    return {
+        'episode': (np.int64, ()),
+        'position': (np.int64, ()),
+        'is_real_source': (np.int8, ()),
+        'calling_identification_factors': (np.int8, (number_identification_factors,)),
+        'current_energy': (np.float64, ()),
+        'reward': (np.float64, ()),
+        'terminated': (np.bool_, ()),
+    }
+
+
+class ColumnWriter:
+    # Buffers buffer_size records in preallocated arrays and appends them to one file per column when full
+    def __init__(self, directory: str, columns: dict, buffer_size: int):
+        os.makedirs(directory, exist_ok=True)
+        self.buffer_size: int = buffer_size
+        self.buffers: dict = {
+            name: np.empty((buffer_size,) + shape, dtype=dtype) for name, (dtype, shape) in columns.items()
+        }
+        self.files: dict = {name: open(os.path.join(directory, f'{name}.bin'), 'ab') for name in columns}
+        self.number_buffered_records: int = 0
+        self.number_records: int = 0
+
+    def append(self, **record):
+        for name, value in record.items():
+            self.buffers[name][self.number_buffered_records] = value
+        self.number_buffered_records += 1
+        self.number_records += 1
+        if self.number_buffered_records >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        for name, buffer in self.buffers.items():
+            buffer[:self.number_buffered_records].tofile(self.files[name])
+            self.files[name].flush()
+        self.number_buffered_records = 0
+
+    def close(self):
+        self.flush()
+        for file in self.files.values():
+            file.close()
+
+
+def read_columns(directory: str, columns: dict) -> dict:
+    memory_maps = {}
+    for name, (dtype, shape) in columns.items():
+        path = os.path.join(directory, f'{name}.bin')
+        record_size = np.dtype(dtype).itemsize * int(np.prod(shape))
+        number_records = os.path.getsize(path) // record_size
+        if number_records == 0:
+            memory_maps[name] = np.empty((0,) + shape, dtype=dtype)
+        else:
+            memory_maps[name] = np.memmap(path, dtype=dtype, mode='r', shape=(number_records,) + shape)
+    return memory_maps
+
+
+class TraceRecorder(gym.Wrapper):
+    def __init__(self, environment: IdentificationManagement, directory: str, buffer_size: int = 4096):
+        super().__init__(environment)
+        identification_management: IdentificationManagement = environment.unwrapped
+        if identification_management.configuration_sampler is not None:
+            raise ValueError('The trace has a single configuration, the environment cannot have a '
+                             'configuration_sampler.')
+        number_identification_factors = identification_management.number_identification_factors
+
+        os.makedirs(directory, exist_ok=True)
+        metadata_path = os.path.join(directory, 'metadata.json')
+        self.number_episodes: int = 0
+        if os.path.exists(metadata_path):
+            with open(metadata_path) as file:
+                self.number_episodes = json.load(file)['number_episodes']
+        self.directory: str = directory
+        self.metadata: dict = {
+            'matrix_identification_factors': identification_management.matrix_identification_factors.tolist(),
+            'maximum_energy': identification_management.maximum_energy,
+            'number_episodes': self.number_episodes,
+        }
+        self._save_metadata()
+
+        self.message_writer = ColumnWriter(
+            os.path.join(directory, 'messages'), get_message_columns(number_identification_factors), buffer_size)
+        self.step_writer = ColumnWriter(
+            os.path.join(directory, 'steps'), get_step_columns(number_identification_factors), buffer_size)
+        self.episode: Union[int, None] = None
+
+    def reset(self, **kwargs):
+        observation, information = self.env.reset(**kwargs)
+        self.episode = self.number_episodes
+        self.number_episodes += 1
+        self._record_message()
+        return observation, information
+
+    def step(self, action):
+        identification_management: IdentificationManagement = self.env.unwrapped
+        position = identification_management.position_current_message
+
+        observation, reward, terminated, truncated, information = self.env.step(action)
+
+        current_action = identification_management.current_action
+        self.step_writer.append(
+            episode=self.episode,
+            position=position,
+            is_real_source=int(current_action['is_real_source']),
+            # Without the calls of the padding factors
+            calling_identification_factors=current_action['calling_identification_factors'][
+                :identification_management.number_identification_factors],
+            current_energy=identification_management.current_energy,
+            reward=reward,
+            terminated=terminated,
+        )
+        if identification_management.position_current_message != position and not terminated:
+            self._record_message()
+
+        return observation, reward, terminated, truncated, information
+
+    def _record_message(self):
+        identification_management: IdentificationManagement = self.env.unwrapped
+        index = identification_management.message_index
+        self.message_writer.append(
+            episode=self.episode,
+            position=identification_management.position_current_message,
+            criticality=identification_management.messages_criticality[index],
+            trust=identification_management.messages_trust[index],
+            is_real_source=identification_management.messages_is_real_source[index],
+            factor_outcome_uniforms=identification_management.factor_outcome_uniforms[
+                identification_management.factor_outcome_cursor],
+        )
+
+    def _save_metadata(self):
+        self.metadata['number_episodes'] = self.number_episodes
+        with open(os.path.join(self.directory, 'metadata.json'), 'w') as file:
+            json.dump(self.metadata, file, indent=4)
+
+    def flush(self):
+        self.message_writer.flush()
+        self.step_writer.flush()
+        self._save_metadata()
+
+    def close(self):
+        self.message_writer.close()
+        self.step_writer.close()
+        self._save_metadata()
+        super().close()
+
+
+def load_trace(directory: str) -> tuple:
+    with open(os.path.join(directory, 'metadata.json')) as file:
+        metadata = json.load(file)
+    number_identification_factors = len(metadata['matrix_identification_factors'])
+    messages = read_columns(os.path.join(directory, 'messages'), get_message_columns(number_identification_factors))
+    steps = read_columns(os.path.join(directory, 'steps'), get_step_columns(number_identification_factors))
+    return metadata, messages, steps
+
+
+class ReplayIdentificationManagement(IdentificationManagement):
+    # Replays the messages and factor outcomes of a recorded trace, episode after episode (or the one given with
+    # reset(options={'episode': index})), for any policy. The recorded messages of an episode are those the recording
+    # policy reached, an episode of the trace that terminated early is replayed up to the same message.
+    def __init__(self, directory: str, environment_configuration=None):
+        self.trace_metadata, self.trace_messages, self.trace_steps = load_trace(directory)
+
+        environment_configuration = dict(environment_configuration or {})
+        environment_configuration['matrix_identification_factors'] = np.array(
+            self.trace_metadata['matrix_identification_factors'])
+        environment_configuration.setdefault('maximum_energy', self.trace_metadata['maximum_energy'])
+        environment_configuration['message_source'] = None
+        environment_configuration['prefetch_episodes'] = 0
+        environment_configuration['configuration_sampler'] = None
+        super().__init__(environment_configuration)
+
+        # Messages of episode i: trace_messages[episode_starts[i]:episode_starts[i + 1]]
+        episodes = np.asarray(self.trace_messages['episode'])
+        is_episode_start = np.ones(len(episodes), dtype=bool)
+        is_episode_start[1:] = episodes[1:] != episodes[:-1]
+        self.episode_starts: np.ndarray = np.append(np.flatnonzero(is_episode_start), len(episodes))
+        self.number_trace_episodes: int = len(self.episode_starts) - 1
+        self.trace_episode: int = -1
+
+    def reset(self, seed=None, options=None):
+        if options is not None and 'episode' in options:
+            self.trace_episode = options['episode']
+        else:
+            self.trace_episode = (self.trace_episode + 1) % self.number_trace_episodes
+        return super().reset(seed=seed, options=options)
+
+    def _get_trace_episode_slice(self) -> slice:
+        return slice(self.episode_starts[self.trace_episode], self.episode_starts[self.trace_episode + 1])
+
+    def _draw_factor_outcome_uniforms(self):
+        self.factor_outcome_uniforms = self.trace_messages['factor_outcome_uniforms'][self._get_trace_episode_slice()]
+        self.factor_outcome_block_size = len(self.factor_outcome_uniforms)
+        self.factor_outcome_cursor = 0
+
+    def _create_messages(self):
+        episode_slice = self._get_trace_episode_slice()
+        self._set_message_chunk({
+            'criticality': self.trace_messages['criticality'][episode_slice],
+            'trust': self.trace_messages['trust'][episode_slice],
+            'is_real_source': self.trace_messages['is_real_source'][episode_slice],
+        })
+        self.number_messages = episode_slice.stop - episode_slice.start
+        if self.observation_buffers is not None:
+            self.observation_buffers['number_messages'][0] = self.number_messages
@@ -0,0 +1,217 @@
+from typing import Callable, Union
+import gymnasium as gym
+from gymnasium import spaces
+from gymnasium.vector.utils import batch_space
+import numpy as np
+
+from environments.identification_management.configuration import default_environment_configuration
+from environments.identification_management.Identification_management import create_message_columns, \
+    create_seed_sequence
+
+
+class VectorizedIdentificationManagement(gym.Env):
+    # Steps number_environments independent IdentificationManagement episodes at once, every per-episode quantity is
+    # stored as an array whose first dimension is the episode index. Reward and termination follow the scalar
+    # environment, a terminated episode stays terminated (reward 0) until the next reset.
+    def __init__(self, environment_configuration=None):
+        if environment_configuration is None:
+            environment_configuration = {}
+
+        self.number_environments: int = environment_configuration.get('number_environments', 1)
+
+        self.message_configuration: Callable = environment_configuration.get(
+            'message_configuration', default_environment_configuration['message_configuration']
+        )
+        self.matrix_identification_factors: np.ndarray = environment_configuration.get(
+            'matrix_identification_factors', default_environment_configuration['matrix_identification_factors'])
+        self.number_identification_factors: int = self.matrix_identification_factors.shape[0]
+        self.number_messages: int = environment_configuration.get(
+            'number_messages', default_environment_configuration['number_messages'])
+        self.maximum_energy: float = environment_configuration.get(
+            'maximum_energy', default_environment_configuration['maximum_energy'])
+
+        self.factors_energy_cost: np.ndarray = self.matrix_identification_factors[:, 0]
+        self.factors_percentage_correct_responses: np.ndarray = self.matrix_identification_factors[:, 1]
+
+        # Shape (number_environments, number_messages)
+        self.messages_criticality: Union[np.ndarray, None] = None
+        self.messages_trust: Union[np.ndarray, None] = None
+        self.messages_is_real_source: Union[np.ndarray, None] = None
+
+        # Shape (number_environments, ...)
+        self.response_identification_factors: Union[np.ndarray, None] = None
+        self.position_current_message: Union[np.ndarray, None] = None
+        self.current_energy: Union[np.ndarray, None] = None
+        self.is_terminated: Union[np.ndarray, None] = None
+        self.is_truncated: Union[np.ndarray, None] = None
+
+        self.environment_indices: np.ndarray = np.arange(self.number_environments)
+
+        self.seed_sequence: Union[np.random.SeedSequence, None] = None
+        self.episode_seed_sequence: Union[np.random.SeedSequence, None] = None
+        self.generator: Union[np.random.Generator, None] = None
+        self.factor_outcome_generator: Union[np.random.Generator, None] = None
+        self._seed(environment_configuration.get('seed', default_environment_configuration['seed']))
+
+        self.single_observation_space = spaces.Dict(
+            {
+                'matrix_identification_factors': spaces.Box(
+                    low=np.finfo(np.float64).min/2,
+                    high=np.finfo(np.float64).max/2,
+                    shape=self.matrix_identification_factors.shape,
+                    dtype=np.float64),
+                'response_identification_factors': spaces.Box(
+                    low=-1,
+                    high=1,
+                    shape=(self.number_identification_factors,),
+                    dtype=np.int32),
+                'current_energy': spaces.Box(
+                    low=0,
+                    high=np.finfo(np.float64).max/2,
+                    shape=(1,),
+                    dtype=np.float64),
+                'position_current_message': spaces.Box(
+                    low=0,
+                    high=np.iinfo(np.int32).max/2,
+                    shape=(1,),
+                    dtype=np.int32),
+                'number_messages': spaces.Box(
+                    low=0,
+                    high=np.iinfo(np.int32).max/2,
+                    shape=(1,),
+                    dtype=np.int32),
+                'current_message_criticality': spaces.Box(
+                    low=np.finfo(np.float64).min/2,
+                    high=np.finfo(np.float64).max/2,
+                    shape=(1,),
+                    dtype=np.float64),
+                'current_message_trust': spaces.Box(
+                    low=np.finfo(np.float64).min/2,
+                    high=np.finfo(np.float64).max/2,
+                    shape=(1,),
+                    dtype=np.float64),
+            }
+        )
+        self.single_action_space = spaces.Dict(
+            {
+                'is_real_source': spaces.Discrete(
+                    n=3),
+                'calling_identification_factors': spaces.MultiDiscrete(
+                    np.full((self.number_identification_factors,), 2)),
+            }
+        )
+        self.observation_space = batch_space(self.single_observation_space, self.number_environments)
+        self.action_space = batch_space(self.single_action_space, self.number_environments)
+
+    def _seed(self, seed: Union[int, np.random.SeedSequence, None]):
+        self.seed_sequence = create_seed_sequence(seed)
+        self.episode_seed_sequence = self.seed_sequence.spawn(1)[0]
+
+    def reset(self, seed=None, options=None):
+        if seed is not None:
+            self._seed(seed)
+        message_seed_sequence, factor_outcome_seed_sequence = self.episode_seed_sequence.spawn(1)[0].spawn(2)
+        self.generator = np.random.default_rng(message_seed_sequence)
+        self.factor_outcome_generator = np.random.default_rng(factor_outcome_seed_sequence)
+
+        self._create_messages()
+
+        self.current_energy = np.full(self.number_environments, self.maximum_energy, dtype=np.float64)
+        self.position_current_message = np.zeros(self.number_environments, dtype=np.int32)
+        self.response_identification_factors = np.zeros(
+            (self.number_environments, self.number_identification_factors), dtype=np.int32)
+
+        self.is_terminated = np.zeros(self.number_environments, dtype=bool)
+        self.is_truncated = np.zeros(self.number_environments, dtype=bool)
+
+        return self._get_observation(), self._get_information()
+
+    def _create_messages(self):
+        shape = (self.number_environments, self.number_messages)
+        columns = create_message_columns(
+            self.message_configuration, self.number_environments * self.number_messages, self.generator)
+        self.messages_criticality = columns['criticality'].reshape(shape)
+        self.messages_trust = columns['trust'].reshape(shape)
+        self.messages_is_real_source = columns['is_real_source'].reshape(shape)
+
+    def step(self, action: dict):
+        action_is_real_source: np.ndarray = np.asarray(action['is_real_source'], dtype=np.int64) - 1
+        action_calling_identification_factors: np.ndarray = np.asarray(action['calling_identification_factors'])
+
+        is_active = ~(self.is_terminated | self.is_truncated)
+        current_criticality, current_trust, current_is_real_source = self._get_current_message()
+        message_reward = current_criticality * current_trust
+
+        is_deciding = is_active & (action_is_real_source != 0)
+        is_calling = is_active & (action_is_real_source == 0)
+
+        is_correct = (action_is_real_source == 1) == current_is_real_source
+        reward = np.where(is_deciding, np.where(is_correct, message_reward, -1 * message_reward), 0.0)
+
+        made_mistake = self._calling_identification_factors(action_calling_identification_factors, is_calling)
+        is_penalized = is_calling & (made_mistake | np.all(action_calling_identification_factors == 0, axis=-1))
+        reward = np.where(is_penalized, -1 * message_reward, reward)
+
+        self._next_message(is_deciding | is_penalized)
+
+        return self._get_observation(), reward, self.is_terminated.copy(), self.is_truncated.copy(), \
+            self._get_information()
+
+    def _get_current_message(self):
+        position = np.minimum(self.position_current_message, self.number_messages - 1)
+        return self.messages_criticality[self.environment_indices, position], \
+            self.messages_trust[self.environment_indices, position], \
+            self.messages_is_real_source[self.environment_indices, position]
+
+    def _next_message(self, is_leaving_message: np.ndarray):
+        is_last_message = self.position_current_message >= self.number_messages - 1
+        self.is_terminated |= is_leaving_message & is_last_message
+
+        is_moving = is_leaving_message & ~is_last_message
+        self.position_current_message[is_moving] += 1
+        self.response_identification_factors[is_moving] = 0
+
+    def _calling_identification_factors(self, calling: np.ndarray, is_calling: np.ndarray) -> np.ndarray:
+        made_mistake: np.ndarray = np.zeros(self.number_environments, dtype=bool)
+        _, _, current_is_real_source = self._get_current_message()
+        response_if_correct = np.where(current_is_real_source, 1, -1).astype(np.int32)
+        factor_outcome_uniforms = self.factor_outcome_generator.random(
+            (self.number_environments, self.number_identification_factors))
+
+        # Factors are processed in index order so that the energy is consumed exactly as in the scalar environment.
+        for i in range(self.number_identification_factors):
+            is_calling_factor = is_calling & (calling[:, i] == 1)
+            was_called = self.response_identification_factors[:, i] != 0
+            is_affordable = self.current_energy >= self.factors_energy_cost[i]
+
+            is_valid_call = is_calling_factor & ~was_called & is_affordable
+            made_mistake |= is_calling_factor & (was_called | ~is_affordable)
+
+            self.current_energy[is_valid_call] -= self.factors_energy_cost[i]
+            is_correct_response = factor_outcome_uniforms[:, i] < self.factors_percentage_correct_responses[i]
+            response = np.where(is_correct_response, response_if_correct, -1 * response_if_correct)
+            self.response_identification_factors[is_valid_call, i] = response[is_valid_call]
+
+        return made_mistake
+
+    def _get_observation(self):
+        current_criticality, current_trust, _ = self._get_current_message()
+        observation = {
+            'matrix_identification_factors': np.broadcast_to(
+                self.matrix_identification_factors, (self.number_environments,) + self.matrix_identification_factors.shape),
+            'response_identification_factors': self.response_identification_factors.copy(),
+            'current_energy': self.current_energy[:, np.newaxis].copy(),
+            'number_messages': np.full((self.number_environments, 1), self.number_messages, dtype=np.int32),
+            'position_current_message': self.position_current_message[:, np.newaxis].copy(),
+            'current_message_criticality': current_criticality[:, np.newaxis],
+            'current_message_trust': current_trust[:, np.newaxis],
+        }
+        return observation
+
+    def _get_information(self):
+        current_criticality, current_trust, current_is_real_source = self._get_current_message()
+        return {'message': {
+            'criticality': current_criticality,
+            'trust': current_trust,
+            'is_real_source': current_is_real_source,
+        }}
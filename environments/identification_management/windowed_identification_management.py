@@ -0,0 +1,227 @@
+from collections import deque
+from typing import Union
+
+from gymnasium import spaces
+import numpy as np
+
+from environments.identification_management.Identification_management import IdentificationManagement
+
+
+class WindowedIdentificationManagement(IdentificationManagement):
+    # The agent sees the number_window_messages oldest undecided messages (the window) and acts on all of them in one
+    # step, under the shared current_energy. The slots are processed in the order of the messages, each one with the
+    # rules of IdentificationManagement for its own message:
+    #   is_real_source 0 or 2       decides the message (the calls of the slot are ignored)
+    #   is_real_source 1            calls the factors of calling_identification_factors[slot], the message stays in
+    #                               the window with its responses, unless a call is invalid (the message is skipped
+    #                               with the negative reward)
+    # except that a slot calling no factor waits (the message stays in the window, no reward), only the first slot is
+    # skipped when it calls nothing, so that every episode ends. The decided and skipped messages leave the window,
+    # the next messages of the episode fill it. The rewards of the step are summed.
+    #
+    # The factor outcomes of the message at position p are the row p of the blocks drawn by IdentificationManagement:
+    # with number_window_messages=1, or a policy acting on the first slot only, the episode is exactly the one of
+    # IdentificationManagement with the same seed. The messages cannot come from a message_source and the spaces
+    # cannot be flat.
+    def __init__(self, environment_configuration=None):
+        if environment_configuration is None:
+            environment_configuration = {}
+        if environment_configuration.get('message_source') is not None:
+            raise ValueError('The windowed environment does not support a message_source.')
+        if environment_configuration.get('flat_spaces', False):
+            raise ValueError('The windowed environment does not support flat_spaces.')
+        self.number_window_messages: int = environment_configuration.get('number_window_messages', 8)
+
+        # Positions of the messages of the window, -1 for an empty slot (the slots are filled from the first one),
+        # with their responses (one row per slot)
+        self.window_positions: np.ndarray = np.full(self.number_window_messages, -1, dtype=np.int64)
+        self.window_responses: Union[np.ndarray, None] = None
+        self.next_position: Union[int, None] = None
+        # Blocks of factor outcome uniforms from the block of the first message of the window on, the block i holds
+        # the rows of the positions i * factor_outcome_block_size ...
+        self.factor_outcome_blocks: deque = deque()
+        self.index_first_factor_outcome_block: int = 0
+
+        super().__init__(environment_configuration)
+
+        number_window_messages = self.number_window_messages
+        number_observed_identification_factors = self.number_observed_identification_factors
+        self.window_responses = np.zeros((number_window_messages, number_observed_identification_factors),
+                                         dtype=np.int32)
+        observation_spaces = dict(self.observation_space.spaces)
+        del observation_spaces['current_message_criticality'], observation_spaces['current_message_trust']
+        observation_spaces.update({
+            'response_identification_factors': spaces.Box(
+                low=-1,
+                high=1,
+                shape=(number_window_messages, number_observed_identification_factors),
+                dtype=np.int32),
+            'window_messages_criticality': spaces.Box(
+                low=np.finfo(np.float64).min/2,
+                high=np.finfo(np.float64).max/2,
+                shape=(number_window_messages,),
+                dtype=np.float64),
+            'window_messages_trust': spaces.Box(
+                low=np.finfo(np.float64).min/2,
+                high=np.finfo(np.float64).max/2,
+                shape=(number_window_messages,),
+                dtype=np.float64),
+            'valid_window_messages': spaces.Box(
+                low=0,
+                high=1,
+                shape=(number_window_messages,),
+                dtype=np.int32),
+        })
+        self.observation_space = spaces.Dict(observation_spaces)
+        self.action_space = spaces.Dict(
+            {
+                'is_real_source': spaces.MultiDiscrete(
+                    np.full((number_window_messages,), 3)),
+                'calling_identification_factors': spaces.MultiDiscrete(
+                    np.full((number_window_messages, number_observed_identification_factors), 2)),
+            }
+        )
+        self.dict_observation_space = self.observation_space
+        self.dict_action_space = self.action_space
+
+    def _start_episode(self):
+        super()._start_episode()
+        self.factor_outcome_blocks.clear()
+        self.factor_outcome_blocks.append(self.factor_outcome_uniforms.copy())
+        self.index_first_factor_outcome_block = 0
+        self.window_positions.fill(-1)
+        self.window_responses.fill(0)
+        self.next_position = 0
+        self._fill_window(0)
+
+    def _get_factor_outcome_uniforms(self, position: int) -> np.ndarray:
+        index_block, index_row = divmod(position, self.factor_outcome_block_size)
+        while index_block >= self.index_first_factor_outcome_block + len(self.factor_outcome_blocks):
+            # Drawn in order from the factor outcome generator, as IdentificationManagement draws them
+            self._draw_factor_outcome_uniforms()
+            self.factor_outcome_blocks.append(self.factor_outcome_uniforms.copy())
+        return self.factor_outcome_blocks[index_block - self.index_first_factor_outcome_block][index_row]
+
+    def _fill_window(self, number_kept_messages: int):
+        # The slots from number_kept_messages on get the next messages of the episode
+        self.window_positions[number_kept_messages:] = -1
+        self.window_responses[number_kept_messages:] = 0
+        number_new_messages = min(self.number_window_messages - number_kept_messages,
+                                  self.number_messages - self.next_position)
+        self.window_positions[number_kept_messages:number_kept_messages + number_new_messages] = np.arange(
+            self.next_position, self.next_position + number_new_messages)
+        self.next_position += number_new_messages
+
+        if self.window_positions[0] < 0:
+            self.is_terminated = True
+            return
+        self.position_current_message = int(self.window_positions[0])
+        self.message_index = self.position_current_message
+        # The blocks before the one of the first message of the window are not needed anymore
+        index_first_block = self.position_current_message // self.factor_outcome_block_size
+        while self.index_first_factor_outcome_block < index_first_block and len(self.factor_outcome_blocks) > 1:
+            self.factor_outcome_blocks.popleft()
+            self.index_first_factor_outcome_block += 1
+
+    def step(self, action: dict):
+        self.current_action = action
+        instrumentation = self.instrumentation
+        if instrumentation is not None:
+            instrumentation.count('steps')
+        actions_is_real_source: np.ndarray = np.asarray(action['is_real_source'])
+        actions_calling_identification_factors: np.ndarray = np.asarray(action['calling_identification_factors'])
+        number_identification_factors = self.number_identification_factors
+        reward: float = 0
+
+        number_kept_messages = 0
+        for slot in range(self.number_window_messages):
+            position = int(self.window_positions[slot])
+            if position < 0:
+                break
+            message_reward: float = self.messages_criticality[position] * self.messages_trust[position]
+            is_real_source: bool = bool(self.messages_is_real_source[position])
+            action_is_real_source: int = int(actions_is_real_source[slot]) - 1
+            is_kept = False
+
+            if action_is_real_source != 0:
+                if instrumentation is not None:
+                    instrumentation.count('messages_decided')
+                if self.int_to_bool[action_is_real_source] == is_real_source:
+                    reward += message_reward
+                else:
+                    reward -= message_reward
+            else:
+                calling = actions_calling_identification_factors[slot]
+                if np.all(calling[:number_identification_factors] == 0):
+                    # Waits, except the first message of the window
+                    is_kept = slot > 0
+                else:
+                    is_kept = not self._call_identification_factors(
+                        calling, is_real_source, self._get_factor_outcome_uniforms(position),
+                        self.window_responses[slot])
+                if not is_kept:
+                    if instrumentation is not None:
+                        instrumentation.count('messages_skipped')
+                    reward -= message_reward
+
+            if is_kept:
+                if number_kept_messages != slot:
+                    self.window_positions[number_kept_messages] = position
+                    self.window_responses[number_kept_messages] = self.window_responses[slot]
+                number_kept_messages += 1
+        self._fill_window(number_kept_messages)
+
+        if self.render_mode == 'text':
+            if self.event_logger is None:
+                self.render()
+            elif self.event_logger.is_sampled('step'):
+                self.event_logger.record('step', {
+                    'position_current_message': self.position_current_message,
+                    'is_real_source': actions_is_real_source.tolist(),
+                    'calling_identification_factors': actions_calling_identification_factors.tolist(),
+                    'reward': float(reward),
+                    'current_energy': float(self.current_energy),
+                    'terminated': self.is_terminated,
+                })
+
+        observation = self._get_observation()
+        information = self._get_information(observation)
+        return observation, reward, self.is_terminated, self.is_truncated, information
+
+    def _get_observation(self):
+        # A new dict of arrays at every step, also with reuse_observation
+        positions = self.window_positions
+        valid_window_messages = positions >= 0
+        message_positions = np.where(valid_window_messages, positions, 0)
+        observation = {
+            'matrix_identification_factors': self.observed_matrix_identification_factors,
+            'response_identification_factors': self.window_responses.copy(),
+            'current_energy': np.array([self.current_energy], dtype=np.float64),
+            'number_messages': np.array([self.number_messages], dtype=np.int32),
+            'position_current_message': np.array([self.position_current_message], dtype=np.int32),
+            'window_messages_criticality': np.where(
+                valid_window_messages, self.messages_criticality[message_positions], 0),
+            'window_messages_trust': np.where(valid_window_messages, self.messages_trust[message_positions], 0),
+            'valid_window_messages': valid_window_messages.astype(np.int32),
+        }
+        if self.valid_identification_factors is not None:
+            observation['valid_identification_factors'] = self.valid_identification_factors
+        return observation
+
+    def _build_information(self, observation: Union[dict, None] = None):
+        if observation is None:
+            observation = self._get_observation()
+        information = {'observation': observation}
+        information.update({'messages': [
+            {
+                'position': int(position),
+                'criticality': float(self.messages_criticality[position]),
+                'trust': float(self.messages_trust[position]),
+                'is_real_source': bool(self.messages_is_real_source[position]),
+            }
+            for position in self.window_positions if position >= 0
+        ]})
+        if self.current_action is not None:
+            information.update({'action': self.current_action})
+
+        return information
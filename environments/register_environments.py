@@ -1,7 +1,10 @@
 from ray.tune.registry import register_env
 
 from environments.identification_management.Identification_management import IdentificationManagement
+from environments.identification_management.windowed_identification_management import \
+    WindowedIdentificationManagement
 
 
 def register_environments():
     register_env(name='IdentificationManagement', env_creator=IdentificationManagement)
+    register_env(name='WindowedIdentificationManagement', env_creator=WindowedIdentificationManagement)
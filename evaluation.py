@@ -0,0 +1,283 @@
+from concurrent.futures import ProcessPoolExecutor
+import math
+import os
+from statistics import NormalDist
+from typing import Callable, Iterable, Union
+
+import gymnasium as gym
+import numpy as np
+
+from environments.identification_management.Identification_management import IdentificationManagement
+from environments.identification_management.vectorized_identification_management import \
+    VectorizedIdentificationManagement
+from instrumentation import Instrumentation
+from policies.abstract import Policy
+
+
+def play_episode(environment: gym.Env, policy: Policy, seed: Union[int, None] = None,
+                 instrumentation: Union[Instrumentation, None] = None, options: Union[dict, None] = None):
+    if instrumentation is not None:
+        return _play_episode_instrumented(environment, policy, seed, instrumentation, options)
+
+    observation, information = environment.reset(seed=seed, options=options)
+    policy.reset(seed=seed)
+    total_reward = 0
+
+    continue_play = True
+    while continue_play:
+        action = policy.action(observation)
+        observation, reward, terminated, truncated, information = environment.step(action)
+        total_reward += reward
+
+        if terminated is True or truncated is True:
+            continue_play = False
+
+    return total_reward
+
+
+def _play_episode_instrumented(environment: gym.Env, policy: Policy, seed: Union[int, None],
+                               instrumentation: Instrumentation, options: Union[dict, None] = None):
+    start = instrumentation.start()
+    observation, information = environment.reset(seed=seed, options=options)
+    policy.reset(seed=seed)
+    instrumentation.stop('reset', start)
+    total_reward = 0
+
+    continue_play = True
+    while continue_play:
+        start = instrumentation.start()
+        action = policy.action(observation)
+        instrumentation.stop('policy_action', start)
+
+        start = instrumentation.start()
+        observation, reward, terminated, truncated, information = environment.step(action)
+        instrumentation.stop('environment_step', start)
+        total_reward += reward
+
+        if terminated is True or truncated is True:
+            continue_play = False
+
+    return total_reward
+
+
+def get_episode_seeds(number_episodes: int, seed: Union[int, None] = None) -> list:
+    # Episode i is played with the seed `seed + i`, so any split of the episodes into contiguous shards gives each
+    # shard a range of seeds that does not overlap the others.
+    if seed is None:
+        return [None] * number_episodes
+    return [seed + index_episode for index_episode in range(number_episodes)]
+
+
+def schedule_episode_seeds(environment: gym.Env, seeds: Iterable):
+    # Lets an environment prefetching its episodes build the episodes of the next seeds ahead
+    schedule = getattr(environment.unwrapped, 'schedule_episode_seeds', None)
+    if schedule is not None:
+        schedule(seeds)
+
+
+def play_episodes(environment: gym.Env, policy: Policy, seeds: list,
+                  instrumentation: Union[Instrumentation, None] = None) -> list:
+    if len(seeds) > 0 and seeds[0] is not None:
+        schedule_episode_seeds(environment, seeds)
+    return [play_episode(environment, policy, seed, instrumentation) for seed in seeds]
+
+
+def play_iteration(environment: gym.Env, policy: Policy, number_episodes: int, seed: Union[int, None] = None,
+                   instrumentation: Union[Instrumentation, None] = None):
+    # The same Instrumentation can also be given to the environment ('instrumentation' key of its configuration) to
+    # split the environment step into its phases.
+    if instrumentation is not None:
+        instrumentation.start_run()
+    rewards = play_episodes(environment, policy, get_episode_seeds(number_episodes, seed), instrumentation)
+    if instrumentation is not None:
+        instrumentation.stop_run()
+    return mean_reward(rewards)
+
+
+def mean_reward(rewards: list) -> float:
+    total_reward: float = 0
+    for reward in rewards:
+        total_reward += reward
+    reward_episode_mean = total_reward / float(len(rewards))
+    return reward_episode_mean
+
+
+class RunningStatistics:
+    # Mean, variance (Welford's streaming update), minimum and maximum of the samples added so far
+    def __init__(self):
+        self.number_samples: int = 0
+        self.mean: float = 0
+        self.sum_squared_deviations: float = 0
+        self.minimum: float = math.inf
+        self.maximum: float = -math.inf
+
+    def add(self, sample: float):
+        self.number_samples += 1
+        delta = sample - self.mean
+        self.mean += delta / self.number_samples
+        self.sum_squared_deviations += delta * (sample - self.mean)
+        self.minimum = min(self.minimum, sample)
+        self.maximum = max(self.maximum, sample)
+
+    @property
+    def variance(self) -> float:
+        # Unbiased sample variance
+        if self.number_samples < 2:
+            return math.inf
+        return self.sum_squared_deviations / (self.number_samples - 1)
+
+    def confidence_half_width(self, confidence: float = 0.95) -> float:
+        # Normal approximation of the confidence interval of the mean
+        if self.number_samples < 2:
+            return math.inf
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        return z * math.sqrt(self.variance / self.number_samples)
+
+    def summary(self, confidence: float = 0.95) -> dict:
+        half_width = self.confidence_half_width(confidence)
+        return {
+            'mean': self.mean,
+            'variance': self.variance,
+            'standard_deviation': math.sqrt(self.variance),
+            'confidence': confidence,
+            'confidence_half_width': half_width,
+            'confidence_interval': (self.mean - half_width, self.mean + half_width),
+            'minimum': self.minimum,
+            'maximum': self.maximum,
+            'number_samples': self.number_samples,
+        }
+
+
+def play_until_precision(environment: gym.Env, policy: Policy, target_half_width: float, confidence: float = 0.95,
+                         minimum_number_episodes: int = 30, maximum_number_episodes: int = 10000,
+                         seed: Union[int, None] = None, antithetic: bool = False) -> dict:
+    # Plays episodes (episode i with the seed seed + i) until the confidence interval of the mean episode reward is
+    # at most target_half_width on each side, or maximum_number_episodes were played. With antithetic, every seed is
+    # played twice, the second time with antithetic factor outcomes (same messages), and the mean of the pair is one
+    # sample. It only pays off when the factor outcomes drive the variance of the reward, check with the number of
+    # episodes reported.
+    def play_sample(episode_seed: int) -> float:
+        reward = play_episode(environment, policy, episode_seed)
+        if antithetic:
+            reward = (reward + play_episode(environment, policy, episode_seed, options={'antithetic': True})) / 2
+        return reward
+
+    summary = _sample_until_precision(environment, play_sample, 2 if antithetic else 1, target_half_width,
+                                      confidence, minimum_number_episodes, maximum_number_episodes, seed)
+    summary['antithetic'] = antithetic
+    return summary
+
+
+def compare_until_precision(environment: gym.Env, policy: Policy, other_policy: Policy, target_half_width: float,
+                            confidence: float = 0.95, minimum_number_episodes: int = 30,
+                            maximum_number_episodes: int = 10000, seed: Union[int, None] = None) -> dict:
+    # Same as play_until_precision on the difference of episode reward between policy and other_policy, both playing
+    # every seed: on common messages and factor outcomes the variance they share cancels in the difference, a clear
+    # difference is settled in a few episodes and a close one gets as many as needed.
+    def play_sample(episode_seed: int) -> float:
+        return play_episode(environment, policy, episode_seed) - play_episode(environment, other_policy, episode_seed)
+
+    return _sample_until_precision(environment, play_sample, 2, target_half_width, confidence,
+                                   minimum_number_episodes, maximum_number_episodes, seed)
+
+
+def _sample_until_precision(environment: gym.Env, play_sample: Callable, episodes_per_sample: int,
+                            target_half_width: float, confidence: float, minimum_number_episodes: int,
+                            maximum_number_episodes: int, seed: Union[int, None]) -> dict:
+    if seed is None:
+        seed = int(np.random.SeedSequence().generate_state(1)[0])
+    minimum_number_samples = max(2, math.ceil(minimum_number_episodes / episodes_per_sample))
+    # Every episode of a sample is played with the seed of the sample, the schedule is only built ahead as far as
+    # the prefetcher goes
+    maximum_number_samples = maximum_number_episodes // episodes_per_sample
+    schedule_episode_seeds(environment, (seed + index_sample for index_sample in range(maximum_number_samples)
+                                         for _ in range(episodes_per_sample)))
+
+    statistics = RunningStatistics()
+    while (statistics.number_samples + 1) * episodes_per_sample <= maximum_number_episodes:
+        statistics.add(float(play_sample(seed + statistics.number_samples)))
+        if statistics.number_samples >= minimum_number_samples and \
+                statistics.confidence_half_width(confidence) <= target_half_width:
+            break
+
+    summary = statistics.summary(confidence)
+    summary.update({
+        'number_episodes': statistics.number_samples * episodes_per_sample,
+        'is_target_reached': summary['confidence_half_width'] <= target_half_width,
+        'seed': seed,
+    })
+    return summary
+
+
+def check_padded_identification_factors(policy_class: type, environment_configuration: dict):
+    if environment_configuration.get('maximum_number_identification_factors') is not None and \
+            not policy_class.reads_padded_identification_factors:
+        raise ValueError(f'{policy_class.__name__} cannot play identification factors padded to '
+                         f'maximum_number_identification_factors, only the network policy can.')
+
+
+def create_environment_and_policy(environment_configuration: dict, policy_class: type,
+                                  policy_configuration: Union[dict, None] = None):
+    if policy_configuration is None:
+        policy_configuration = {}
+    check_padded_identification_factors(policy_class, environment_configuration)
+    environment = IdentificationManagement(environment_configuration=environment_configuration)
+    policy = policy_class(environment.observation_space, environment.action_space, **policy_configuration)
+    return environment, policy
+
+
+def _play_shard(environment_configuration: dict, policy_class: type, policy_configuration: Union[dict, None],
+                seeds: list) -> list:
+    environment, policy = create_environment_and_policy(environment_configuration, policy_class, policy_configuration)
+    rewards = play_episodes(environment, policy, seeds)
+    # Writes what the environment buffered (e.g. its events) before the process of the pool exits
+    environment.close()
+    return rewards
+
+
+def play_episodes_parallel(environment_configuration: dict, policy_class: type, seeds: list,
+                           policy_configuration: Union[dict, None] = None,
+                           number_processes: Union[int, None] = None) -> list:
+    if number_processes is None:
+        number_processes = os.cpu_count()
+    number_processes = max(1, min(number_processes, len(seeds)))
+
+    # Contiguous shards, the rewards are concatenated back in episode order
+    shards = [list(shard) for shard in np.array_split(np.array(seeds, dtype=object), number_processes)]
+    with ProcessPoolExecutor(max_workers=number_processes) as executor:
+        futures = [
+            executor.submit(_play_shard, environment_configuration, policy_class, policy_configuration, shard)
+            for shard in shards
+        ]
+        return [reward for future in futures for reward in future.result()]
+
+
+def play_iteration_parallel(environment_configuration: dict, policy_class: type, number_episodes: int,
+                            seed: Union[int, None] = None, policy_configuration: Union[dict, None] = None,
+                            number_processes: Union[int, None] = None) -> tuple:
+    # Without seed the workers would all start from fresh entropy, a base seed is drawn so that the run can be
+    # reported and replayed: returns the mean reward and the seed of the run (the one given or the one drawn).
+    if seed is None:
+        seed = int(np.random.SeedSequence().generate_state(1)[0])
+
+    rewards = play_episodes_parallel(environment_configuration, policy_class,
+                                     get_episode_seeds(number_episodes, seed), policy_configuration, number_processes)
+    return mean_reward(rewards), seed
+
+
+def play_vectorized_episodes(environment: VectorizedIdentificationManagement, policy: Policy,
+                             seed: Union[int, None] = None) -> np.ndarray:
+    observations, information = environment.reset(seed=seed)
+    policy.reset_batch(environment.number_environments, seed)
+    total_rewards = np.zeros(environment.number_environments, dtype=np.float64)
+
+    continue_play = True
+    while continue_play:
+        actions = policy.action_batch(observations)
+        observations, rewards, terminated, truncated, information = environment.step(actions)
+        total_rewards += rewards
+
+        if np.all(terminated | truncated):
+            continue_play = False
+
+    return total_rewards
@@ -0,0 +1,179 @@
+from collections import defaultdict, deque
+import json
+import os
+import pickle
+import queue
+import random
+import threading
+import time
+from typing import Iterator, Union
+
+import numpy as np
+
+# Structured events of the environment (invalid factor calls, steps with render_mode='text', ...), recorded in memory
+# and written in batches instead of printed. Every event is counted, only a sampled fraction of each type is recorded:
+# an environment of a training worker can keep a logger at no noticeable cost per step.
+#
+# 'jsonl' files hold one JSON object per event, 'binary' files a sequence of pickled batches (lists of events), both
+# are read back by read_events. An event is a dict with the keys 'time', 'event' and the fields given to log.
+
+EVENT_FILE_FORMATS = ('jsonl', 'binary')
+
+
+def json_serializer(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f'Type {type(value).__name__} not serializable')
+
+
+class EventLogger:
+    # path may contain {pid}, replaced by the identifier of the process when the file is opened: a logger given in the
+    # configuration of environments created in several processes (it is pickled without its buffer, file and thread)
+    # then writes one file per process. Without path, the events are counted and only the last buffer_size are kept
+    # in memory. With background=True, the batches are written by a thread, log never waits for the disk unless
+    # maximum_pending_batches batches are already waiting.
+    def __init__(self, path: Union[str, None] = None, file_format: str = 'jsonl',
+                 sampling_rates: Union[dict, None] = None, default_sampling_rate: float = 1.0,
+                 buffer_size: int = 4096, background: bool = False, maximum_pending_batches: int = 8,
+                 seed: Union[int, None] = None):
+        if file_format not in EVENT_FILE_FORMATS:
+            raise ValueError(f'Unknown file format {file_format}, expected one of {EVENT_FILE_FORMATS}.')
+        self.path: Union[str, None] = path
+        self.file_format: str = file_format
+        self.sampling_rates: dict = dict(sampling_rates or {})
+        self.default_sampling_rate: float = default_sampling_rate
+        self.buffer_size: int = buffer_size
+        self.background: bool = background
+        self.maximum_pending_batches: int = maximum_pending_batches
+        self.seed: Union[int, None] = seed
+        self._initialize()
+
+    def _initialize(self):
+        self.counters: defaultdict = defaultdict(int)
+        self.recorded_counters: defaultdict = defaultdict(int)
+        # Without path, a ring of the last buffer_size events
+        self.events: Union[list, deque] = [] if self.path is not None else deque(maxlen=self.buffer_size)
+        self.generator: random.Random = random.Random(self.seed)
+        self.file = None
+        self.batches: Union[queue.Queue, None] = None
+        self.thread: Union[threading.Thread, None] = None
+        self.exception: Union[BaseException, None] = None
+
+    def __getstate__(self):
+        return {
+            'path': self.path,
+            'file_format': self.file_format,
+            'sampling_rates': self.sampling_rates,
+            'default_sampling_rate': self.default_sampling_rate,
+            'buffer_size': self.buffer_size,
+            'background': self.background,
+            'maximum_pending_batches': self.maximum_pending_batches,
+            'seed': self.seed,
+        }
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self._initialize()
+
+    def is_sampled(self, event_type: str) -> bool:
+        # Counts the event and decides whether it is recorded, the fields of an event not recorded are not even built
+        self.counters[event_type] += 1
+        sampling_rate = self.sampling_rates.get(event_type, self.default_sampling_rate)
+        return sampling_rate >= 1 or (sampling_rate > 0 and self.generator.random() < sampling_rate)
+
+    def record(self, event_type: str, fields: dict):
+        # Records an event already counted by is_sampled
+        self.recorded_counters[event_type] += 1
+        event = {'time': time.time(), 'event': event_type}
+        event.update(fields)
+        self.events.append(event)
+        if self.path is not None and len(self.events) >= self.buffer_size:
+            self.flush()
+
+    def log(self, event_type: str, **fields):
+        if self.is_sampled(event_type):
+            self.record(event_type, fields)
+
+    def flush(self, wait: bool = False):
+        # wait: with background=True, also waits until the thread has written every batch
+        if self.exception is not None:
+            raise RuntimeError('The event logger failed to write.') from self.exception
+        if self.path is None or len(self.events) == 0:
+            return
+        events, self.events = self.events, []
+        if not self.background:
+            self._write(events)
+            return
+        if self.thread is None:
+            self.batches = queue.Queue(maxsize=self.maximum_pending_batches)
+            self.thread = threading.Thread(target=self._run, name='EventLogger', daemon=True)
+            self.thread.start()
+        self.batches.put(events)
+        if wait:
+            self.batches.join()
+
+    def _run(self):
+        while True:
+            events = self.batches.get()
+            if events is None:
+                self.batches.task_done()
+                return
+            if self.exception is None:
+                try:
+                    self._write(events)
+                except BaseException as exception:
+                    # Raised again by the next flush
+                    self.exception = exception
+            self.batches.task_done()
+
+    def _write(self, events: list):
+        if self.file is None:
+            path = self.path.format(pid=os.getpid())
+            directory = os.path.dirname(path)
+            if directory != '':
+                os.makedirs(directory, exist_ok=True)
+            self.file = open(path, 'a' if self.file_format == 'jsonl' else 'ab')
+        if self.file_format == 'jsonl':
+            self.file.write(''.join(json.dumps(event, default=json_serializer) + '\n' for event in events))
+        else:
+            pickle.dump(events, self.file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        if self.thread is not None:
+            self.batches.put(None)
+            self.thread.join()
+            self.thread = None
+            if self.exception is not None:
+                raise RuntimeError('The event logger failed to write.') from self.exception
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def summary(self) -> dict:
+        return {
+            'counters': dict(sorted(self.counters.items())),
+            'recorded_counters': dict(sorted(self.recorded_counters.items())),
+        }
+
+
+def read_events(path: str, file_format: Union[str, None] = None) -> Iterator[dict]:
+    # The format is deduced from the extension (.jsonl or not) when it is not given
+    if file_format is None:
+        file_format = 'jsonl' if path.endswith('.jsonl') else 'binary'
+    if file_format == 'jsonl':
+        with open(path) as file:
+            for line in file:
+                yield json.loads(line)
+        return
+
+    with open(path, 'rb') as file:
+        while True:
+            try:
+                events = pickle.load(file)
+            except EOFError:
+                return
+            yield from events
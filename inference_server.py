@@ -0,0 +1,254 @@
+import argparse
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import sys
+import time
+from typing import Callable, Union
+
+import numpy as np
+
+# Serves a policy to many concurrent callers: the requests (one flat observation each, see flat_spaces) are queued and
+# gathered into micro-batches, a batch is computed when it is full or when its oldest request has waited
+# maximum_delay_seconds. In-process with `await server.compute_action(observation)`, or over a local socket with
+# newline-delimited JSON: {"id": ..., "observation": [...]} answered by {"id": ..., "action": [...]}.
+#
+# python -m inference_server --checkpoint <checkpoint directory of train_deep_policy> [--port 8765]
+
+
+def load_checkpoint_compute_actions(checkpoint_path: str, policy_id: str = 'default_policy') -> Callable:
+    # The policy of an RLlib checkpoint (trained with flat_spaces=True) as a function from a batch of flat
+    # observations to a batch of flat actions, deterministic, on CPU. ray is only imported here.
+    os.environ['CUDA_VISIBLE_DEVICES'] = ''
+    from ray.rllib.policy.policy import Policy as RllibPolicy
+
+    policy = RllibPolicy.from_checkpoint(checkpoint_path)
+    if isinstance(policy, dict):
+        policy = policy[policy_id]
+
+    def compute_actions(observations: np.ndarray) -> np.ndarray:
+        actions, _, _ = policy.compute_actions(observations, explore=False)
+        return np.asarray(actions)
+
+    # Read by _serve, the requests of another shape are rejected
+    compute_actions.observation_shape = policy.observation_space.shape
+    return compute_actions
+
+
+class InferenceServer:
+    def __init__(self, compute_actions: Callable, maximum_batch_size: int = 256,
+                 maximum_delay_seconds: float = 0.002, number_latencies_kept: int = 100_000,
+                 observation_shape: Union[tuple, None] = None):
+        # compute_actions: batch of observations (stacked along a first dimension) to the batch of actions
+        # observation_shape: shape of every observation, the shape of the first request when not given. A request of
+        # another shape is rejected by compute_action.
+        self.compute_actions: Callable = compute_actions
+        self.observation_shape: Union[tuple, None] = None if observation_shape is None else tuple(observation_shape)
+        self.maximum_batch_size: int = maximum_batch_size
+        self.maximum_delay_seconds: float = maximum_delay_seconds
+
+        self.requests: Union[asyncio.Queue, None] = None
+        self.batching_task: Union[asyncio.Task, None] = None
+        # One thread computes the batches, the event loop keeps gathering the next one meanwhile
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='InferenceServer')
+
+        self.start_time: Union[float, None] = None
+        self.number_requests: int = 0
+        self.number_batches: int = 0
+        self.latencies_seconds: deque = deque(maxlen=number_latencies_kept)
+
+    async def start(self):
+        self.requests = asyncio.Queue()
+        self.start_time = time.perf_counter()
+        self.batching_task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.batching_task is not None:
+            self.batching_task.cancel()
+            try:
+                await self.batching_task
+            except asyncio.CancelledError:
+                pass
+            self.batching_task = None
+        # The requests still queued are never computed
+        while self.requests is not None and not self.requests.empty():
+            _, future, _ = self.requests.get_nowait()
+            self._fail([(None, future, None)], RuntimeError('The inference server is stopped.'))
+        self.executor.shutdown(wait=True)
+
+    async def compute_action(self, observation: np.ndarray) -> np.ndarray:
+        observation = np.asarray(observation)
+        if self.observation_shape is None:
+            self.observation_shape = observation.shape
+        elif observation.shape != self.observation_shape:
+            raise ValueError(f'The observation has the shape {observation.shape}, the server expects '
+                             f'{self.observation_shape}.')
+        future = asyncio.get_running_loop().create_future()
+        await self.requests.put((observation, future, time.perf_counter()))
+        return await future
+
+    @staticmethod
+    def _fail(batch: list, exception: BaseException):
+        for _, future, _ in batch:
+            if not future.done():
+                future.set_exception(exception)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.requests.get()]
+            deadline = batch[0][2] + self.maximum_delay_seconds
+            while len(batch) < self.maximum_batch_size:
+                remaining_seconds = deadline - time.perf_counter()
+                if remaining_seconds <= 0:
+                    # Whatever is already queued still joins the batch
+                    if self.requests.empty():
+                        break
+                    batch.append(self.requests.get_nowait())
+                    continue
+                try:
+                    batch.append(await asyncio.wait_for(self.requests.get(), remaining_seconds))
+                except asyncio.TimeoutError:
+                    break
+
+            # A failure only fails the requests of its batch, the loop keeps serving the next ones
+            try:
+                observations = np.stack([observation for observation, _, _ in batch])
+                actions = await loop.run_in_executor(self.executor, self.compute_actions, observations)
+            except asyncio.CancelledError:
+                self._fail(batch, RuntimeError('The inference server is stopped.'))
+                raise
+            except Exception as exception:
+                self._fail(batch, exception)
+                continue
+
+            end_time = time.perf_counter()
+            for (_, future, request_time), action in zip(batch, actions):
+                if not future.done():
+                    future.set_result(action)
+                self.latencies_seconds.append(end_time - request_time)
+            self.number_requests += len(batch)
+            self.number_batches += 1
+
+    def statistics(self) -> dict:
+        elapsed_seconds = time.perf_counter() - self.start_time if self.start_time is not None else 0
+        latencies_milliseconds = 1e3 * np.array(self.latencies_seconds)
+        has_latencies = len(latencies_milliseconds) > 0
+        return {
+            'number_requests': self.number_requests,
+            'number_batches': self.number_batches,
+            'mean_batch_size': self.number_requests / self.number_batches if self.number_batches > 0 else None,
+            'requests_per_second': self.number_requests / elapsed_seconds if elapsed_seconds > 0 else None,
+            'latency_p50_milliseconds': float(np.percentile(latencies_milliseconds, 50)) if has_latencies else None,
+            'latency_p99_milliseconds': float(np.percentile(latencies_milliseconds, 99)) if has_latencies else None,
+        }
+
+
+async def serve_socket(server: InferenceServer, host: str = '127.0.0.1', port: int = 8765) -> asyncio.AbstractServer:
+    # Every line of a connection is answered as soon as its batch is computed, so a client can have many requests in
+    # flight on one connection and match the answers with their id
+    async def answer(request: dict, writer: asyncio.StreamWriter):
+        try:
+            action = await server.compute_action(np.asarray(request['observation'], dtype=np.float32))
+            response = {'id': request.get('id'), 'action': np.asarray(action).tolist()}
+        except Exception as exception:
+            response = {'id': request.get('id'), 'error': repr(exception)}
+        writer.write((json.dumps(response) + '\n').encode())
+
+    async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        tasks = set()
+        try:
+            while line := await reader.readline():
+                task = asyncio.create_task(answer(json.loads(line), writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle_connection, host, port)
+
+
+class InferenceClient:
+    # Asynchronous client of serve_socket, compute_action can be awaited concurrently by many tasks
+    def __init__(self, host: str = '127.0.0.1', port: int = 8765):
+        self.host: str = host
+        self.port: int = port
+        self.reader: Union[asyncio.StreamReader, None] = None
+        self.writer: Union[asyncio.StreamWriter, None] = None
+        self.pending: dict = {}
+        self.next_id: int = 0
+        self.reading_task: Union[asyncio.Task, None] = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.reading_task = asyncio.create_task(self._read())
+
+    async def _read(self):
+        while line := await self.reader.readline():
+            response = json.loads(line)
+            future = self.pending.pop(response['id'])
+            if 'error' in response:
+                future.set_exception(RuntimeError(response['error']))
+            else:
+                future.set_result(np.array(response['action']))
+
+    async def compute_action(self, observation: np.ndarray) -> np.ndarray:
+        request_id = self.next_id
+        self.next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        self.writer.write((json.dumps({'id': request_id, 'observation': np.asarray(observation).tolist()}) +
+                           '\n').encode())
+        await self.writer.drain()
+        return await future
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        if self.reading_task is not None:
+            self.reading_task.cancel()
+
+
+async def _serve(compute_actions: Callable, host: str, port: int, maximum_batch_size: int,
+                 maximum_delay_seconds: float, statistics_interval_seconds: float):
+    server = InferenceServer(compute_actions, maximum_batch_size, maximum_delay_seconds,
+                             observation_shape=getattr(compute_actions, 'observation_shape', None))
+    await server.start()
+    socket_server = await serve_socket(server, host, port)
+    print(f'Serving on {host}:{port}', file=sys.stderr)
+    try:
+        async with socket_server:
+            while True:
+                await asyncio.sleep(statistics_interval_seconds)
+                print(json.dumps(server.statistics()), file=sys.stderr)
+    finally:
+        await server.stop()
+
+
+def main(arguments: Union[list, None] = None) -> int:
+    parser = argparse.ArgumentParser(description='Serve a trained policy with dynamic batching on a local socket.')
+    parser.add_argument('--checkpoint', required=True, help='Checkpoint directory written by train_deep_policy.')
+    parser.add_argument('--policy-id', default='default_policy')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--maximum-batch-size', type=int, default=256)
+    parser.add_argument('--maximum-delay-milliseconds', type=float, default=2)
+    parser.add_argument('--statistics-interval-seconds', type=float, default=10)
+    arguments = parser.parse_args(arguments)
+
+    compute_actions = load_checkpoint_compute_actions(arguments.checkpoint, arguments.policy_id)
+    try:
+        asyncio.run(_serve(compute_actions, arguments.host, arguments.port, arguments.maximum_batch_size,
+                           arguments.maximum_delay_milliseconds / 1e3, arguments.statistics_interval_seconds))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
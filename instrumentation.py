@@ -0,0 +1,85 @@
+import cProfile
+from collections import defaultdict
+import json
+import pstats
+import time
+from typing import Union
+
+
+class Instrumentation:
+    # Per-phase timers and event counters for the environment and the evaluation loop. It is opt-in: the
+    # instrumented code only does `if instrumentation is not None` when none is given.
+    def __init__(self, profile: bool = False):
+        self.phase_seconds: defaultdict = defaultdict(float)
+        self.phase_calls: defaultdict = defaultdict(int)
+        self.counters: defaultdict = defaultdict(int)
+        self.profile: bool = profile
+        self.profiler: Union[cProfile.Profile, None] = None
+        self.run_start: Union[float, None] = None
+        self.run_seconds: float = 0
+
+    @staticmethod
+    def start() -> float:
+        return time.perf_counter()
+
+    def stop(self, phase: str, start: float):
+        self.phase_seconds[phase] += time.perf_counter() - start
+        self.phase_calls[phase] += 1
+
+    def count(self, counter: str, increment: int = 1):
+        self.counters[counter] += increment
+
+    def start_run(self):
+        self.run_start = time.perf_counter()
+        if self.profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stop_run(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.run_start is not None:
+            self.run_seconds += time.perf_counter() - self.run_start
+            self.run_start = None
+
+    def reset(self):
+        self.phase_seconds.clear()
+        self.phase_calls.clear()
+        self.counters.clear()
+        self.profiler = None
+        self.run_seconds = 0
+
+    def summary(self) -> dict:
+        return {
+            'run_seconds': self.run_seconds,
+            'phases': {
+                phase: {
+                    'seconds': self.phase_seconds[phase],
+                    'calls': self.phase_calls[phase],
+                    'microseconds_per_call': 1e6 * self.phase_seconds[phase] / self.phase_calls[phase],
+                    'fraction_run': self.phase_seconds[phase] / self.run_seconds if self.run_seconds > 0 else None,
+                }
+                for phase in sorted(self.phase_seconds)
+            },
+            'counters': dict(sorted(self.counters.items())),
+        }
+
+    def report(self) -> str:
+        summary = self.summary()
+        lines = [f'Run time: {summary["run_seconds"]:.3f} s']
+        for phase, statistics in sorted(summary['phases'].items(), key=lambda item: -item[1]['seconds']):
+            fraction_run = '' if statistics['fraction_run'] is None else f' ({statistics["fraction_run"]:.1%})'
+            lines.append(f'  {phase:<24} {statistics["seconds"]:10.4f} s{fraction_run:>9}  {statistics["calls"]:>10} '
+                         f'calls  {statistics["microseconds_per_call"]:10.2f} us/call')
+        for counter, value in summary['counters'].items():
+            lines.append(f'  {counter:<24} {value:>10}')
+        return '\n'.join(lines)
+
+    def save_summary(self, path: str):
+        with open(path, 'w') as file:
+            json.dump(self.summary(), file, indent=4)
+
+    def dump_profile(self, path: str):
+        if self.profiler is None:
+            raise RuntimeError('No profile recorded, create the Instrumentation with profile=True.')
+        pstats.Stats(self.profiler).dump_stats(path)
@@ -1,73 +1,242 @@
-import warnings
+import argparse
+import json
+import sys
+from typing import Union
 
 import numpy as np
 
 from environments.identification_management.Identification_management import IdentificationManagement
-import gymnasium as gym
-import random
-
-from environments.identification_management.configuration import default_environment_configuration
-from policies.abstract import Policy
+from environments.identification_management.configuration import default_environment_configuration, \
+    random_episode_configuration, MAXIMUM_NUMBER_RANDOM_IDENTIFICATION_FACTORS
+from evaluation import check_padded_identification_factors, create_environment_and_policy, play_iteration, \
+    play_iteration_parallel, play_until_precision
 from policies.brutal import Brutal
 from policies.combination import Combination
 from policies.random import Random
 from policies.voracious import Voracious
-from train_deep_policy import train_deep_policy
-
-
-def play_episode(environment: gym.Env, policy: Policy):
-    observation, information = environment.reset()
-    policy.reset()
-    total_reward = 0
-
-    continue_play = True
-    while continue_play:
-        action = policy.action(observation)
-        observation, reward, terminated, truncated, information = environment.step(action)
-        total_reward += reward
 
-        if terminated is True or truncated is True:
-            continue_play = False
-
-    return total_reward
-
-
-def play_iteration(environment: gym.Env, policy: Policy, number_episodes: int):
-    total_reward: float = 0
-    for _ in range(number_episodes):
-        total_reward += play_episode(environment, policy)
-    reward_episode_mean = total_reward / float(number_episodes)
-    return reward_episode_mean
+# python main.py evaluate [--experiment experiments/voracious.json] [--policy voracious] [--episodes 500] ...
+# python main.py benchmark [--quick] ...       (see benchmarks/benchmark.py)
+# python main.py train [--experiment ...] [--cpu-only] [--storage-path results]   (ray is only imported here)
+# python main.py plan [--experiment ...]       (resources detected and settings train would use)
+# python main.py export --experiment <path> --output policy.npz   (see policy_export.py)
+#
+# An experiment file is a JSON object with the optional keys:
+#   environment_configuration   overrides of default_environment_configuration (the matrix as a list of rows),
+#                               "configuration_sampler": "random" draws the configuration of each episode with
+#                               random_episode_configuration, on factors padded to its maximum number of factors
+#                               (only the network policy can be evaluated on padded factors)
+#   policy, policy_configuration, number_episodes, seed, number_processes
+# The options given on the command line override the file.
+
+POLICIES = {
+    'brutal': Brutal,
+    'combination': Combination,
+    'random': Random,
+    'voracious': Voracious,
+}
+OTHER_POLICIES = ('optimal', 'network')
+
+
+def get_default_experiment() -> dict:
+    return {
+        'environment_configuration': {
+            'number_messages': 300,
+            'maximum_energy': 30,
+            # First column: energy cost, Second column: percentage of correct responses
+            'matrix_identification_factors': [
+                [0.8, 0.8],
+                [0.4, 0.7],
+                [0.6, 0.75],
+                [0.2, 0.6],
+            ],
+        },
+        'policy': 'voracious',
+        'policy_configuration': {},
+        'number_episodes': 500,
+        'seed': 0,
+        'number_processes': 1,
+    }
+
+
+def load_experiment(path: Union[str, None]) -> dict:
+    experiment = get_default_experiment()
+    if path is not None:
+        with open(path) as file:
+            experiment_file = json.load(file)
+        experiment['environment_configuration'].update(experiment_file.pop('environment_configuration', {}))
+        experiment.update(experiment_file)
+    return experiment
+
+
+def create_environment_configuration(experiment: dict) -> dict:
+    environment_configuration = dict(default_environment_configuration)
+    environment_configuration.update(experiment['environment_configuration'])
+    environment_configuration['matrix_identification_factors'] = np.array(
+        environment_configuration['matrix_identification_factors'], dtype=np.float64)
+    if environment_configuration['configuration_sampler'] == 'random':
+        environment_configuration['configuration_sampler'] = random_episode_configuration
+        if environment_configuration['maximum_number_identification_factors'] is None:
+            environment_configuration['maximum_number_identification_factors'] = \
+                MAXIMUM_NUMBER_RANDOM_IDENTIFICATION_FACTORS
+    return environment_configuration
+
+
+def evaluate(arguments: argparse.Namespace) -> int:
+    experiment = load_experiment(arguments.experiment)
+    for key in ('policy', 'number_episodes', 'seed', 'number_processes'):
+        if getattr(arguments, key) is not None:
+            experiment[key] = getattr(arguments, key)
+    if arguments.policy_configuration is not None:
+        experiment['policy_configuration'] = json.loads(arguments.policy_configuration)
+    environment_configuration = create_environment_configuration(experiment)
+    if arguments.render:
+        environment_configuration['render_mode'] = 'text'
+    if arguments.event_log is None:
+        return _evaluate(arguments, experiment, environment_configuration)
+
+    from event_logging import EventLogger
+
+    event_logger = EventLogger(arguments.event_log, 'jsonl' if arguments.event_log.endswith('.jsonl') else 'binary',
+                               background=True)
+    environment_configuration['event_logger'] = event_logger
+    try:
+        return _evaluate(arguments, experiment, environment_configuration)
+    finally:
+        event_logger.close()
+        # With --processes, the events are counted by the loggers of the processes
+        if len(event_logger.counters) > 0:
+            print(f'Events : {json.dumps(event_logger.summary())}')
+
+
+def _evaluate(arguments: argparse.Namespace, experiment: dict, environment_configuration: dict) -> int:
+    name_policy = experiment['policy']
+    if name_policy in POLICIES:
+        # Before the processes are started
+        check_padded_identification_factors(POLICIES[name_policy], environment_configuration)
+    if name_policy in POLICIES and arguments.target_half_width is None and experiment['number_processes'] != 1:
+        reward, seed = play_iteration_parallel(environment_configuration, POLICIES[name_policy],
+                                               experiment['number_episodes'], experiment['seed'],
+                                               experiment['policy_configuration'], experiment['number_processes'])
+        print(f'Episode mean reward for {name_policy} policy : {reward} (seed {seed})')
+        return 0
+
+    if name_policy in POLICIES:
+        environment, policy = create_environment_and_policy(
+            environment_configuration, POLICIES[name_policy], experiment['policy_configuration'])
+    else:
+        environment = IdentificationManagement(environment_configuration=environment_configuration)
+        policy = create_other_policy(name_policy, environment, environment_configuration, arguments)
+
+    if arguments.target_half_width is not None:
+        summary = play_until_precision(environment, policy, arguments.target_half_width,
+                                       maximum_number_episodes=experiment['number_episodes'], seed=experiment['seed'],
+                                       antithetic=arguments.antithetic)
+        print(json.dumps(summary, indent=4))
+        return 0
+
+    reward = play_iteration(environment, policy, experiment['number_episodes'], experiment['seed'])
+    print(f'Episode mean reward for {name_policy} policy : {reward}')
+    return 0
+
+
+def create_other_policy(name_policy: str, environment: IdentificationManagement, environment_configuration: dict,
+                        arguments: argparse.Namespace):
+    if name_policy == 'optimal':
+        from policies.optimal import Optimal, solve_optimal_policy
+
+        check_padded_identification_factors(Optimal, environment_configuration)
+        optimal_solution = solve_optimal_policy(environment_configuration)
+        print(f'Optimal expected episode reward : {optimal_solution.optimal_value}')
+        return Optimal(environment.observation_space, environment.action_space, optimal_solution)
+
+    if name_policy == 'network':
+        from policies.network import Network
+
+        if arguments.network is None:
+            raise ValueError('The network policy needs --network, a file written by the export command.')
+        return Network(environment.observation_space, environment.action_space, arguments.network)
+
+    raise ValueError(f'Unknown policy {name_policy}, expected one of {sorted(POLICIES) + list(OTHER_POLICIES)}.')
+
+
+def train(arguments: argparse.Namespace) -> int:
+    # ray, RLlib and torch are only imported here
+    from train_deep_policy import train_deep_policy
+
+    experiment = load_experiment(arguments.experiment)
+    train_deep_policy(environment_name='IdentificationManagement',
+                      environment_configuration=create_environment_configuration(experiment),
+                      storage_path=arguments.storage_path, cpu_only=arguments.cpu_only)
+    return 0
+
+
+def plan(arguments: argparse.Namespace) -> int:
+    from resource_planner import detect_resources, plan_resources
+
+    experiment = load_experiment(arguments.experiment)
+    resources = detect_resources()
+    print(json.dumps({
+        'resources': resources,
+        'plan': plan_resources(create_environment_configuration(experiment), resources, arguments.cpu_only),
+    }, indent=4))
+    return 0
+
+
+def main(arguments: Union[list, None] = None) -> int:
+    parser = argparse.ArgumentParser(description='Identification management experiments.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    evaluate_parser = commands.add_parser('evaluate', help='Evaluate a policy.')
+    evaluate_parser.add_argument('--experiment', default=None, help='Experiment file (JSON).')
+    evaluate_parser.add_argument('--policy', default=None, choices=sorted(POLICIES) + list(OTHER_POLICIES))
+    evaluate_parser.add_argument('--policy-configuration', default=None,
+                                 help='Parameters of the policy as a JSON object.')
+    evaluate_parser.add_argument('--episodes', dest='number_episodes', type=int, default=None,
+                                 help='Number of episodes, the maximum with --target-half-width.')
+    evaluate_parser.add_argument('--seed', type=int, default=None)
+    evaluate_parser.add_argument('--processes', dest='number_processes', type=int, default=None,
+                                 help='Number of processes, 1 to play in this process.')
+    evaluate_parser.add_argument('--target-half-width', type=float, default=None,
+                                 help='Play until the confidence interval of the mean reward is this narrow.')
+    evaluate_parser.add_argument('--antithetic', action='store_true',
+                                 help='With --target-half-width, play antithetic pairs of episodes.')
+    evaluate_parser.add_argument('--network', default=None, help='Exported policy file of the network policy.')
+    evaluate_parser.add_argument('--render', action='store_true')
+    evaluate_parser.add_argument('--event-log', default=None,
+                                 help='Record the events of the environment (and the steps with --render) to this '
+                                      'file, JSONL when it ends with .jsonl, else binary. With --processes, {pid} in '
+                                      'the path gives one file per process.')
+
+    train_parser = commands.add_parser('train', help='Train a deep policy with RLlib.')
+    train_parser.add_argument('--experiment', default=None, help='Experiment file (JSON).')
+    train_parser.add_argument('--storage-path', default=None, help='Results directory, ./results by default.')
+    train_parser.add_argument('--cpu-only', action='store_true', help='Do not use the GPUs.')
+
+    plan_parser = commands.add_parser('plan', help='Show the resources detected and the training resource plan.')
+    plan_parser.add_argument('--experiment', default=None, help='Experiment file (JSON).')
+    plan_parser.add_argument('--cpu-only', action='store_true', help='Do not use the GPUs.')
+
+    # The other commands pass their arguments through
+    commands.add_parser('benchmark', help='Benchmark, see benchmarks/benchmark.py.', add_help=False)
+    commands.add_parser('export', help='Export a trained policy, see policy_export.py.', add_help=False)
+
+    arguments, remaining_arguments = parser.parse_known_args(arguments)
+    if arguments.command == 'benchmark':
+        from benchmarks.benchmark import main as benchmark_main
+        return benchmark_main(remaining_arguments)
+    if arguments.command == 'export':
+        from policy_export import main as export_main
+        return export_main(remaining_arguments)
+
+    if len(remaining_arguments) > 0:
+        parser.error(f'unrecognized arguments: {" ".join(remaining_arguments)}')
+    if arguments.command == 'evaluate':
+        return evaluate(arguments)
+    if arguments.command == 'plan':
+        return plan(arguments)
+    return train(arguments)
 
 
 if __name__ == '__main__':
-    # warnings.filterwarnings("ignore")
-    environment_configuration: dict = default_environment_configuration
-    environment_configuration['number_messages'] = 300
-    environment_configuration['maximum_energy'] = 30
-
-    # First column: energy cost, Second column: percentage of correct responses
-    environment_configuration['matrix_identification_factors'] = np.array([
-        [0.8, 0.8],
-        [0.4, 0.7],
-        [0.6, 0.75],
-        [0.2, 0.6],
-    ])
-
-    # environment_configuration['render_mode'] = 'text'   # text or None
-
-    identification_management: gym.Env = IdentificationManagement(environment_configuration=environment_configuration)
-    # random: Policy = Random(identification_management.observation_space, identification_management.action_space)
-    # brutal: Policy = Brutal(identification_management.observation_space, identification_management.action_space)
-    # combination: Policy = Combination(identification_management.observation_space, identification_management.action_space)
-    voracious: Policy = Voracious(identification_management.observation_space, identification_management.action_space)
-
-    # print(f'Episode mean reward for random policy : {play_iteration(identification_management, random, 1)}')
-    # print(f'Episode mean reward for brutal policy : {play_iteration(identification_management, brutal, 500)}')
-    # print(f'Episode mean reward for combination policy : {play_iteration(identification_management, combination, 500)}')
-    # print(f'Episode mean reward for voracious policy : {play_iteration(identification_management, voracious, 500)}')
-
-    train_deep_policy(environment_name='IdentificationManagement', environment_configuration=environment_configuration)
-
-
-
+    sys.exit(main())
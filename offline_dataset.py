@@ -0,0 +1,185 @@
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+from typing import Iterator, Union
+
+import numpy as np
+
+from environments.identification_management.flat_spaces import flatten_action, flatten_observation
+from evaluation import create_environment_and_policy, get_episode_seeds, schedule_episode_seeds
+
+# A dataset is a directory of shards, each written by one task of generate_dataset with the transitions of
+# episodes_per_shard consecutive episodes. The observations and actions are those of the flat spaces ('flat_spaces'
+# configuration key), train on an environment created with flat_spaces=True (and the same
+# flat_observation_includes_matrix) to use them. Two formats:
+#   'npy'    shard_<index>/<column>.npy, one array per column, read memory-mapped by iterate_dataset
+#   'rllib'  shard_<index>/*.json written by RLlib's JsonWriter, read by RLlib's JsonReader for the behaviour
+#            cloning of train_deep_policy, requires ray
+#
+# Columns (named as RLlib's SampleBatch):
+#   obs, new_obs     float32 flat observations before and after the step
+#   actions          int64 flat actions (is_real_source, then calling_identification_factors)
+#   rewards          float32
+#   terminateds      bool, truncateds bool
+#   eps_id           int64 index of the episode in the dataset, t int64 index of the step in the episode
+#   action_prob      float32, action_logp float32: the heuristic policies are logged as deterministic (1 and 0)
+
+DATASET_FORMATS = ('npy', 'rllib')
+
+
+def play_episode_transitions(environment, policy, seed: Union[int, None], include_matrix: bool) -> dict:
+    observation, information = environment.reset(seed=seed)
+    policy.reset(seed=seed)
+    include_maximum_energy = environment.flat_observation_includes_maximum_energy
+
+    observations = [flatten_observation(observation, environment.maximum_energy, include_matrix,
+                                        include_maximum_energy=include_maximum_energy)]
+    actions = []
+    rewards = []
+    terminateds = []
+    truncateds = []
+
+    continue_play = True
+    while continue_play:
+        action = policy.action(observation)
+        observation, reward, terminated, truncated, information = environment.step(action)
+        observations.append(flatten_observation(observation, environment.maximum_energy, include_matrix,
+                                                include_maximum_energy=include_maximum_energy))
+        actions.append(flatten_action(action))
+        rewards.append(reward)
+        terminateds.append(terminated)
+        truncateds.append(truncated)
+
+        if terminated is True or truncated is True:
+            continue_play = False
+
+    observations = np.stack(observations)
+    number_steps = len(actions)
+    return {
+        'obs': observations[:-1],
+        'new_obs': observations[1:],
+        'actions': np.stack(actions),
+        'rewards': np.array(rewards, dtype=np.float32),
+        'terminateds': np.array(terminateds, dtype=bool),
+        'truncateds': np.array(truncateds, dtype=bool),
+        't': np.arange(number_steps, dtype=np.int64),
+        'action_prob': np.ones(number_steps, dtype=np.float32),
+        'action_logp': np.zeros(number_steps, dtype=np.float32),
+    }
+
+
+def _write_shard(environment_configuration: dict, policy_class: type, policy_configuration: Union[dict, None],
+                 directory: str, index_shard: int, index_first_episode: int, seeds: list,
+                 dataset_format: str) -> dict:
+    # The heuristic policies read the Dict observation, the flat one is built for the dataset only
+    include_matrix = environment_configuration.get('flat_observation_includes_matrix', True)
+    environment_configuration = dict(environment_configuration, flat_spaces=False, return_information=False)
+    environment, policy = create_environment_and_policy(environment_configuration, policy_class, policy_configuration)
+
+    schedule_episode_seeds(environment, seeds)
+    episodes = []
+    for index_episode, seed in enumerate(seeds):
+        transitions = play_episode_transitions(environment, policy, seed, include_matrix)
+        transitions['eps_id'] = np.full(len(transitions['rewards']), index_first_episode + index_episode,
+                                        dtype=np.int64)
+        episodes.append(transitions)
+
+    shard_directory = os.path.join(directory, f'shard_{index_shard:05d}')
+    if dataset_format == 'rllib':
+        _write_rllib_shard(shard_directory, episodes)
+    else:
+        os.makedirs(shard_directory, exist_ok=True)
+        for column in episodes[0]:
+            np.save(os.path.join(shard_directory, f'{column}.npy'),
+                    np.concatenate([transitions[column] for transitions in episodes]))
+
+    return {
+        'number_episodes': len(episodes),
+        'number_transitions': sum(len(transitions['rewards']) for transitions in episodes),
+        'total_reward': float(sum(transitions['rewards'].sum(dtype=np.float64) for transitions in episodes)),
+    }
+
+
+def _write_rllib_shard(shard_directory: str, episodes: list):
+    # Imported here, ray is only needed for this format
+    from ray.rllib.offline.json_writer import JsonWriter
+    from ray.rllib.policy.sample_batch import SampleBatch
+
+    writer = JsonWriter(shard_directory)
+    for transitions in episodes:
+        writer.write(SampleBatch(transitions))
+
+
+def generate_dataset(environment_configuration: dict, policy_class: type, directory: str, number_episodes: int,
+                     seed: Union[int, None] = None, policy_configuration: Union[dict, None] = None,
+                     episodes_per_shard: int = 100, dataset_format: str = 'npy',
+                     number_processes: Union[int, None] = None) -> dict:
+    if number_episodes <= 0:
+        raise ValueError(f'number_episodes must be positive, not {number_episodes}.')
+    if dataset_format not in DATASET_FORMATS:
+        raise ValueError(f'Unknown dataset format {dataset_format!r}, expected one of {DATASET_FORMATS}.')
+    if seed is None:
+        seed = int(np.random.SeedSequence().generate_state(1)[0])
+    if number_processes is None:
+        number_processes = os.cpu_count()
+
+    # Episode i is played with the seed seed + i, whatever the number of processes
+    seeds = get_episode_seeds(number_episodes, seed)
+    starts = range(0, number_episodes, episodes_per_shard)
+    os.makedirs(directory, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=max(1, min(number_processes, len(starts)))) as executor:
+        futures = [
+            executor.submit(_write_shard, environment_configuration, policy_class, policy_configuration, directory,
+                            index_shard, start, seeds[start:start + episodes_per_shard], dataset_format)
+            for index_shard, start in enumerate(starts)
+        ]
+        shards = [future.result() for future in futures]
+
+    metadata = {
+        'policy': policy_class.__name__,
+        'policy_configuration': policy_configuration,
+        'seed': seed,
+        'format': dataset_format,
+        'flat_observation_includes_matrix': environment_configuration.get('flat_observation_includes_matrix', True),
+        'number_shards': len(shards),
+        'number_episodes': number_episodes,
+        'number_transitions': sum(shard['number_transitions'] for shard in shards),
+        'episode_mean_reward': sum(shard['total_reward'] for shard in shards) / number_episodes,
+        'shards': shards,
+    }
+    with open(os.path.join(directory, 'metadata.json'), 'w') as file:
+        json.dump(metadata, file, indent=4)
+    return metadata
+
+
+def get_shard_directories(directory: str) -> list:
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.startswith('shard_') and os.path.isdir(os.path.join(directory, name))
+    )
+
+
+def load_shard(shard_directory: str, columns: Union[list, None] = None) -> dict:
+    # Memory-mapped, nothing is read until the arrays are indexed
+    if columns is None:
+        columns = [name[:-len('.npy')] for name in sorted(os.listdir(shard_directory)) if name.endswith('.npy')]
+    return {column: np.load(os.path.join(shard_directory, f'{column}.npy'), mmap_mode='r') for column in columns}
+
+
+def iterate_dataset(directory: str, batch_size: int = 4096, columns: Union[list, None] = None,
+                    shuffle: bool = False, seed: Union[int, None] = None) -> Iterator[dict]:
+    # Streams an 'npy' dataset as batches of transitions, one shard in memory at a time. With shuffle the shards
+    # are visited in random order and the transitions are shuffled inside each shard.
+    generator = np.random.default_rng(seed)
+    shard_directories = get_shard_directories(directory)
+    if shuffle:
+        generator.shuffle(shard_directories)
+
+    for shard_directory in shard_directories:
+        shard = load_shard(shard_directory, columns)
+        number_transitions = len(next(iter(shard.values())))
+        if shuffle:
+            order = generator.permutation(number_transitions)
+            shard = {column: np.asarray(values)[order] for column, values in shard.items()}
+        for start in range(0, number_transitions, batch_size):
+            yield {column: np.asarray(values[start:start + batch_size]) for column, values in shard.items()}
@@ -0,0 +1,86 @@
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import math
+import os
+from typing import Union
+
+import numpy as np
+
+from evaluation import create_environment_and_policy, get_episode_seeds, mean_reward, play_episodes
+
+
+def create_parameter_grid(parameter_values: dict) -> list:
+    # {'name': [values], ...} to the list of every combination as policy configurations
+    names = list(parameter_values)
+    return [dict(zip(names, values)) for values in itertools.product(*(parameter_values[name] for name in names))]
+
+
+def _play_candidate_episodes(environment_configuration: dict, policy_class: type, policy_configuration: dict,
+                             seeds: list) -> list:
+    environment, policy = create_environment_and_policy(environment_configuration, policy_class, policy_configuration)
+    return play_episodes(environment, policy, seeds)
+
+
+def successive_halving(environment_configuration: dict, policy_class: type, candidates: list,
+                       number_episodes_first_round: int = 8, reduction_factor: int = 2,
+                       maximum_number_episodes: int = 500, seed: Union[int, None] = 0,
+                       number_processes: Union[int, None] = None, episodes_per_task: int = 8,
+                       verbose: bool = False) -> list:
+    # Evaluates policy_class with every candidate policy configuration. All candidates play the same episodes (episode
+    # i with the seed seed + i, the same messages and factor outcomes for everyone), so their mean rewards are
+    # compared on common random numbers. After each round only the best 1 / reduction_factor of the candidates are
+    # kept, and the survivors play reduction_factor times more episodes (only the new ones are played), until one
+    # candidate is left or maximum_number_episodes is reached.
+    # Returns one result per candidate, the best first: the survivors of the last round by mean reward, then the
+    # others by the round in which they were eliminated.
+    if seed is None:
+        seed = int(np.random.SeedSequence().generate_state(1)[0])
+    if number_processes is None:
+        number_processes = os.cpu_count()
+    seeds = get_episode_seeds(maximum_number_episodes, seed)
+
+    results = [
+        {'policy_configuration': candidate, 'rewards': [], 'number_rounds': 0}
+        for candidate in candidates
+    ]
+    surviving_results = list(results)
+    number_episodes = min(number_episodes_first_round, maximum_number_episodes)
+
+    with ProcessPoolExecutor(max_workers=number_processes) as executor:
+        while True:
+            # Every survivor plays the episodes it has not played yet, split in tasks of episodes_per_task episodes
+            futures = []
+            for result in surviving_results:
+                new_seeds = seeds[len(result['rewards']):number_episodes]
+                for start in range(0, len(new_seeds), episodes_per_task):
+                    futures.append((result, executor.submit(
+                        _play_candidate_episodes, environment_configuration, policy_class,
+                        result['policy_configuration'], new_seeds[start:start + episodes_per_task])))
+            for result, future in futures:
+                result['rewards'].extend(future.result())
+
+            for result in surviving_results:
+                result['number_rounds'] += 1
+                result['episode_mean_reward'] = mean_reward(result['rewards'])
+            surviving_results.sort(key=lambda result: result['episode_mean_reward'], reverse=True)
+            if verbose:
+                print(f'{len(surviving_results)} candidate(s) on {number_episodes} episodes, best '
+                      f'{surviving_results[0]["episode_mean_reward"]:.4f} with '
+                      f'{surviving_results[0]["policy_configuration"]}')
+
+            if len(surviving_results) <= 1 or number_episodes >= maximum_number_episodes:
+                break
+            surviving_results = surviving_results[:max(1, math.ceil(len(surviving_results) / reduction_factor))]
+            number_episodes = min(number_episodes * reduction_factor, maximum_number_episodes)
+
+    # Candidates that went further first, then by mean reward on the episodes they played
+    results.sort(key=lambda result: (result['number_rounds'], result['episode_mean_reward']), reverse=True)
+    return [
+        {
+            'policy_configuration': result['policy_configuration'],
+            'episode_mean_reward': result['episode_mean_reward'],
+            'number_episodes': len(result['rewards']),
+            'number_rounds': result['number_rounds'],
+        }
+        for result in results
+    ]
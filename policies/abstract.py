@@ -1,15 +1,36 @@
+from __future__ import annotations
+
 from abc import ABC, abstractmethod
-from gymnasium.spaces import Space
+from typing import TYPE_CHECKING, Union
+
+import numpy as np
+
+if TYPE_CHECKING:
+    # Only for the annotations, policies that do not need gymnasium (policies.network) start without importing it
+    from gymnasium.spaces import Space
 
 
 class Policy(ABC):
+    # Whether the policy can play observations padded to maximum_number_identification_factors, whose factor matrix
+    # ends with zero rows (the heuristic policies would call them)
+    reads_padded_identification_factors: bool = False
+
     def __init__(self, observation_space: Space, action_space: Space):
         self.observation_space: Space = observation_space
         self.action_space: Space = action_space
+        self.generator: np.random.Generator = np.random.default_rng()
 
     @abstractmethod
     def action(self, observation):
         pass
 
-    def reset(self):
-        pass
+    def action_batch(self, observations):
+        # Observations and actions are stacked along a first dimension, one row per episode
+        raise NotImplementedError(f'{type(self).__name__} does not implement action_batch.')
+
+    def reset(self, seed: Union[int, None] = None):
+        if seed is not None:
+            self.generator = np.random.default_rng(seed)
+
+    def reset_batch(self, number_episodes: int, seed: Union[int, None] = None):
+        self.reset(seed)
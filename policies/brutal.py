@@ -3,16 +3,23 @@ from typing import Union
 from gymnasium.spaces import Space
 import numpy as np
 from policies.abstract import Policy
+from policies.cache import get_factor_tables, get_shared_matrix
 
 
 class Brutal(Policy):
     def __init__(self, observation_space: Space, action_space: Space):
         super().__init__(observation_space, action_space)
         self.is_first_time_seeing_message: Union[bool, None] = None
+        self.is_first_time_seeing_messages: Union[np.ndarray, None] = None
 
-    def reset(self):
+    def reset(self, seed: Union[int, None] = None):
+        super().reset(seed)
         self.is_first_time_seeing_message: Union[bool, None] = True
 
+    def reset_batch(self, number_episodes: int, seed: Union[int, None] = None):
+        super().reset_batch(number_episodes, seed)
+        self.is_first_time_seeing_messages = np.ones(number_episodes, dtype=bool)
+
     def action(self, observation):
         action = {}
 
@@ -23,7 +30,7 @@ class Brutal(Policy):
         response_identification_factors = observation['response_identification_factors']
 
         number_factor = matrix_identification_factors.shape[0]
-        indices_order_call_factors = np.argsort(matrix_identification_factors[:, 1])[::-1]
+        factor_tables = get_factor_tables(matrix_identification_factors)
 
         if self.is_first_time_seeing_message:
             # Calculation of the budget for this message
@@ -31,19 +38,12 @@ class Brutal(Policy):
             number_messages_remaining_before_end = observation['number_messages'] - observation['position_current_message']
             energy_budget = current_energy
 
-            # We are looking for the maximum criteria we can call with this budget, starting with the most profitable ones
-            identification_factors_call = []
-
-            calling_one_factor = False
-            for index in indices_order_call_factors:
-                factor_energy_cost = matrix_identification_factors[index][0]
-                if energy_budget >= factor_energy_cost and calling_one_factor is False:
-                    identification_factors_call.append(index)
-                    energy_budget -= factor_energy_cost
-                    calling_one_factor = True
+            # We are looking for the most accurate criteria we can call with this budget
+            index_call = factor_tables.first_affordable_by_accuracy.lookup(energy_budget[0])
 
             calling_identification_factors = np.zeros(number_factor, dtype=np.int32)
-            calling_identification_factors[identification_factors_call] = 1
+            if index_call is not None:
+                calling_identification_factors[index_call] = 1
             action = {
                 'is_real_source': 0,
                 'calling_identification_factors': calling_identification_factors,
@@ -66,3 +66,41 @@ class Brutal(Policy):
             self.is_first_time_seeing_message = True
 
         return action
+
+    def action_batch(self, observations):
+        # Same rule as action, every quantity has an extra first dimension of one row per episode
+        matrix_identification_factors = observations['matrix_identification_factors']
+        response_identification_factors = observations['response_identification_factors']
+
+        number_episodes, number_factor = response_identification_factors.shape
+        episode_indices = np.arange(number_episodes)
+
+        # First time: call the most accurate factor that fits in the whole remaining energy
+        energy_budget = observations['current_energy'][:, 0]
+        shared_matrix = get_shared_matrix(matrix_identification_factors)
+        if shared_matrix is not None:
+            index_call, calling_one_factor = \
+                get_factor_tables(shared_matrix).first_affordable_by_accuracy.lookup_batch(energy_budget)
+        else:
+            indices_order_call_factors = np.argsort(matrix_identification_factors[:, :, 1], axis=-1)[:, ::-1]
+            factor_energy_costs = np.take_along_axis(
+                matrix_identification_factors[:, :, 0], indices_order_call_factors, axis=-1)
+            is_affordable = factor_energy_costs <= energy_budget[:, np.newaxis]
+            calling_one_factor = np.any(is_affordable, axis=-1)
+            index_call = indices_order_call_factors[episode_indices, np.argmax(is_affordable, axis=-1)]
+
+        is_first_time = self.is_first_time_seeing_messages
+        calling_identification_factors = np.zeros((number_episodes, number_factor), dtype=np.int32)
+        is_calling = is_first_time & calling_one_factor
+        calling_identification_factors[episode_indices[is_calling], index_call[is_calling]] = 1
+
+        # Second time: decide from the responses
+        is_real_source = np.where(np.any(response_identification_factors == 1, axis=-1), 0, 2)
+        is_real_source[is_first_time] = 0
+
+        self.is_first_time_seeing_messages = ~is_first_time
+
+        return {
+            'is_real_source': is_real_source,
+            'calling_identification_factors': calling_identification_factors,
+        }
@@ -0,0 +1,144 @@
+from collections import OrderedDict
+from typing import Union
+
+import numpy as np
+
+from policies.decision import BayesianDecision
+
+# Above this number of factors the 2 ** k subsets are not enumerated, the policies keep their greedy selection
+MAXIMUM_NUMBER_FACTORS_SUBSET_TABLE = 16
+
+
+class FirstAffordableTable:
+    # First factor of an order of call whose energy cost fits in a budget, by binary search on the running minimum
+    # of the costs along the order (non increasing, the first affordable factor is where it goes under the budget)
+    def __init__(self, indices_order_call_factors: np.ndarray, energy_costs: np.ndarray):
+        self.indices_order_call_factors: np.ndarray = indices_order_call_factors
+        self.negative_minimum_costs: np.ndarray = -np.minimum.accumulate(energy_costs[indices_order_call_factors])
+
+    def lookup(self, energy_budget) -> Union[int, None]:
+        order = int(np.searchsorted(self.negative_minimum_costs, -energy_budget, side='left'))
+        if order >= len(self.indices_order_call_factors):
+            return None
+        return int(self.indices_order_call_factors[order])
+
+    def lookup_batch(self, energy_budgets: np.ndarray) -> tuple:
+        # Index of the factor (0 where none is affordable) and whether one is affordable, one row per budget
+        orders = np.searchsorted(self.negative_minimum_costs, -energy_budgets, side='left')
+        is_affordable = orders < len(self.indices_order_call_factors)
+        indices = self.indices_order_call_factors[np.minimum(orders, len(self.indices_order_call_factors) - 1)]
+        return np.where(is_affordable, indices, 0), is_affordable
+
+
+class BestSubsetTable:
+    # Exact knapsack over the factors: for any budget, the subset of factors of maximal total value whose energy
+    # costs sum to at most the budget. The 2 ** k subsets are sorted by cost, the best subset among the first i is
+    # kept for every i (the cheapest one on ties), a budget is then a binary search.
+    def __init__(self, energy_costs: np.ndarray, values: np.ndarray):
+        number_factors = len(energy_costs)
+        subsets = np.arange(2 ** number_factors)
+        memberships = ((subsets[:, np.newaxis] >> np.arange(number_factors)) & 1).astype(np.int32)
+        subset_costs = memberships @ energy_costs
+        subset_values = memberships @ values
+
+        order = np.argsort(subset_costs, kind='stable')
+        self.sorted_costs: np.ndarray = subset_costs[order]
+        sorted_values = subset_values[order]
+        previous_best_values = np.concatenate(([-np.inf], np.maximum.accumulate(sorted_values)[:-1]))
+        is_improvement = sorted_values > previous_best_values
+        best_orders = np.maximum.accumulate(np.where(is_improvement, np.arange(len(order)), 0))
+        # calling_identification_factors of the best subset, one row per prefix of sorted subsets
+        self.best_callings: np.ndarray = memberships[order[best_orders]]
+
+    def lookup(self, energy_budget) -> np.ndarray:
+        return self.best_callings[np.searchsorted(self.sorted_costs, energy_budget, side='right') - 1]
+
+    def lookup_batch(self, energy_budgets: np.ndarray) -> np.ndarray:
+        return self.best_callings[np.searchsorted(self.sorted_costs, energy_budgets, side='right') - 1]
+
+
+class FactorTables:
+    # Everything the heuristic policies derive from the factor matrix alone
+    def __init__(self, matrix_identification_factors: np.ndarray):
+        self.matrix_identification_factors: np.ndarray = matrix_identification_factors
+        self.number_identification_factors: int = matrix_identification_factors.shape[0]
+        self.energy_costs: np.ndarray = matrix_identification_factors[:, 0]
+        self.percentage_correct_responses: np.ndarray = matrix_identification_factors[:, 1]
+
+        # Same orders as np.argsort(...)[::-1] in the policies, ties included
+        self.indices_order_by_accuracy: np.ndarray = np.argsort(self.percentage_correct_responses)[::-1]
+        self.first_affordable_by_accuracy: FirstAffordableTable = FirstAffordableTable(
+            self.indices_order_by_accuracy, self.energy_costs)
+
+        self.indices_order_by_ratio: dict = {}
+        self.best_subsets: dict = {}
+        self.bayesian_decisions: dict = {}
+
+    def get_indices_order_by_ratio(self, exponent: float = 1) -> np.ndarray:
+        # Factors by decreasing percentage_correct_responses ** exponent / energy_cost
+        if exponent not in self.indices_order_by_ratio:
+            ratio_correct_by_energy = self.percentage_correct_responses ** exponent / self.energy_costs
+            self.indices_order_by_ratio[exponent] = np.argsort(ratio_correct_by_energy)[::-1]
+        return self.indices_order_by_ratio[exponent]
+
+    def get_best_subset_table(self, exponent: float = 1) -> Union[BestSubsetTable, None]:
+        # Knapsack on the values percentage_correct_responses ** exponent, None when there are too many factors
+        if self.number_identification_factors > MAXIMUM_NUMBER_FACTORS_SUBSET_TABLE:
+            return None
+        if exponent not in self.best_subsets:
+            self.best_subsets[exponent] = BestSubsetTable(
+                self.energy_costs, self.percentage_correct_responses ** exponent)
+        return self.best_subsets[exponent]
+
+    def get_bayesian_decision(self, prior_real_source: float = 0.5) -> BayesianDecision:
+        if prior_real_source not in self.bayesian_decisions:
+            self.bayesian_decisions[prior_real_source] = BayesianDecision(
+                self.matrix_identification_factors, prior_real_source)
+        return self.bayesian_decisions[prior_real_source]
+
+
+class FactorTablesCache:
+    # Least recently used FactorTables, keyed on the content of the matrix, so that evaluating policies against many
+    # random_environment_configuration matrices keeps a bounded memory
+    def __init__(self, maximum_size: int = 256):
+        self.maximum_size: int = maximum_size
+        self.tables: OrderedDict = OrderedDict()
+        self.number_hits: int = 0
+        self.number_misses: int = 0
+
+    def get(self, matrix_identification_factors: np.ndarray) -> FactorTables:
+        key = (matrix_identification_factors.shape, matrix_identification_factors.dtype.str,
+               matrix_identification_factors.tobytes())
+        tables = self.tables.get(key)
+        if tables is not None:
+            self.number_hits += 1
+            self.tables.move_to_end(key)
+            return tables
+
+        self.number_misses += 1
+        tables = FactorTables(np.array(matrix_identification_factors, dtype=np.float64))
+        self.tables[key] = tables
+        if len(self.tables) > self.maximum_size:
+            self.tables.popitem(last=False)
+        return tables
+
+    def clear(self):
+        self.tables.clear()
+        self.number_hits = 0
+        self.number_misses = 0
+
+
+# Shared by the policies of a process
+factor_tables_cache = FactorTablesCache()
+
+
+def get_factor_tables(matrix_identification_factors: np.ndarray) -> FactorTables:
+    return factor_tables_cache.get(matrix_identification_factors)
+
+
+def get_shared_matrix(matrix_identification_factors: np.ndarray) -> Union[np.ndarray, None]:
+    # Matrix of a batch of observations when every row has the same one (as in the vectorized environment), else None
+    shared_matrix = matrix_identification_factors[0]
+    if matrix_identification_factors.strides[0] == 0 or np.all(matrix_identification_factors == shared_matrix):
+        return shared_matrix
+    return None
@@ -3,16 +3,39 @@ from typing import Union
 from gymnasium.spaces import Space
 import numpy as np
 from policies.abstract import Policy
+from policies.cache import get_factor_tables, get_shared_matrix
 
 
 class Combination(Policy):
-    def __init__(self, observation_space: Space, action_space: Space):
+    def __init__(self, observation_space: Space, action_space: Space,
+                 estimation_average_message_criticality: float = 0.5,
+                 estimation_average_message_confidence: float = 0.5, ratio_exponent: float = 1,
+                 exact_factor_selection: bool = True, bayesian_decision: bool = False):
         super().__init__(observation_space, action_space)
+        # The budget of a message is its share of the remaining energy, its criticality * trust against the estimated
+        # average over the remaining messages
+        self.estimation_average_message_criticality: float = estimation_average_message_criticality
+        self.estimation_average_message_confidence: float = estimation_average_message_confidence
+        # The factors are valued percentage_correct_responses ** ratio_exponent (divided by their energy cost for the
+        # greedy order)
+        self.ratio_exponent: float = ratio_exponent
+        # True: the factors called are the subset of maximal total accuracy within the budget (exact knapsack, see
+        # policies.cache), False: the factors are taken greedily by decreasing accuracy / energy cost ratio
+        self.exact_factor_selection: bool = exact_factor_selection
+        # True: the decision is the most probable source given the responses (see policies.decision), False: the
+        # accuracies of the factors on each side are compared
+        self.bayesian_decision: bool = bayesian_decision
         self.is_first_time_seeing_message: Union[bool, None] = None
+        self.is_first_time_seeing_messages: Union[np.ndarray, None] = None
 
-    def reset(self):
+    def reset(self, seed: Union[int, None] = None):
+        super().reset(seed)
         self.is_first_time_seeing_message: Union[bool, None] = True
 
+    def reset_batch(self, number_episodes: int, seed: Union[int, None] = None):
+        super().reset_batch(number_episodes, seed)
+        self.is_first_time_seeing_messages = np.ones(number_episodes, dtype=bool)
+
     def action(self, observation):
         action = {}
 
@@ -23,37 +46,51 @@ class Combination(Policy):
         response_identification_factors = observation['response_identification_factors']
 
         number_factor = matrix_identification_factors.shape[0]
-        ratio_correct_by_energy = matrix_identification_factors[:, 1] ** 1 / matrix_identification_factors[:, 0]
-        indices_order_call_factors = np.argsort(ratio_correct_by_energy)[::-1]
+        factor_tables = get_factor_tables(matrix_identification_factors)
 
         if self.is_first_time_seeing_message:
             # Calculation of the budget for this message
             current_energy = np.array(observation['current_energy'], dtype=np.float64)
             number_messages_remaining_before_end = observation['number_messages'] - observation['position_current_message']
-            estimation_average_message_criticality = 0.5
-            estimation_average_message_confidence = 0.5
+            estimation_average_message_criticality = self.estimation_average_message_criticality
+            estimation_average_message_confidence = self.estimation_average_message_confidence
 
             energy_budget = ((observation['current_message_criticality'] * observation['current_message_trust']) / (number_messages_remaining_before_end * estimation_average_message_criticality * estimation_average_message_confidence)) * current_energy
             if energy_budget > current_energy:
                 energy_budget = current_energy
 
-            # We are looking for the maximum criteria we can call with this budget, starting with the most profitable ones
-            identification_factors_call = []
+            best_subset_table = None
+            if self.exact_factor_selection:
+                best_subset_table = factor_tables.get_best_subset_table(self.ratio_exponent)
+            if best_subset_table is not None:
+                # The most accurate combination of criteria we can call with this budget
+                calling_identification_factors = best_subset_table.lookup(energy_budget[0]).copy()
+            else:
+                # We are looking for the maximum criteria we can call with this budget, starting with the most profitable ones
+                identification_factors_call = []
 
-            for index in indices_order_call_factors:
-                factor_energy_cost = matrix_identification_factors[index][0]
-                if energy_budget >= factor_energy_cost:
-                    identification_factors_call.append(index)
-                    energy_budget -= factor_energy_cost
+                for index in factor_tables.get_indices_order_by_ratio(self.ratio_exponent):
+                    factor_energy_cost = matrix_identification_factors[index][0]
+                    if energy_budget >= factor_energy_cost:
+                        identification_factors_call.append(index)
+                        energy_budget -= factor_energy_cost
 
-            calling_identification_factors = np.zeros(number_factor, dtype=np.int32)
-            calling_identification_factors[identification_factors_call] = 1
+                calling_identification_factors = np.zeros(number_factor, dtype=np.int32)
+                calling_identification_factors[identification_factors_call] = 1
             action = {
                 'is_real_source': 0,
                 'calling_identification_factors': calling_identification_factors,
             }
 
             self.is_first_time_seeing_message = False
+        elif self.bayesian_decision:
+            is_real_source, _ = factor_tables.get_bayesian_decision().decide(response_identification_factors)
+            action = {
+                'is_real_source': is_real_source,
+                'calling_identification_factors': np.zeros(number_factor, dtype=np.int32),
+            }
+
+            self.is_first_time_seeing_message = True
         else:
             calling_identification_factors = np.zeros(number_factor, dtype=np.int32)
             identification_is_true_indices = np.where(response_identification_factors == 1)
@@ -82,3 +119,90 @@ class Combination(Policy):
             self.is_first_time_seeing_message = True
 
         return action
+
+    def action_batch(self, observations):
+        # Same rule as action, every quantity has an extra first dimension of one row per episode
+        matrix_identification_factors = observations['matrix_identification_factors']
+        response_identification_factors = observations['response_identification_factors']
+
+        number_episodes, number_factor = response_identification_factors.shape
+        episode_indices = np.arange(number_episodes)
+
+        # First time: fill the budget of the message with the most accurate combination of factors
+        current_energy = np.array(observations['current_energy'][:, 0], dtype=np.float64)
+        number_messages_remaining_before_end = \
+            observations['number_messages'][:, 0] - observations['position_current_message'][:, 0]
+        estimation_average_message_criticality = self.estimation_average_message_criticality
+        estimation_average_message_confidence = self.estimation_average_message_confidence
+
+        energy_budget = ((observations['current_message_criticality'][:, 0] * observations['current_message_trust'][:, 0]) / (number_messages_remaining_before_end * estimation_average_message_criticality * estimation_average_message_confidence)) * current_energy
+        energy_budget = np.minimum(energy_budget, current_energy)
+
+        is_first_time = self.is_first_time_seeing_messages
+        shared_matrix = get_shared_matrix(matrix_identification_factors)
+        best_subset_table = None
+        if self.exact_factor_selection and shared_matrix is not None:
+            best_subset_table = get_factor_tables(shared_matrix).get_best_subset_table(self.ratio_exponent)
+
+        if best_subset_table is not None:
+            calling_identification_factors = \
+                best_subset_table.lookup_batch(energy_budget) * is_first_time[:, np.newaxis].astype(np.int32)
+        elif self.exact_factor_selection:
+            calling_identification_factors = np.zeros((number_episodes, number_factor), dtype=np.int32)
+            for index_episode in np.flatnonzero(is_first_time):
+                subset_table = get_factor_tables(
+                    matrix_identification_factors[index_episode]).get_best_subset_table(self.ratio_exponent)
+                if subset_table is None:
+                    calling_identification_factors[index_episode] = self._greedy_calling_identification_factors(
+                        matrix_identification_factors[index_episode:index_episode + 1],
+                        energy_budget[index_episode:index_episode + 1], self.ratio_exponent)[0]
+                else:
+                    calling_identification_factors[index_episode] = subset_table.lookup(energy_budget[index_episode])
+        else:
+            calling_identification_factors = self._greedy_calling_identification_factors(
+                matrix_identification_factors, energy_budget, self.ratio_exponent) * is_first_time[:, np.newaxis].astype(np.int32)
+
+        # Second time: compare the accuracies of the factors on each side, or the posterior probabilities
+        if self.bayesian_decision and shared_matrix is not None:
+            is_real_source, _ = \
+                get_factor_tables(shared_matrix).get_bayesian_decision().decide(response_identification_factors)
+        elif self.bayesian_decision:
+            is_real_source = np.array([
+                get_factor_tables(matrix_identification_factors[index_episode]).get_bayesian_decision().decide(
+                    response_identification_factors[index_episode])[0]
+                for index_episode in range(number_episodes)
+            ])
+        else:
+            identification_is_true_probabilities = np.sum(np.where(
+                response_identification_factors == 1, matrix_identification_factors[:, :, 1] ** 1, 0), axis=-1)
+            identification_is_false_probabilities = np.sum(np.where(
+                response_identification_factors == -1, matrix_identification_factors[:, :, 1] ** 1, 0), axis=-1)
+            is_real_source = np.where(
+                identification_is_true_probabilities > identification_is_false_probabilities, 0, 2)
+        is_real_source[is_first_time] = 0
+
+        self.is_first_time_seeing_messages = ~is_first_time
+
+        return {
+            'is_real_source': is_real_source,
+            'calling_identification_factors': calling_identification_factors,
+        }
+
+    @staticmethod
+    def _greedy_calling_identification_factors(matrix_identification_factors: np.ndarray,
+                                               energy_budget: np.ndarray, ratio_exponent: float) -> np.ndarray:
+        # Factors by decreasing accuracy / energy cost ratio while they fit in the budget, one row per episode
+        number_episodes, number_factor = matrix_identification_factors.shape[:2]
+        episode_indices = np.arange(number_episodes)
+        ratio_correct_by_energy = \
+            matrix_identification_factors[:, :, 1] ** ratio_exponent / matrix_identification_factors[:, :, 0]
+        indices_order_call_factors = np.argsort(ratio_correct_by_energy, axis=-1)[:, ::-1]
+
+        calling_identification_factors = np.zeros((number_episodes, number_factor), dtype=np.int32)
+        for order in range(number_factor):
+            index = indices_order_call_factors[:, order]
+            factor_energy_cost = matrix_identification_factors[episode_indices, index, 0]
+            is_calling = energy_budget >= factor_energy_cost
+            energy_budget = np.where(is_calling, energy_budget - factor_energy_cost, energy_budget)
+            calling_identification_factors[episode_indices, index] = is_calling
+        return calling_identification_factors
@@ -0,0 +1,57 @@
+from typing import Union
+
+import numpy as np
+
+# Above this number of factors the 3 ** k patterns are not tabulated, the log-likelihood ratio is computed from the
+# responses (a dot product, vectorized over a batch)
+MAXIMUM_NUMBER_FACTORS_DECISION_TABLE = 12
+
+# The accuracies are kept away from 0 and 1 so that a perfect factor gives a large but finite log-likelihood ratio
+EPSILON_PERCENTAGE_CORRECT_RESPONSES = 1e-12
+
+
+class BayesianDecision:
+    # Decision on is_real_source from the responses of the factors to a message. The factors answer independently,
+    # factor i gives the right answer with probability p_i, so a response r_i (1 real source, -1 fake, 0 not called)
+    # adds r_i * log(p_i / (1 - p_i)) to the log-likelihood ratio log P(real | responses) - log P(fake | responses).
+    # A response vector is encoded as the base 3 integer sum((r_i + 1) * 3 ** i), for which the ratio of every
+    # pattern is tabulated once.
+    def __init__(self, matrix_identification_factors: np.ndarray, prior_real_source: float = 0.5):
+        self.number_identification_factors: int = matrix_identification_factors.shape[0]
+        percentage_correct_responses = np.clip(
+            matrix_identification_factors[:, 1], EPSILON_PERCENTAGE_CORRECT_RESPONSES,
+            1 - EPSILON_PERCENTAGE_CORRECT_RESPONSES)
+        self.factor_log_likelihood_ratios: np.ndarray = np.log(percentage_correct_responses) - \
+            np.log1p(-percentage_correct_responses)
+        self.prior_log_likelihood_ratio: float = float(np.log(prior_real_source) - np.log1p(-prior_real_source))
+        self.powers: np.ndarray = 3 ** np.arange(self.number_identification_factors, dtype=np.int64)
+
+        self.log_likelihood_ratios: Union[np.ndarray, None] = None
+        if self.number_identification_factors <= MAXIMUM_NUMBER_FACTORS_DECISION_TABLE:
+            # Factor i is the digit i of the code: the table of the first i factors is repeated for its 3 responses
+            log_likelihood_ratios = np.array([self.prior_log_likelihood_ratio])
+            for factor_log_likelihood_ratio in self.factor_log_likelihood_ratios:
+                log_likelihood_ratios = np.add.outer(
+                    np.array([-factor_log_likelihood_ratio, 0, factor_log_likelihood_ratio]),
+                    log_likelihood_ratios).ravel()
+            self.log_likelihood_ratios = log_likelihood_ratios
+
+    def encode(self, response_identification_factors: np.ndarray) -> Union[int, np.ndarray]:
+        # One code per row for a batch of response vectors
+        return (np.asarray(response_identification_factors, dtype=np.int64) + 1) @ self.powers
+
+    def log_likelihood_ratio(self, response_identification_factors: np.ndarray) -> Union[float, np.ndarray]:
+        if self.log_likelihood_ratios is not None:
+            return self.log_likelihood_ratios[self.encode(response_identification_factors)]
+        return np.asarray(response_identification_factors) @ self.factor_log_likelihood_ratios + \
+            self.prior_log_likelihood_ratio
+
+    def decide(self, response_identification_factors: np.ndarray) -> tuple:
+        # is_real_source action (2 real source, 0 fake, as the environment expects) and the posterior probability
+        # that it is the right one. Works on one response vector or a batch of them.
+        log_likelihood_ratio = self.log_likelihood_ratio(response_identification_factors)
+        is_real_source = np.where(log_likelihood_ratio > 0, 2, 0)
+        confidence = 1 / (1 + np.exp(-np.abs(log_likelihood_ratio)))
+        if np.ndim(log_likelihood_ratio) == 0:
+            return int(is_real_source), float(confidence)
+        return is_real_source, confidence
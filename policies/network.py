@@ -0,0 +1,111 @@
+import json
+from typing import Union
+
+import numpy as np
+
+from policies.abstract import Policy
+
+# Only numpy is imported: a policy exported by policy_export starts in a few tens of milliseconds, without ray or torch
+
+ACTIVATIONS = {
+    'tanh': np.tanh,
+    'relu': lambda values: np.maximum(values, 0),
+    'linear': lambda values: values,
+}
+
+
+def load_network(path: str, dtype: type = np.float32) -> dict:
+    with np.load(path) as arrays:
+        metadata = json.loads(str(arrays['metadata']))
+        number_hidden_layers = metadata['number_hidden_layers']
+        return {
+            'metadata': metadata,
+            'hidden_weights': [arrays[f'hidden_weights_{index}'].astype(dtype) for index in range(number_hidden_layers)],
+            'hidden_biases': [arrays[f'hidden_biases_{index}'].astype(dtype) for index in range(number_hidden_layers)],
+            'logits_weights': arrays['logits_weights'].astype(dtype),
+            'logits_biases': arrays['logits_biases'].astype(dtype),
+        }
+
+
+class Network(Policy):
+    # Deterministic actions (argmax of each categorical distribution) of a fully connected RLlib model exported by
+    # policy_export.export_checkpoint. The observations are those of the environment it was trained on: flat
+    # observations, or Dict observations flattened in the order of the keys recorded at export. The spaces are not
+    # needed, they can be None.
+    reads_padded_identification_factors: bool = True
+
+    def __init__(self, observation_space, action_space, path: str, dtype: type = np.float32):
+        super().__init__(observation_space, action_space)
+        network = load_network(path, dtype)
+        self.dtype: type = dtype
+        self.metadata: dict = network['metadata']
+        self.hidden_weights: list = network['hidden_weights']
+        self.hidden_biases: list = network['hidden_biases']
+        self.logits_weights: np.ndarray = network['logits_weights']
+        self.logits_biases: np.ndarray = network['logits_biases']
+        self.activation = ACTIVATIONS[self.metadata['activation']]
+
+        # observation_keys is None for a flat observation
+        self.observation_keys: Union[list, None] = self.metadata['observation_keys']
+        # Absent from the files exported before it was recorded
+        self.flat_observation_size: Union[int, None] = self.metadata.get('flat_observation_size')
+        # One component per action key (a single one without key for a flat action), each splitting the logits in
+        # one categorical distribution per size
+        self.action_components: list = self.metadata['action_components']
+
+    def flatten_observations(self, observations) -> np.ndarray:
+        # Batch of observations to the (number_observations, input size) input of the network
+        if self.observation_keys is None:
+            observations = np.asarray(observations, dtype=self.dtype)
+            observations = observations.reshape(len(observations), -1)
+            if self.flat_observation_size is not None and observations.shape[1] != self.flat_observation_size:
+                raise ValueError(f'The network was exported for flat observations of size '
+                                 f'{self.flat_observation_size}, not {observations.shape[1]}: the flat layout of the '
+                                 f'environment differs from the one it was trained on (see flat_spaces).')
+            return observations
+        number_observations = len(observations[self.observation_keys[0]])
+        return np.concatenate([
+            np.asarray(observations[key], dtype=self.dtype).reshape(number_observations, -1)
+            for key in self.observation_keys
+        ], axis=1)
+
+    def compute_logits(self, inputs: np.ndarray) -> np.ndarray:
+        values = inputs
+        for weights, biases in zip(self.hidden_weights, self.hidden_biases):
+            values = self.activation(values @ weights + biases)
+        return values @ self.logits_weights + self.logits_biases
+
+    def compute_actions(self, inputs: np.ndarray) -> list:
+        # One (number_observations, number of sizes) array of argmax per action component
+        logits = self.compute_logits(inputs)
+        actions = []
+        start = 0
+        for component in self.action_components:
+            argmaxes = []
+            for size in component['sizes']:
+                argmaxes.append(np.argmax(logits[:, start:start + size], axis=1))
+                start += size
+            actions.append(np.stack(argmaxes, axis=1))
+        return actions
+
+    def _format_actions(self, actions: list, index: Union[int, None]):
+        # index None for the whole batch, else the action of one observation
+        formatted_actions = {}
+        for component, component_actions in zip(self.action_components, actions):
+            values = component_actions if index is None else component_actions[index]
+            if component['kind'] == 'discrete':
+                values = values[..., 0]
+            if component['key'] is None:
+                return values
+            formatted_actions[component['key']] = values
+        return formatted_actions
+
+    def action(self, observation):
+        if self.observation_keys is None:
+            observations = np.asarray(observation)[np.newaxis]
+        else:
+            observations = {key: np.asarray(observation[key])[np.newaxis] for key in self.observation_keys}
+        return self._format_actions(self.compute_actions(self.flatten_observations(observations)), 0)
+
+    def action_batch(self, observations):
+        return self._format_actions(self.compute_actions(self.flatten_observations(observations)), None)
@@ -0,0 +1,230 @@
+import math
+from typing import Union
+
+from gymnasium.spaces import Space
+import numpy as np
+
+from environments.identification_management.Identification_management import create_message_columns
+from environments.identification_management.configuration import default_environment_configuration
+from policies.abstract import Policy
+
+
+class ResponsePatterns:
+    # Every combination of responses of the factors to one message, a pattern is encoded as the base 3 integer
+    # sum((response_i + 1) * 3 ** i). Everything that only depends on the pattern is computed once here.
+    def __init__(self, matrix_identification_factors: np.ndarray, prior_real_source: float):
+        self.number_identification_factors: int = matrix_identification_factors.shape[0]
+        self.number_patterns: int = 3 ** self.number_identification_factors
+        self.powers: np.ndarray = 3 ** np.arange(self.number_identification_factors)
+        self.empty_code: int = int(np.sum(self.powers))
+
+        codes = np.arange(self.number_patterns)
+        self.responses: np.ndarray = (codes[:, np.newaxis] // self.powers[np.newaxis, :]) % 3 - 1
+        self.number_called: np.ndarray = np.sum(self.responses != 0, axis=1)
+
+        percentage_correct_responses = matrix_identification_factors[:, 1]
+        likelihood_real_source = np.prod(np.where(
+            self.responses == 1, percentage_correct_responses,
+            np.where(self.responses == -1, 1 - percentage_correct_responses, 1.0)), axis=1)
+        likelihood_fake_source = np.prod(np.where(
+            self.responses == 1, 1 - percentage_correct_responses,
+            np.where(self.responses == -1, percentage_correct_responses, 1.0)), axis=1)
+        evidence = prior_real_source * likelihood_real_source + (1 - prior_real_source) * likelihood_fake_source
+        self.probability_real_source: np.ndarray = np.divide(
+            prior_real_source * likelihood_real_source, evidence,
+            out=np.full(self.number_patterns, 0.5), where=evidence > 0)
+
+        # Expected reward of deciding now, in units of criticality * trust
+        self.decision_gain: np.ndarray = np.abs(2 * self.probability_real_source - 1)
+
+        # Probability that factor i answers "real source" given the pattern, for the patterns where i is not called
+        self.probability_positive_response: np.ndarray = \
+            self.probability_real_source[:, np.newaxis] * percentage_correct_responses[np.newaxis, :] + \
+            (1 - self.probability_real_source[:, np.newaxis]) * (1 - percentage_correct_responses[np.newaxis, :])
+
+    def encode(self, response_identification_factors: np.ndarray) -> int:
+        return int(np.sum((np.asarray(response_identification_factors) + 1) * self.powers))
+
+
+class OptimalSolution:
+    def __init__(self, matrix_identification_factors: np.ndarray, number_messages: int, energy_step: float,
+                 energy_costs: np.ndarray, reward_scales: np.ndarray, reward_scale_weights: np.ndarray,
+                 patterns: ResponsePatterns, values: np.ndarray):
+        self.matrix_identification_factors: np.ndarray = matrix_identification_factors
+        self.number_messages: int = number_messages
+        self.energy_step: float = energy_step
+        # Energy costs of the factors in number of grid steps
+        self.energy_costs: np.ndarray = energy_costs
+        self.reward_scales: np.ndarray = reward_scales
+        self.reward_scale_weights: np.ndarray = reward_scale_weights
+        self.patterns: ResponsePatterns = patterns
+        # values[m, j]: optimal expected reward with m messages left (current one included) and energy j * energy_step
+        self.values: np.ndarray = values
+
+    @property
+    def optimal_value(self) -> float:
+        return float(self.values[self.number_messages, -1])
+
+    def energy_index(self, energy: float) -> int:
+        return min(int(math.floor(energy / self.energy_step + 1e-9)), self.values.shape[1] - 1)
+
+
+def get_default_energy_step(matrix_identification_factors: np.ndarray, maximum_energy: float,
+                            maximum_energy_grid_size: int) -> float:
+    # Largest step dividing every energy cost (to the thousandth), refined until the grid is fine enough to be useful
+    # and coarsened if it does not fit in maximum_energy_grid_size points.
+    energy_costs_thousandths = np.round(matrix_identification_factors[:, 0] * 1000).astype(np.int64)
+    energy_step = max(int(np.gcd.reduce(energy_costs_thousandths)), 1) / 1000
+    if maximum_energy / energy_step > maximum_energy_grid_size:
+        energy_step = maximum_energy / maximum_energy_grid_size
+    return energy_step
+
+
+def solve_optimal_policy(environment_configuration: Union[dict, None] = None, energy_step: Union[float, None] = None,
+                         number_reward_scales: int = 32, number_message_samples: int = 100_000,
+                         maximum_energy_grid_size: int = 5000, maximum_table_size: int = 50_000_000,
+                         seed: Union[int, None] = 0) -> OptimalSolution:
+    # Bellman recursion over (messages left, energy on a grid, responses to the current message). The only property
+    # of the message distribution that matters is the law of criticality * trust (the reward at stake, discretized
+    # into number_reward_scales equally likely values) and the prior probability of a real source, both estimated
+    # from number_message_samples draws of the message configuration.
+    if environment_configuration is None:
+        environment_configuration = {}
+    matrix_identification_factors: np.ndarray = environment_configuration.get(
+        'matrix_identification_factors', default_environment_configuration['matrix_identification_factors'])
+    number_messages: int = environment_configuration.get(
+        'number_messages', default_environment_configuration['number_messages'])
+    maximum_energy: float = environment_configuration.get(
+        'maximum_energy', default_environment_configuration['maximum_energy'])
+    message_configuration = environment_configuration.get(
+        'message_configuration', default_environment_configuration['message_configuration'])
+
+    columns = create_message_columns(message_configuration, number_message_samples, np.random.default_rng(seed))
+    prior_real_source = float(np.mean(columns['is_real_source']))
+    reward_scale_bins = np.array_split(np.sort(columns['criticality'] * columns['trust']), number_reward_scales)
+    reward_scales = np.array([np.mean(bin_reward_scales) for bin_reward_scales in reward_scale_bins])
+    reward_scale_weights = np.array([len(bin_reward_scales) for bin_reward_scales in reward_scale_bins],
+                                    dtype=np.float64) / number_message_samples
+
+    if energy_step is None:
+        energy_step = get_default_energy_step(matrix_identification_factors, maximum_energy, maximum_energy_grid_size)
+    energy_grid_size = int(math.floor(maximum_energy / energy_step + 1e-9)) + 1
+    # Costs are rounded up so that the grid never believes a factor is affordable when it is not
+    energy_costs = np.ceil(matrix_identification_factors[:, 0] / energy_step - 1e-9).astype(np.int64)
+
+    patterns = ResponsePatterns(matrix_identification_factors, prior_real_source)
+    table_size = patterns.number_patterns * energy_grid_size * number_reward_scales
+    if table_size > maximum_table_size:
+        raise ValueError(f'The solver needs a table of {table_size} values for {patterns.number_identification_factors} '
+                         f'factors and {energy_grid_size} energy levels, above maximum_table_size. Use a larger '
+                         f'energy_step or fewer reward scales.')
+
+    # Action values are laid out as a (3, ..., 3, energy, reward scale) tensor, one axis per factor (factor i on axis
+    # number_identification_factors - 1 - i, matching the pattern encoding). All the patterns sharing the same set of
+    # called factors, and their children for one more factor, are then strided views of this tensor.
+    number_identification_factors = patterns.number_identification_factors
+    pattern_shape = (3,) * number_identification_factors
+    action_values = np.empty(pattern_shape + (energy_grid_size, number_reward_scales), dtype=np.float64)
+    decision_gain = patterns.decision_gain.reshape(pattern_shape)
+    probability_positive_response = patterns.probability_positive_response.reshape(
+        pattern_shape + (number_identification_factors,))
+
+    def get_index(called_factors: tuple, index_factor: Union[int, None] = None, response: int = 0) -> tuple:
+        index = [slice(None, None, 2) if i in called_factors else 1 for i in range(number_identification_factors)]
+        if index_factor is not None:
+            index[index_factor] = response + 1
+        return tuple(reversed(index))
+
+    # Sets of called factors, the largest first: their action values are needed by the sets with one factor less
+    subsets_called_factors = sorted(
+        (tuple(i for i in range(number_identification_factors) if subset >> i & 1)
+         for subset in range(2 ** number_identification_factors)),
+        key=len, reverse=True)
+
+    values = np.zeros((number_messages + 1, energy_grid_size), dtype=np.float64)
+    for number_messages_left in range(1, number_messages + 1):
+        values_next = values[number_messages_left - 1]
+
+        for called_factors in subsets_called_factors:
+            index = get_index(called_factors)
+            subset_action_values = action_values[index]
+            np.add(decision_gain[index][..., np.newaxis, np.newaxis] * reward_scales, values_next[:, np.newaxis],
+                   out=subset_action_values)
+
+            for i in range(number_identification_factors):
+                energy_cost = energy_costs[i]
+                if i in called_factors or energy_cost >= energy_grid_size:
+                    continue
+
+                probability_positive = probability_positive_response[index + (i,)][..., np.newaxis, np.newaxis]
+                action_values_positive = action_values[get_index(called_factors, i, 1)]
+                action_values_negative = action_values[get_index(called_factors, i, -1)]
+                remaining_energy = slice(0, energy_grid_size - energy_cost)
+                calling_values = probability_positive * action_values_positive[..., remaining_energy, :] + \
+                    (1 - probability_positive) * action_values_negative[..., remaining_energy, :]
+                np.maximum(subset_action_values[..., energy_cost:, :], calling_values,
+                           out=subset_action_values[..., energy_cost:, :])
+
+        values[number_messages_left] = action_values[get_index(())] @ reward_scale_weights
+
+    return OptimalSolution(matrix_identification_factors, number_messages, energy_step, energy_costs, reward_scales,
+                           reward_scale_weights, patterns, values)
+
+
+class Optimal(Policy):
+    # Plays the solution of solve_optimal_policy, one factor at a time. The tabulated values of the next messages are
+    # looked up, only the tree of the current message is expanded for its actual criticality * trust.
+    def __init__(self, observation_space: Space, action_space: Space, solution: OptimalSolution):
+        super().__init__(observation_space, action_space)
+        self.solution: OptimalSolution = solution
+
+    def action(self, observation):
+        patterns = self.solution.patterns
+        number_messages_left = int(observation['number_messages'][0] - observation['position_current_message'][0])
+        if number_messages_left > self.solution.number_messages:
+            raise ValueError(f'The solution covers {self.solution.number_messages} messages, the episode has '
+                             f'{number_messages_left} left.')
+
+        values_next = self.solution.values[number_messages_left - 1]
+        reward_scale = float(observation['current_message_criticality'][0] * observation['current_message_trust'][0])
+        code = patterns.encode(observation['response_identification_factors'])
+        energy_index = self.solution.energy_index(float(observation['current_energy'][0]))
+
+        _, index_call = self._action_value(code, energy_index, reward_scale, values_next, {})
+
+        calling_identification_factors = np.zeros(patterns.number_identification_factors, dtype=np.int32)
+        if index_call is None:
+            is_real_source = 2 if patterns.probability_real_source[code] >= 0.5 else 0
+        else:
+            is_real_source = 1
+            calling_identification_factors[index_call] = 1
+
+        return {
+            'is_real_source': is_real_source,
+            'calling_identification_factors': calling_identification_factors,
+        }
+
+    def _action_value(self, code: int, energy_index: int, reward_scale: float, values_next: np.ndarray,
+                      memory: dict) -> tuple:
+        key = (code, energy_index)
+        if key in memory:
+            return memory[key]
+
+        patterns = self.solution.patterns
+        best_value = patterns.decision_gain[code] * reward_scale + values_next[energy_index]
+        best_index_call = None
+        for i in np.flatnonzero(patterns.responses[code] == 0):
+            energy_cost = self.solution.energy_costs[i]
+            if energy_cost > energy_index:
+                continue
+            probability_positive_response = patterns.probability_positive_response[code, i]
+            value = probability_positive_response * self._action_value(
+                code + patterns.powers[i], energy_index - energy_cost, reward_scale, values_next, memory)[0] + \
+                (1 - probability_positive_response) * self._action_value(
+                code - patterns.powers[i], energy_index - energy_cost, reward_scale, values_next, memory)[0]
+            if value > best_value:
+                best_value = value
+                best_index_call = int(i)
+
+        memory[key] = (best_value, best_index_call)
+        return memory[key]
@@ -1,4 +1,7 @@
+from typing import Union
+
 from gymnasium.spaces import Space
+import numpy as np
 
 from policies.abstract import Policy
 
@@ -7,5 +10,18 @@ class Random(Policy):
     def __init__(self, observation_space: Space, action_space: Space):
         super().__init__(observation_space, action_space)
 
+    def reset(self, seed: Union[int, None] = None):
+        super().reset(seed)
+        if seed is not None:
+            self.action_space.seed(seed)
+
     def action(self, observation):
         return self.action_space.sample()
+
+    def action_batch(self, observations):
+        number_episodes, number_factor = observations['response_identification_factors'].shape
+        return {
+            'is_real_source': self.generator.integers(0, 3, size=number_episodes),
+            'calling_identification_factors': self.generator.integers(
+                0, 2, size=(number_episodes, number_factor), dtype=np.int32),
+        }
@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+import re
+import sys
+from typing import Union
+
+import numpy as np
+
+# Exports the policy of a train_deep_policy checkpoint (RLlib fully connected torch model, fcnet_hiddens) to a single
+# .npz file read by policies.network.Network, which runs it with numpy only.
+#
+# python -m policy_export --experiment <storage_path>/<experiment name> --output policy.npz
+
+HIDDEN_LAYER_WEIGHT_PATTERN = re.compile(r'_hidden_layers\.(\d+)\._model\.0\.weight')
+
+
+def find_best_checkpoint(experiment_path: str, metric: str = 'episode_reward_mean', mode: str = 'max') -> str:
+    # Checkpoint of the best trial of a Tuner experiment, as kept by its CheckpointConfig
+    from ray.tune import ExperimentAnalysis
+
+    analysis = ExperimentAnalysis(experiment_path)
+    trial = analysis.get_best_trial(metric, mode)
+    checkpoint = analysis.get_best_checkpoint(trial, metric, mode)
+    if checkpoint is None:
+        raise ValueError(f'No checkpoint found in {experiment_path}.')
+    return checkpoint.path if hasattr(checkpoint, 'path') else str(checkpoint)
+
+
+def get_action_components(action_space) -> list:
+    # The action distribution of RLlib concatenates the logits of the sub-spaces of a Dict in the order of its keys
+    from gymnasium import spaces
+
+    if isinstance(action_space, spaces.Dict):
+        items = list(action_space.spaces.items())
+    else:
+        items = [(None, action_space)]
+
+    action_components = []
+    for key, space in items:
+        if isinstance(space, spaces.Discrete):
+            action_components.append({'key': key, 'kind': 'discrete', 'sizes': [int(space.n)]})
+        elif isinstance(space, spaces.MultiDiscrete):
+            action_components.append({'key': key, 'kind': 'multi_discrete', 'sizes': [int(n) for n in space.nvec]})
+        else:
+            raise ValueError(f'Action space {space} is not supported, only Discrete and MultiDiscrete are.')
+    return action_components
+
+
+def get_observation_keys(observation_space) -> Union[list, None]:
+    # RLlib flattens a Dict of Box observations in the order of its keys, None for a flat observation
+    from gymnasium import spaces
+
+    observation_space = getattr(observation_space, 'original_space', observation_space)
+    if not isinstance(observation_space, spaces.Dict):
+        return None
+    for key, space in observation_space.spaces.items():
+        if not isinstance(space, spaces.Box):
+            raise ValueError(f'Observation {key} ({space}) is not supported, only Box observations are.')
+    return list(observation_space.spaces)
+
+
+def get_flat_observation_size(observation_space) -> Union[int, None]:
+    # Size of a flat observation (its layout depends on the environment configuration, see flat_spaces), None for a
+    # Dict observation
+    observation_space = getattr(observation_space, 'original_space', observation_space)
+    if get_observation_keys(observation_space) is not None:
+        return None
+    return int(np.prod(observation_space.shape))
+
+
+def export_checkpoint(checkpoint_path: str, output_path: str, policy_id: str = 'default_policy') -> dict:
+    os.environ['CUDA_VISIBLE_DEVICES'] = ''
+    from ray.rllib.policy.policy import Policy as RllibPolicy
+
+    policy = RllibPolicy.from_checkpoint(checkpoint_path)
+    if isinstance(policy, dict):
+        policy = policy[policy_id]
+    weights = {name: np.asarray(value) for name, value in policy.get_weights().items()}
+    model_configuration = policy.config.get('model', {})
+
+    number_hidden_layers = len([name for name in weights if HIDDEN_LAYER_WEIGHT_PATTERN.fullmatch(name)])
+    activation = model_configuration.get('fcnet_activation', 'tanh') or 'linear'
+    if activation not in ('tanh', 'relu', 'linear'):
+        raise ValueError(f'Activation {activation} is not supported.')
+
+    metadata = {
+        'checkpoint': checkpoint_path,
+        'activation': activation,
+        'number_hidden_layers': number_hidden_layers,
+        'observation_keys': get_observation_keys(policy.observation_space),
+        'flat_observation_size': get_flat_observation_size(policy.observation_space),
+        'action_components': get_action_components(policy.action_space),
+    }
+
+    # torch Linear layers compute x @ weight.T + bias, the weights are stored transposed
+    arrays = {'metadata': np.array(json.dumps(metadata))}
+    for index in range(number_hidden_layers):
+        arrays[f'hidden_weights_{index}'] = weights[f'_hidden_layers.{index}._model.0.weight'].T
+        arrays[f'hidden_biases_{index}'] = weights[f'_hidden_layers.{index}._model.0.bias']
+    arrays['logits_weights'] = weights['_logits._model.0.weight'].T
+    arrays['logits_biases'] = weights['_logits._model.0.bias']
+
+    number_logits = sum(sum(component['sizes']) for component in metadata['action_components'])
+    if arrays['logits_biases'].shape[0] != number_logits:
+        raise ValueError(f'The model has {arrays["logits_biases"].shape[0]} logits, the action space needs '
+                         f'{number_logits}.')
+
+    np.savez(output_path, **arrays)
+    return metadata
+
+
+def main(arguments: Union[list, None] = None) -> int:
+    parser = argparse.ArgumentParser(description='Export a trained policy to a numpy-only file.')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--checkpoint', help='Checkpoint directory.')
+    source.add_argument('--experiment', help='Experiment directory, its best checkpoint is exported.')
+    parser.add_argument('--output', required=True, help='.npz file to write.')
+    parser.add_argument('--policy-id', default='default_policy')
+    parser.add_argument('--metric', default='episode_reward_mean')
+    arguments = parser.parse_args(arguments)
+
+    checkpoint_path = arguments.checkpoint
+    if checkpoint_path is None:
+        checkpoint_path = find_best_checkpoint(arguments.experiment, arguments.metric)
+    metadata = export_checkpoint(checkpoint_path, arguments.output, arguments.policy_id)
+    print(json.dumps(metadata, indent=4))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
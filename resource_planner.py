@@ -0,0 +1,213 @@
+import math
+import os
+import shutil
+import subprocess
+import time
+from typing import Union
+
+import numpy as np
+
+from environments.identification_management.configuration import MAXIMUM_NUMBER_RANDOM_MESSAGES, \
+    random_episode_configuration
+from environments.identification_management.Identification_management import IdentificationManagement
+
+# Chooses the RLlib rollout, learner and batch settings of train_deep_policy from the resources of the node. The
+# sampling is the bottleneck of PPO on this environment (small network, cheap updates): the planner gives every core
+# but the one of the driver to rollout workers, and gives each worker enough environments that the batched forward
+# pass of the policy is amortized over them. Without a GPU the learner runs on the driver (CPU-only path).
+
+# Approximate fixed cost of one forward pass of the torch policy on CPU, whatever the batch size
+POLICY_FORWARD_SECONDS = 3e-4
+MAXIMUM_ENVIRONMENTS_PER_WORKER = 32
+# Fraction of the available memory the environments may use
+MEMORY_FRACTION_ENVIRONMENTS = 0.5
+# Memory of a rollout worker process without its environments (ray, torch and the policy)
+WORKER_MEMORY_BYTES = 500 * 2 ** 20
+# Configurations drawn from a configuration_sampler whose maximum number of messages is not known
+NUMBER_SAMPLED_CONFIGURATIONS = 256
+
+
+def _read_file(path: str) -> Union[str, None]:
+    try:
+        with open(path) as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+
+def detect_number_cpus() -> int:
+    # Cores this process may run on, capped by the cgroup CPU quota of a container
+    if hasattr(os, 'sched_getaffinity'):
+        number_cpus = len(os.sched_getaffinity(0))
+    else:
+        number_cpus = os.cpu_count() or 1
+
+    cpu_max = _read_file('/sys/fs/cgroup/cpu.max')
+    if cpu_max is not None:
+        quota, period = cpu_max.split()[:2]
+        if quota != 'max':
+            number_cpus = min(number_cpus, max(1, math.floor(int(quota) / int(period))))
+    return number_cpus
+
+
+def detect_available_memory_bytes() -> Union[int, None]:
+    available_memory_bytes = None
+    meminfo = _read_file('/proc/meminfo')
+    if meminfo is not None:
+        for line in meminfo.splitlines():
+            if line.startswith('MemAvailable:'):
+                available_memory_bytes = int(line.split()[1]) * 1024
+    elif hasattr(os, 'sysconf') and 'SC_AVPHYS_PAGES' in os.sysconf_names:
+        available_memory_bytes = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
+    memory_max = _read_file('/sys/fs/cgroup/memory.max')
+    memory_current = _read_file('/sys/fs/cgroup/memory.current')
+    if memory_max is not None and memory_max != 'max' and memory_current is not None:
+        cgroup_available_memory_bytes = int(memory_max) - int(memory_current)
+        if available_memory_bytes is None or cgroup_available_memory_bytes < available_memory_bytes:
+            available_memory_bytes = cgroup_available_memory_bytes
+    return available_memory_bytes
+
+
+def detect_number_gpus() -> int:
+    # Without importing torch: CUDA_VISIBLE_DEVICES when it is set, else nvidia-smi
+    visible_devices = os.environ.get('CUDA_VISIBLE_DEVICES')
+    if visible_devices is not None:
+        return len([device for device in visible_devices.split(',') if device.strip() not in ('', '-1')])
+    if shutil.which('nvidia-smi') is None:
+        return 0
+    try:
+        output = subprocess.run(['nvidia-smi', '-L'], capture_output=True, text=True, timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return 0
+    return len([line for line in output.splitlines() if line.startswith('GPU ')])
+
+
+def detect_resources() -> dict:
+    return {
+        'number_cpus': detect_number_cpus(),
+        'available_memory_bytes': detect_available_memory_bytes(),
+        'number_gpus': detect_number_gpus(),
+    }
+
+
+def get_maximum_number_messages(environment_configuration: dict) -> int:
+    # Longest episode in messages. With a configuration_sampler, the maximum of random_episode_configuration, or the
+    # largest number_messages of NUMBER_SAMPLED_CONFIGURATIONS seeded draws of any other sampler. A streaming
+    # environment without number_messages is counted with episodes of message_read_ahead messages.
+    number_messages = environment_configuration.get('number_messages') or \
+        environment_configuration.get('message_read_ahead', 1024)
+    configuration_sampler = environment_configuration.get('configuration_sampler')
+    if configuration_sampler is None:
+        return number_messages
+    if configuration_sampler is random_episode_configuration:
+        return MAXIMUM_NUMBER_RANDOM_MESSAGES
+    generator = np.random.default_rng(0)
+    return max(configuration_sampler(generator).get('number_messages', number_messages)
+               for _ in range(NUMBER_SAMPLED_CONFIGURATIONS))
+
+
+def measure_environment(environment_configuration: dict, number_steps: int = 2000) -> dict:
+    # Seconds per step and approximate memory of one environment, to size the rollout workers. The steps alternate a
+    # call of the cheapest factor and a decision, as the heuristic policies do.
+    environment = IdentificationManagement(dict(environment_configuration, seed=0, render_mode=None, flat_spaces=False))
+    number_factors = environment.number_observed_identification_factors
+    index_cheapest_factor = int(np.argmin(environment.matrix_identification_factors[:, 0]))
+    cheapest_energy_cost = environment.matrix_identification_factors[index_cheapest_factor, 0]
+    calling_cheapest_factor = np.zeros(number_factors, dtype=np.int32)
+    calling_cheapest_factor[index_cheapest_factor] = 1
+    calling_action = {'is_real_source': 1, 'calling_identification_factors': calling_cheapest_factor}
+    deciding_action = {'is_real_source': 2, 'calling_identification_factors': np.zeros(number_factors, dtype=np.int32)}
+
+    environment.reset()
+    start = time.perf_counter()
+    for index_step in range(number_steps):
+        is_calling = index_step % 2 == 0 and environment.current_energy >= cheapest_energy_cost
+        _, _, terminated, truncated, _ = environment.step(calling_action if is_calling else deciding_action)
+        if terminated or truncated:
+            environment.reset()
+    seconds_per_step = (time.perf_counter() - start) / number_steps
+
+    number_messages = get_maximum_number_messages(environment_configuration)
+    # Message columns, factor outcome uniforms and a margin for the Python objects
+    memory_bytes = number_messages * (8 + 8 + 1) + environment.factor_outcome_uniforms.nbytes + 2 ** 16
+    environment.close()
+    return {'seconds_per_step': seconds_per_step, 'memory_bytes': memory_bytes}
+
+
+def plan_resources(environment_configuration: dict, resources: Union[dict, None] = None, cpu_only: bool = False,
+                   environment_measure: Union[dict, None] = None, minimum_train_batch_size: int = 8000,
+                   maximum_train_batch_size: int = 100_000) -> dict:
+    if resources is None:
+        resources = detect_resources()
+    if environment_measure is None:
+        environment_measure = measure_environment(environment_configuration)
+    number_cpus = resources['number_cpus']
+    number_gpus = 0 if cpu_only else resources['number_gpus']
+
+    # One core for the driver (and the learner without GPU), one per learner worker and per evaluation worker, the
+    # others sample
+    number_learner_workers = number_gpus if number_gpus > 1 else 0
+    number_evaluation_workers = 0 if number_cpus <= 2 else 1
+    number_rollout_workers = max(0, number_cpus - 1 - number_learner_workers - number_evaluation_workers)
+
+    # Enough environments per worker that stepping them takes about as long as the forward pass of the policy
+    number_environments_per_worker = math.ceil(POLICY_FORWARD_SECONDS / environment_measure['seconds_per_step'])
+    number_environments_per_worker = int(np.clip(number_environments_per_worker, 1, MAXIMUM_ENVIRONMENTS_PER_WORKER))
+    available_memory_bytes = resources['available_memory_bytes']
+    if available_memory_bytes is not None:
+        memory_environments_bytes = MEMORY_FRACTION_ENVIRONMENTS * available_memory_bytes - \
+            max(1, number_rollout_workers) * WORKER_MEMORY_BYTES
+        maximum_environments_per_worker = int(
+            memory_environments_bytes // (max(1, number_rollout_workers) * environment_measure['memory_bytes']))
+        number_environments_per_worker = max(1, min(number_environments_per_worker, maximum_environments_per_worker))
+
+    # complete_episodes: every environment of every worker brings at least one whole episode per training batch, the
+    # longest one included, the number of environments is bounded so that the batch stays under
+    # maximum_train_batch_size
+    maximum_episode_length = 2 * get_maximum_number_messages(environment_configuration)
+    number_environments_per_worker = max(1, min(number_environments_per_worker, maximum_train_batch_size // (
+        max(1, number_rollout_workers) * maximum_episode_length)))
+    number_sampling_environments = max(1, number_rollout_workers) * number_environments_per_worker
+    train_batch_size = max(minimum_train_batch_size, number_sampling_environments * maximum_episode_length)
+
+    plan = {
+        'number_cpus': number_cpus,
+        'number_gpus': number_gpus,
+        'num_rollout_workers': number_rollout_workers,
+        'num_envs_per_worker': number_environments_per_worker,
+        'num_cpus_per_worker': 1,
+        'num_gpus_per_worker': 0,
+        'train_batch_size': train_batch_size,
+        'sgd_minibatch_size': min(4096, train_batch_size),
+        'evaluation_num_workers': number_evaluation_workers,
+    }
+    if number_gpus > 1:
+        # One learner worker per GPU, the driver keeps none (Ray could not place number_gpus + 1 GPUs)
+        plan.update({
+            'num_gpus': 0,
+            'num_learner_workers': number_learner_workers,
+            'num_gpus_per_learner_worker': 1,
+            'num_cpus_per_learner_worker': 1,
+        })
+    elif number_gpus == 1:
+        # The learner updates on the driver, with the GPU
+        plan.update({
+            'num_gpus': 1,
+            'num_learner_workers': 0,
+            'num_gpus_per_learner_worker': 0,
+            'num_cpus_per_learner_worker': 1,
+        })
+    else:
+        # The learner updates on the driver
+        plan.update({
+            'num_gpus': 0,
+            'num_learner_workers': 0,
+            'num_gpus_per_learner_worker': 0,
+            'num_cpus_per_learner_worker': 1,
+        })
+    # Upper bound of the sampling throughput: each worker steps its environments then runs one forward pass for all
+    # of them, without the other overheads of RLlib
+    plan['maximum_environment_steps_per_second'] = max(1, number_rollout_workers) * number_environments_per_worker / (
+        number_environments_per_worker * environment_measure['seconds_per_step'] + POLICY_FORWARD_SECONDS)
+    return plan
@@ -0,0 +1,33 @@
+import numpy as np
+
+from environments.identification_management.configuration import default_environment_configuration, \
+    random_episode_configuration
+from environments.identification_management.flat_spaces import flatten_action, flatten_observation, \
+    unflatten_observation
+from environments.identification_management.Identification_management import IdentificationManagement
+
+
+def test_flat_observation_of_sampled_configurations():
+    environment_configuration = dict(default_environment_configuration,
+                                     configuration_sampler=random_episode_configuration,
+                                     maximum_number_identification_factors=10)
+    flat_environment = IdentificationManagement(dict(environment_configuration, flat_spaces=True))
+    environment = IdentificationManagement(environment_configuration)
+    for seed in range(4):
+        flat_observation, _ = flat_environment.reset(seed=seed)
+        observation, _ = environment.reset(seed=seed)
+        for _ in range(3):
+            assert flat_environment.observation_space.contains(flat_observation)
+            np.testing.assert_array_equal(flat_observation,
+                                          flatten_observation(observation, environment.maximum_energy, True))
+            # maximum_energy is the last value, the mask is before it
+            assert flat_observation[-1] == np.float32(environment.maximum_energy)
+            assert flat_observation[-11:-1].sum() == environment.number_identification_factors
+            unflattened_observation = unflatten_observation(flat_observation, environment.matrix_identification_factors,
+                                                            None, environment.number_messages)
+            np.testing.assert_allclose(unflattened_observation['current_energy'], observation['current_energy'],
+                                       rtol=1e-5)
+
+            action = {'is_real_source': 2, 'calling_identification_factors': np.zeros(10, dtype=np.int64)}
+            flat_observation = flat_environment.step(flatten_action(action))[0]
+            observation = environment.step(action)[0]
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from environments.identification_management.configuration import default_environment_configuration
+from offline_dataset import generate_dataset, load_shard
+from policies.voracious import Voracious
+
+
+def test_generate_dataset_rejects_no_episode(tmp_path):
+    with pytest.raises(ValueError):
+        generate_dataset(dict(default_environment_configuration), Voracious, str(tmp_path), 0)
+
+
+def test_rllib_shard_is_read_back_by_rllib(tmp_path):
+    pytest.importorskip('ray.rllib')
+    from ray.rllib.offline.json_reader import JsonReader
+
+    environment_configuration = dict(default_environment_configuration, number_messages=30)
+    generate_dataset(environment_configuration, Voracious, str(tmp_path / 'npy'), 2, seed=0, number_processes=1)
+    generate_dataset(environment_configuration, Voracious, str(tmp_path / 'rllib'), 2, seed=0,
+                     dataset_format='rllib', number_processes=1)
+
+    # JsonReader is the input train_deep_policy gives to the behaviour cloning
+    reader = JsonReader(str(tmp_path / 'rllib' / 'shard_*' / '*.json'))
+    batches = [reader.next() for _ in range(2)]
+    shard = load_shard(str(tmp_path / 'npy' / 'shard_00000'))
+    for column in ('obs', 'new_obs', 'actions', 'rewards', 'terminateds'):
+        read_values = np.concatenate([
+            batch[column] for batch in sorted(batches, key=lambda batch: batch['eps_id'][0])])
+        np.testing.assert_array_equal(read_values, shard[column])
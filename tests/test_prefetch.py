@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from environments.identification_management.configuration import default_environment_configuration
+from environments.identification_management.Identification_management import IdentificationManagement
+from evaluation import play_episode
+from policies.combination import Combination
+
+# None resets without seed, 'schedule' schedules the seeds 11, 12 and 13, an integer resets with this seed
+RESET_SEQUENCES = [
+    [None, 'schedule', None, None],
+    [None, None, 'schedule', 11, None, 7, None, 'schedule', 11, 12, None, None],
+    ['schedule', 11, 12, 13, None, None, 5, None],
+    [3, None, 'schedule', 12, 11, None, None],
+]
+
+
+def play_reset_sequence(prefetch_episodes: int, reset_sequence: list) -> list:
+    environment_configuration = dict(default_environment_configuration, number_messages=50, maximum_energy=10,
+                                     seed=5, prefetch_episodes=prefetch_episodes)
+    environment = IdentificationManagement(environment_configuration)
+    policy = Combination(environment.observation_space, environment.action_space)
+    rewards = []
+    for reset in reset_sequence:
+        if reset == 'schedule':
+            environment.schedule_episode_seeds([11, 12, 13])
+        else:
+            rewards.append(play_episode(environment, policy, reset))
+    environment.close()
+    return rewards
+
+
+@pytest.mark.parametrize('reset_sequence', RESET_SEQUENCES)
+@pytest.mark.parametrize('prefetch_episodes', [1, 4])
+def test_prefetch_plays_the_same_episodes(reset_sequence: list, prefetch_episodes: int):
+    np.testing.assert_array_equal(play_reset_sequence(prefetch_episodes, reset_sequence),
+                                  play_reset_sequence(0, reset_sequence))
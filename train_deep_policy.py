@@ -1,13 +1,84 @@
+import os
+from typing import Union
+
 import gymnasium
 import ray
 from ray.rllib.algorithms.ppo import PPOConfig
 from environments.register_environments import register_environments
 from ray import air, tune
 from ray.rllib.algorithms import AlgorithmConfig
+from ray.rllib.algorithms.bc import BCConfig
+from ray.rllib.algorithms.callbacks import DefaultCallbacks
 from ray.rllib.algorithms.ppo import PPOConfig, PPO
+from resource_planner import plan_resources
+
+# Same network for the behaviour cloning and PPO, so that the cloned weights initialize PPO
+MODEL_CONFIGURATION = {'fcnet_hiddens': [248, 248, 248, 248], 'vf_share_layers': False}
+
+
+class ThroughputReporter(tune.Callback):
+    # Prints the sampling and learning throughput of every training iteration
+    def on_trial_result(self, iteration, trials, trial, result, **info):
+        sampled = result.get('num_env_steps_sampled_throughput_per_sec')
+        trained = result.get('num_env_steps_trained_throughput_per_sec')
+        if sampled is None or trained is None:
+            return
+        print(f'Iteration {result.get("training_iteration")}: {sampled:.0f} env steps sampled / s, '
+              f'{trained:.0f} env steps trained / s, episode reward mean {result.get("episode_reward_mean")}')
+
+
+def create_initial_weights_callbacks(weights: dict) -> type:
+    # Callbacks class (RLlib instantiates it) setting the weights of the policy when the algorithm is built
+    class InitialWeightsCallbacks(DefaultCallbacks):
+        def on_algorithm_init(self, *, algorithm, **kwargs):
+            algorithm.get_policy().set_weights(weights)
+            algorithm.workers.sync_weights()
+
+    return InitialWeightsCallbacks
+
+
+def clone_behaviour(environment_name: str, environment_configuration: dict, offline_dataset: str,
+                    number_iterations: int) -> dict:
+    # Weights of the policy trained by behaviour cloning (RLlib's BC, supervised on the logged actions) on the
+    # transitions of offline_dataset, read by RLlib's JsonReader. The environment only gives the spaces.
+    algorithm_configuration: AlgorithmConfig = (
+        BCConfig()
+        .environment(env=environment_name, env_config=environment_configuration)
+        .framework('torch')
+        .training(model=MODEL_CONFIGURATION)
+        .offline_data(input_=os.path.join(offline_dataset, 'shard_*', '*.json'))
+        .rollouts(num_rollout_workers=0)
+        .evaluation(evaluation_interval=None)
+        # The model of PPO (and of policy_export), not the RLModule BC uses by default
+        .experimental(_enable_new_api_stack=False)
+    )
+    algorithm = algorithm_configuration.build()
+    for _ in range(number_iterations):
+        result = algorithm.train()
+        print(f'Behaviour cloning iteration {result.get("training_iteration")}: '
+              f'{result.get("num_env_steps_trained")} env steps trained')
+    weights = algorithm.get_policy().get_weights()
+    algorithm.stop()
+    return weights
 
 
-def train_deep_policy(environment_name: str, environment_configuration: dict):
+def train_deep_policy(environment_name: str, environment_configuration: dict,
+                      offline_dataset: Union[str, None] = None, behaviour_cloning_iterations: int = 50,
+                      storage_path: Union[str, None] = None, resource_plan: Union[dict, None] = None,
+                      cpu_only: bool = False):
+    # offline_dataset: directory of a dataset generated by offline_dataset.generate_dataset with the 'rllib' format.
+    # The policy is first trained on it by behaviour cloning for behaviour_cloning_iterations iterations, PPO then
+    # starts from the cloned weights and only samples the environment (PPO itself is on-policy, the logged actions
+    # of the heuristic policies are not valid samples for its importance ratio). The dataset holds flat observations
+    # and actions, the environment configuration must set flat_spaces.
+    # storage_path: where the results and checkpoints are written, ./results by default.
+    # resource_plan: rollout, learner and batch settings, planned from the resources of the node when not given (see
+    # resource_planner), without GPU when cpu_only.
+    if storage_path is None:
+        storage_path = os.path.join(os.getcwd(), 'results')
+    if resource_plan is None:
+        resource_plan = plan_resources(environment_configuration, cpu_only=cpu_only)
+    print(f'Resource plan: {resource_plan}')
 
     # register_environments()
     # config = (  # 1. Configure the algorithm,
@@ -26,7 +97,7 @@ def train_deep_policy(environment_name: str, environment_configuration: dict):
     #
     # algo.evaluate()
 
-    ray.init(local_mode=False)
+    ray.init(local_mode=False, num_cpus=resource_plan['number_cpus'], num_gpus=resource_plan['number_gpus'])
     register_environments()
 
     algorithm_configuration: AlgorithmConfig = (
@@ -34,30 +105,36 @@ def train_deep_policy(environment_name: str, environment_configuration: dict):
         .environment(env=environment_name, env_config=environment_configuration)
         .framework('torch')
         .training(
-            model={"fcnet_hiddens": [248, 248, 248, 248]},
-            train_batch_size=8000,
+            model=MODEL_CONFIGURATION,
+            train_batch_size=resource_plan['train_batch_size'],
+            sgd_minibatch_size=resource_plan['sgd_minibatch_size'],
         )
         .rollouts(
-            num_rollout_workers=2,
+            num_rollout_workers=resource_plan['num_rollout_workers'],
+            num_envs_per_worker=resource_plan['num_envs_per_worker'],
             batch_mode='complete_episodes'
         )
         .resources(
-            num_gpus=1,
-            num_learner_workers=3,
-            num_cpus_per_worker=1,
-            num_gpus_per_worker=0,
-            # num_cpus_per_learner_worker=2,
-            num_gpus_per_learner_worker=0.3,
+            num_gpus=resource_plan['num_gpus'],
+            num_learner_workers=resource_plan['num_learner_workers'],
+            num_cpus_per_worker=resource_plan['num_cpus_per_worker'],
+            num_gpus_per_worker=resource_plan['num_gpus_per_worker'],
+            num_cpus_per_learner_worker=resource_plan['num_cpus_per_learner_worker'],
+            num_gpus_per_learner_worker=resource_plan['num_gpus_per_learner_worker'],
         )
-        .evaluation(evaluation_num_workers=1)
+        .evaluation(evaluation_num_workers=resource_plan['evaluation_num_workers'])
     )
+    if offline_dataset is not None:
+        weights = clone_behaviour(environment_name, environment_configuration, offline_dataset,
+                                  behaviour_cloning_iterations)
+        algorithm_configuration = algorithm_configuration.callbacks(create_initial_weights_callbacks(weights))
 
     tuner = tune.Tuner(
         trainable=PPO,
         param_space=algorithm_configuration,
         run_config=air.RunConfig(
             name='exp_debug',
-            storage_path='/home/maxalaar/PycharmProjects/Marc_Project/results',
+            storage_path=storage_path,
             stop={
                 'time_total_s': 60 * 60 * 5,
                 # 'episode_reward_mean': 0.95,
@@ -68,7 +145,8 @@ def train_deep_policy(environment_name: str, environment_configuration: dict):
                 checkpoint_score_order='max',
                 checkpoint_frequency=10,
                 checkpoint_at_end=True,
-            )
+            ),
+            callbacks=[ThroughputReporter()],
         ),
     )
 